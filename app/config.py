@@ -1,3 +1,5 @@
+import os
+
 #
 # If a page doesn't exist in some location, or is not specified,
 # use the following page name.
@@ -32,3 +34,204 @@ DEFAULT_ENCODING = "utf-8"
 # Number of document revisions to keep
 #
 PAGE_REVISION_HISTORY_COUNT = 30
+
+#
+# Responses smaller than this many bytes are sent uncompressed.
+# Larger html responses are gzip'd, or brotli'd if the brotli package is installed.
+#
+COMPRESSION_MINIMUM_SIZE = 500
+
+#
+# gzip level (1-9) for dynamic responses.  Static files in the template
+# folder are precompressed once at startup at the highest level.
+#
+COMPRESSION_LEVEL = 6
+
+#
+# Send big pages and the /index/ tree as streamed responses, so the
+# browser gets the first bytes early and the server doesn't hold
+# several full copies of the page in memory.
+#
+STREAMING_RESPONSES = True
+
+#
+# Rendered pages with at least this many characters of html get streamed.
+# Smaller pages are sent in one piece.
+#
+STREAMING_MINIMUM_SIZE = 256 * 1024
+
+#
+# Size of each streamed piece, in characters.
+#
+STREAMING_CHUNK_SIZE = 64 * 1024
+
+#
+# The /index/ tree is converted to html this many list lines at a time.
+#
+INDEX_BATCH_LINES = 400
+
+#
+# Enable /debug/profile/<page>, which renders a page with every markdown
+# preprocessor, block processor, inline pattern, treeprocessor and
+# postprocessor timed.  Add ?cprofile=1 for a cProfile summary, or
+# ?cprofile=dump to download a .prof file for snakeviz or flameprof.
+# Leave off unless you're looking for a slow page.
+#
+PROFILING_ENABLED = False
+
+#
+# Where the jupyter-server lives.  The default is the service in
+# docker-compose.yml, override with the JUPYTER_HOST environment variable,
+# e.g. JUPYTER_HOST=http://127.0.0.1:8888 for a local server or the fake
+# one in bench/fake_jupyter.py.  The websocket url is derived from it.
+#
+JUPYTER_HOST = os.environ.get("JUPYTER_HOST", "http://jupyter:8888").rstrip("/")
+JUPYTER_WS = os.environ.get(
+    "JUPYTER_WS", "ws" + JUPYTER_HOST[len("http") :]
+).rstrip("/")
+
+#
+# Which kernel backend runs ```jupyter cells.
+#   "server"  a jupyter-server (the docker-compose service) at JUPYTER_HOST
+#   "local"   kernels started in this container with jupyter_client,
+#             talked to directly over ZMQ.  Needs ipykernel installed,
+#             and no jupyter service in docker-compose.yml.
+#
+JUPYTER_BACKEND = os.environ.get("JUPYTER_BACKEND", "server")
+
+#
+# Kernel spec used by the local backend.
+#
+JUPYTER_KERNEL_NAME = os.environ.get("JUPYTER_KERNEL_NAME", "python3")
+
+#
+# Where the wiki keeps state shared between uvicorn workers, such as
+# the page to kernel registry.  Relative to the app directory.
+#
+STATE_DIRECTORY = os.environ.get("PYMDWIKI_STATE_DIRECTORY", ".state")
+
+#
+# Keep the page to kernel mapping in a SQLite file in STATE_DIRECTORY
+# instead of in memory, so `uvicorn --workers N` shares one kernel per
+# page and only one worker runs the kernel reaper.
+# Only used by the "server" backend, local kernels belong to the worker
+# that started them.
+#
+SHARED_KERNEL_REGISTRY = True
+
+#
+# Cache rendered pages, wikilink existence checks and code highlighting
+# in a SQLite file in STATE_DIRECTORY, shared by every uvicorn worker.
+# Entries are checked against the file's mtime and size, and saves and
+# deletes in any worker invalidate them.
+#
+RENDER_CACHE = True
+
+#
+# Add up the metrics of every uvicorn worker in /metrics: each worker
+# writes its counts to a SQLite file in STATE_DIRECTORY every
+# METRICS_FLUSH_INTERVAL seconds, and the one answering the scrape adds
+# them up.  With False each worker answers with its own counts only, so
+# scrape every worker (one port each) rather than through --workers N.
+#
+SHARED_METRICS = True
+METRICS_FLUSH_INTERVAL = 5
+
+#
+# Entries kept in the shared cache file, oldest are dropped first,
+# and the size of each worker's in-memory copy of the hot entries.
+#
+CACHE_MAX_ENTRIES = 10000
+CACHE_MEMORY_BYTES = 64 * 1024 * 1024
+
+#
+# Starlette debug mode, tracebacks in the browser.  The production
+# compose file turns it off with PYMDWIKI_DEBUG=0.
+#
+DEBUG = os.environ.get("PYMDWIKI_DEBUG", "1") != "0"
+
+#
+# Watch the wiki directory for changes made outside the app, e.g. in
+# Obsidian on the host, to keep caches honest and reload open pages.
+# CHANGE_FEED_MODE is "auto" (inotify if it works, else polling),
+# "inotify" or "poll".  Docker Desktop bind mounts on Windows and macOS
+# don't pass inotify events through, use "poll" there.
+#
+CHANGE_FEED = True
+CHANGE_FEED_MODE = os.environ.get("PYMDWIKI_CHANGE_FEED_MODE", "auto")
+CHANGE_FEED_POLL_INTERVAL = 2.0
+
+#
+# Seconds a burst of file events has to be quiet before it's handed on,
+# so a sync touching many files is one update instead of hundreds.
+#
+CHANGE_FEED_DEBOUNCE = 0.25
+
+#
+# Parsed urls and file paths remembered, per kind.  Every wikilink on a
+# page and every file in the index is parsed, mostly the same ones.
+#
+PAGE_PATH_CACHE_SIZE = 16384
+
+#
+# Widths of the resized copies offered in an embedded image's srcset,
+# only those narrower than the image are used.  Needs Pillow installed,
+# without it images get width/height and lazy loading only.
+#
+IMAGE_VARIANT_WIDTHS = [480, 960, 1600]
+
+#
+# How wide images are drawn, for the browser to pick from the srcset.
+# Matches #document's width in the default template.
+#
+IMAGE_SIZES = "(max-width: 816px) 99vw, 800px"
+
+#
+# Disk space for the resized copies in STATE_DIRECTORY, least recently
+# used are deleted first.
+#
+IMAGE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+#
+# Most pages a ```query block lists, whatever its LIMIT says.
+#
+QUERY_RESULT_LIMIT = 1000
+
+#
+# How much of the top of a page is read for its title and summary in
+# listings, instead of rendering it.  Enough for the meta header and the
+# first heading and paragraph.
+#
+PAGE_HEADER_BYTES = 16 * 1024
+
+#
+# How deep ![[Page]] embeds can nest, a page embedding a page embedding
+# a page...  Deeper ones, and a page embedding itself, show a note.
+#
+TRANSCLUSION_MAX_DEPTH = 4
+
+#
+# Processes reading pages when the page index is built or caught up with
+# a lot of changes at startup, 0 for one per CPU, 1 to read them in the
+# server's own process.
+#
+INDEX_WORKERS = 0
+
+#
+# How many related pages are listed under each page, by the words they
+# share and the pages they both link to.  0 for none.
+#
+RELATED_PAGES = 8
+
+#
+# How much of a related page's score comes from links rather than words,
+# between 0 and 1.
+#
+RELATED_LINK_WEIGHT = 0.3
+
+#
+# Follow wiki links without reloading the whole page: the template's
+# router fetches /api/page/ for the new page's content and swaps it in,
+# fetching links as soon as they're hovered.
+#
+CLIENT_ROUTER = True
@@ -1,12 +1,18 @@
+# first, so the startup report can time everything imported below
+from src.startup import startup, import_time_report
+
 from starlette.applications import Starlette
 from starlette.responses import (
     HTMLResponse,
     RedirectResponse,
     FileResponse,
     JSONResponse,
+    StreamingResponse,
+    Response,
 )
 from starlette.exceptions import HTTPException
 from starlette.routing import Route
+from starlette.middleware import Middleware
 
 from starlette.requests import Request
 
@@ -19,13 +25,12 @@ import datetime
 # from jinja2 import Template
 from jinja2 import Environment, FileSystemLoader
 
-import httpx
-
 import json
-from urllib.parse import unquote
+from urllib.parse import quote
 from pathlib import Path
 import os
 from pathlib import PurePosixPath
+import posixpath
 import glob
 
 import markdown
@@ -36,10 +41,37 @@ from config import (
     DIRECTORY_AS_MD_FILE_LINK,
     HIDE_DOT_DIRECTORY,
     DEFAULT_ENCODING,
+    COMPRESSION_MINIMUM_SIZE,
+    COMPRESSION_LEVEL,
+    STREAMING_RESPONSES,
+    STREAMING_MINIMUM_SIZE,
+    STREAMING_CHUNK_SIZE,
+    INDEX_BATCH_LINES,
+    PROFILING_ENABLED,
+    STATE_DIRECTORY,
+    RENDER_CACHE,
+    CACHE_MAX_ENTRIES,
+    CACHE_MEMORY_BYTES,
+    DEBUG,
+    CHANGE_FEED,
+    CHANGE_FEED_MODE,
+    CHANGE_FEED_POLL_INTERVAL,
+    CHANGE_FEED_DEBOUNCE,
+    IMAGE_VARIANT_WIDTHS,
+    IMAGE_SIZES,
+    IMAGE_CACHE_MAX_BYTES,
+    QUERY_RESULT_LIMIT,
+    PAGE_HEADER_BYTES,
+    TRANSCLUSION_MAX_DEPTH,
+    INDEX_WORKERS,
+    RELATED_PAGES,
+    RELATED_LINK_WEIGHT,
+    CLIENT_ROUTER,
+    SHARED_METRICS,
+    METRICS_FLUSH_INTERVAL,
 )
 
 # these aren't configurable
-RESERVED_PATHS = ["wiki", "edit", "save", "delete", "index"]
 FILE_PATH = "wiki"
 
 os.makedirs(FILE_PATH, exist_ok=True)
@@ -51,10 +83,63 @@ from src.markdown_extensions import (
     AutoLinkExtension,
     ImageEmbedExtension,
     WikiLinkExtension,
+    TransclusionExtension,
+    normalize_page_name,
+    normalize_anchor,
+    extract_section,
+    namespace_ids,
 )
 
 from src.jupyter_extension import JupyterCellExtension
+from src.query_extension import QueryBlockExtension
+from src.page_path import parse_url_path, parse_file_path
+from src.media import image_size, can_resize, VariantCache
+from src.attachments import attachment_response
+from src.compression import (
+    CompressionMiddleware,
+    precompress_directory,
+    static_file_response,
+)
+from src.streaming import stream_template
+from src.metrics import (
+    MetricsMiddleware,
+    metrics_endpoint,
+    registry as metrics_registry,
+    stage,
+    timed_callback,
+)
+from src.kernel_registry import WORKER_ID
+from src.profiler import (
+    MarkdownProfile,
+    cprofile_convert,
+    cprofile_dump,
+    cprofile_summary,
+)
+from src.shared_cache import (
+    SharedCache,
+    ExistenceIndex,
+    code_fingerprint,
+    install_highlight_cache,
+)
+from src.change_feed import ChangeFeed, LiveReload
+from src.page_index import PageIndex, page_header, page_headings
+from src.related import RelatedPages
+from src.completion import PageCompleter
+from src.rename import RenameError, rename, recover as recover_rename
+from src.saving import PageLocks, remove_temporary_files, write_atomic
+from src.sections import (
+    PatchError,
+    StaleRevision,
+    apply_patch,
+    join_lines,
+    revision as page_revision,
+    section_lines,
+    split_lines,
+)
+
+import pygments
 
+startup.mark("imports")
 
 MD_EXTENSIONS = [
     LaTeXExtension(),
@@ -70,9 +155,11 @@ MD_EXTENSIONS = [
     "sane_lists",
     "smarty",
     "toc",
-    ImageEmbedExtension(),
+    # ImageEmbedExtension(), specified below with parameters
     AutoLinkExtension(),
     # WikiLinkExtension(), specified below with parameters
+    # QueryBlockExtension(), specified below with parameters
+    # TransclusionExtension(), specified below with parameters
     #
     JupyterCellExtension(),
 ]
@@ -145,66 +232,89 @@ MD_EXTENSION_CONFIG = {
     },
 }
 
+# rendered pages, wikilink existence and highlighting, shared by all workers
+if RENDER_CACHE:
+    shared_cache = SharedCache(
+        os.path.join(STATE_DIRECTORY, "render_cache.sqlite3"),
+        max_entries=CACHE_MAX_ENTRIES,
+        memory_bytes=CACHE_MEMORY_BYTES,
+    )
+    existence_index = ExistenceIndex(shared_cache)
+    # html rendered by older code or config is stale too
+    source_directory = os.path.dirname(os.path.abspath(__file__))
+    CODE_FINGERPRINT = code_fingerprint(
+        [
+            os.path.join(source_directory, "main.py"),
+            os.path.join(source_directory, "config.py"),
+            *glob.glob(os.path.join(source_directory, "src", "*.py")),
+        ],
+        extra=[markdown.__version__, pygments.__version__],
+    )
+else:
+    shared_cache = None
+    existence_index = None
+
+# /metrics counts every worker's requests, not just its own
+if SHARED_METRICS:
+    metrics_registry.share(
+        os.path.join(STATE_DIRECTORY, "metrics.sqlite3"),
+        WORKER_ID,
+        flush_interval=METRICS_FLUSH_INTERVAL,
+    )
 
-def parse_url_path(path):
-    """helper to break url into some commonly used components"""
-    path = unquote(path)
-    while ".." in path:
-        path = path.replace("..", "")
-    while "\\" in path:
-        path = path.replace("\\", "/")
-    while "//" in path:
-        path = path.replace("//", "/")
-    path_split = path.split("/")
-    path_split = [each for each in path_split if each]
-
-    if path_split and path_split[0] in RESERVED_PATHS:
-        path_split.pop(0)
-
-    if path_split:
-        file_name = path_split.pop()
-        if len(path_split) == 0:
-            path_split = [""]
-        file_name_parts = file_name.split(".")
-        if len(file_name_parts) > 1:
-            if file_name_parts[0]:
-                file_ext = file_name_parts.pop()
-                file_name_no_ext = file_name[: -1 - len(file_ext)]
-            else:
-                # could be .hidden.md  ['', 'hidden', 'md']
-                # or .hidden  ['', 'hidden']
-                if len(file_name_parts) == 2:
-                    file_ext = ""
-                    file_name_no_ext = file_name
-                else:
-                    file_ext = file_name_parts.pop()
-                    file_name_no_ext = ".".join(file_name_parts)
-        else:
-            file_ext = ""
-            file_name_no_ext = file_name
-    else:
-        path_split = [""]
-        file_name = DEFAULT_WIKI_PAGE
-        file_ext = ""
-        file_name_no_ext = DEFAULT_WIKI_PAGE
-
-    response = {
-        "path": "/".join(path_split),
-        "path_list": path_split,
-        "file_name": file_name,
-        "file_ext": file_ext,
-        "file_name_no_ext": file_name_no_ext,
-    }
-    return response
+# file changes made outside the app, started in lifespan.
+# anything that needs to know can subscribe.
+change_feed = ChangeFeed(
+    FILE_PATH,
+    mode=CHANGE_FEED_MODE,
+    debounce=CHANGE_FEED_DEBOUNCE,
+    poll_interval=CHANGE_FEED_POLL_INTERVAL,
+    include_hidden=not HIDE_DOT_DIRECTORY,
+)
+live_reload = LiveReload()
+change_feed.subscribe(live_reload.publish)
+
+# meta headers of every page, for ```query blocks.  Built in the
+# background at startup, then kept up to date on saves and changes.
+page_index = PageIndex(
+    os.path.join(STATE_DIRECTORY, "page_index.sqlite3"),
+    FILE_PATH,
+    include_hidden=not HIDE_DOT_DIRECTORY,
+    result_limit=QUERY_RESULT_LIMIT,
+    header_bytes=PAGE_HEADER_BYTES,
+    workers=INDEX_WORKERS,
+)
+# the pages most like each page, listed under it
+related_pages = RelatedPages(
+    page_index, count=RELATED_PAGES, link_weight=RELATED_LINK_WEIGHT
+)
+
+# page names and titles for the quick switcher and [[ completion
+page_completer = PageCompleter(page_index)
+
+# one save of a page at a time, across workers too
+page_locks = PageLocks(os.path.join(STATE_DIRECTORY, "page_locks"))
+
+# a rename in progress, finished at startup if the server died mid way
+RENAME_JOURNAL = os.path.join(STATE_DIRECTORY, "rename.journal")
+
+# resized copies of embedded images, for srcset
+RESIZE_IMAGES = can_resize()
+image_variants = VariantCache(
+    os.path.join(STATE_DIRECTORY, "image_variants"),
+    max_bytes=IMAGE_CACHE_MAX_BYTES,
+)
+
+startup.mark("caches")
 
 
 def markdown_page_name(url_pieces):
     """helper for cleaner urls to file.md files"""
-    path = url_pieces["path"]
-    path_list = url_pieces["path_list"]
-    file_name = url_pieces["file_name"]
-    file_ext = url_pieces["file_ext"]
-    file_name_base = url_pieces["file_name_no_ext"]
+    path = url_pieces.path
+    path_list = url_pieces.path_list
+    file_name = url_pieces.file_name
+    file_ext = url_pieces.file_ext
+    file_name_base = url_pieces.file_name_no_ext
 
     if file_ext == "":
         page_name = file_name_base
@@ -216,9 +326,8 @@ def markdown_page_name(url_pieces):
     return page_name
 
 
-def wikilink_page_check(resolved_name):
-    """check if a wiki link points to an actual documenbt"""
-
+def resolve_wikilink(resolved_name):
+    """a wikilink's page name as an absolute url path, .. resolved"""
     path = PurePosixPath(resolved_name)
     parts = []
     for part in path.parts:
@@ -229,9 +338,29 @@ def wikilink_page_check(resolved_name):
                 parts.append(part)
         elif part != ".":
             parts.append(part)
-    resolved_path = "/" + "/".join(parts)
+    return "/" + "/".join(parts)
+
+
+def wikilink_target_file(resolved_path):
+    """the file a wikilink (or an embedded image) points at, whether or not it exists"""
+    url_pieces = parse_url_path(resolved_path)
+    if url_pieces.file_ext == "":
+        return os.path.join(FILE_PATH, *url_pieces.path_list, url_pieces.file_name) + ".md"
+    return os.path.join(FILE_PATH, *url_pieces.path_list, url_pieces.file_name)
+
+
+def wikilink_page_check(resolved_name):
+    """check if a wiki link points to an actual documenbt"""
+
+    resolved_path = resolve_wikilink(resolved_name)
 
     # resolved_path = path.resolve()
+    if existence_index is not None:
+        return existence_index.lookup(resolved_path, wikilink_target_exists)
+    return wikilink_target_exists(resolved_path)
+
+
+def wikilink_target_exists(resolved_path):
     url_pieces = parse_url_path(resolved_path)
     file_exists = markdown_file_exists(url_pieces, any_type=True)
 
@@ -243,11 +372,11 @@ def wikilink_page_check(resolved_name):
 def markdown_file_exists(url_pieces, any_type=False):
     """Determines if a markdown url exists as a file"""
 
-    path = url_pieces["path"]
-    path_list = url_pieces["path_list"]
-    file_name = url_pieces["file_name"]
-    file_ext = url_pieces["file_ext"]
-    file_name_base = url_pieces["file_name_no_ext"]
+    path = url_pieces.path
+    path_list = url_pieces.path_list
+    file_name = url_pieces.file_name
+    file_ext = url_pieces.file_ext
+    file_name_base = url_pieces.file_name_no_ext
 
     file_path = ""
 
@@ -266,6 +395,345 @@ def markdown_file_exists(url_pieces, any_type=False):
         return False
 
 
+def image_attributes(url):
+    """width, height and srcset for an image embedded in a page, by its url under /wiki"""
+    url_pieces = parse_url_path(url)
+    file_path = os.path.join(FILE_PATH, *url_pieces.path_list, url_pieces.file_name)
+    size = image_size(file_path)
+    if size is None:
+        return {}
+    width, height = size
+    attributes = {"width": width, "height": height}
+
+    widths = [each for each in IMAGE_VARIANT_WIDTHS if each < width]
+    if RESIZE_IMAGES and widths:
+        # srcset is space and comma separated, file names can have both
+        quoted = quote("/".join([*url_pieces.path_list, url_pieces.file_name]).lstrip("/"))
+        srcset = [f"/media/{each}/{quoted} {each}w" for each in widths]
+        srcset.append(f"/wiki/{quoted} {width}w")
+        attributes["srcset"] = ", ".join(srcset)
+        attributes["sizes"] = IMAGE_SIZES
+    return attributes
+
+
+def make_markdown(
+    current_path, page_exists_callback=wikilink_page_check, transclusion_stack=()
+):
+    """
+    a Markdown instance for rendering a page that lives in current_path.
+    transclusion_stack is the pages being embedded into, outermost first.
+    """
+    if existence_index is not None:
+        # forget existence checks if a page was created or deleted since
+        existence_index.refresh()
+        # here rather than at import, codehilite pulls in pygments' lexers
+        install_highlight_cache(shared_cache, CODE_FINGERPRINT)
+    # files the page links to or shows, whether they exist or not.
+    # a cached render is dropped when one of them is created or deleted.
+    links = set()
+
+    def linked_page_exists(resolved_name):
+        links.add(wikilink_target_file(resolve_wikilink(resolved_name)))
+        return page_exists_callback(resolved_name)
+
+    def linked_image_attributes(url):
+        links.add(wikilink_target_file(url))
+        return image_attributes(url)
+
+    # { file path: digest of its heading ids } of pages [[linked#to]]
+    anchors = {}
+
+    def linked_anchor_exists(resolved_name, anchor):
+        file_path = wikilink_target_file(resolve_wikilink(resolved_name))
+        headings = page_headings(file_path) if file_path.endswith(".md") else None
+        if headings is None:
+            return True
+        anchors[file_path] = headings["digest"]
+        return anchor in headings["anchors"]
+
+    # custom extensions need to be configured on creation,
+    # and this one needs the current path
+    # images first, wikilinks would take ![[image.png]] for a [[link]]
+    all_extensions = MD_EXTENSIONS + [
+        ImageEmbedExtension(
+            current_path=current_path,
+            image_attributes_callback=linked_image_attributes,
+        ),
+        WikiLinkExtension(
+            base_url="/wiki",
+            current_path=current_path,
+            page_exists_callback=linked_page_exists,
+            anchor_exists_callback=linked_anchor_exists,
+        ),
+        QueryBlockExtension(
+            base_url="/wiki",
+            query_callback=page_index.cached_query,
+        ),
+        TransclusionExtension(
+            transclusion_callback=lambda target: transclude(
+                target, current_path, transclusion_stack
+            ),
+        ),
+    ]
+    md = markdown.Markdown(
+        extensions=all_extensions,
+        extension_configs=MD_EXTENSION_CONFIG,
+        output_format="html",
+    )
+    # embedded pages add theirs
+    md.pymdwiki_links = links
+    md.pymdwiki_anchors = anchors
+    return md
+
+
+def file_stamp(file_path):
+    """what a cached render remembers of a file it was made from"""
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return "missing"
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def render_stamp(file_path):
+    """the file and the code a render depends on, linked pages are dependencies"""
+    return f"{file_stamp(file_path)}:{CODE_FINGERPRINT}"
+
+
+def cache_render(namespace, key, stamp, value, links, generation):
+    """
+    keep a render, and the files it links to for invalidate_dependents.
+    Not if a page was created or deleted while it was rendered, it may
+    have missed being invalidated.
+    """
+    if shared_cache.generation("existence") != generation:
+        return
+    shared_cache.set(namespace, key, stamp, value)
+    shared_cache.set_dependencies(namespace, key, links)
+
+
+def embeds_unchanged(page):
+    """are the pages a cached render embeds unchanged since"""
+    return all(
+        file_stamp(file_path) == stamp
+        for file_path, stamp in page.get("embeds", {}).items()
+    )
+
+
+def anchors_unchanged(page):
+    """do the pages a cached render links to sections of have the same headings"""
+    for file_path, digest in page.get("anchors", {}).items():
+        headings = page_headings(file_path)
+        if headings is None or headings["digest"] != digest:
+            return False
+    return True
+
+
+def transclude(target, current_path, stack=()):
+    """
+    ![[target]] on a page in current_path, as { html, embeds, queries,
+    has_latex, has_jupyter, complete }.  Embedded pages are rendered on
+    their own and kept in the shared cache, so a page embedding fifty
+    others doesn't render fifty pages when one of them changes.
+    """
+    page_name, _, section = target.partition("#")
+    page_name = page_name.strip()
+    if page_name.endswith(".md"):
+        page_name = page_name[: -len(".md")]
+    if page_name.startswith("/"):
+        resolved = page_name.lstrip("/")
+    else:
+        resolved = "/".join(filter(None, [current_path, page_name]))
+    # ../Page from a page in a subdirectory
+    url = posixpath.normpath("/" + normalize_page_name(resolved))
+    url_pieces = parse_url_path(url)
+    file_path = os.path.join(FILE_PATH, *url_pieces.path_list, url_pieces.file_name) + ".md"
+    link = escape(url + (f"#{normalize_anchor(section)}" if section else ""))
+    label = escape(target)
+
+    def notice(message, complete=True):
+        html = (
+            f"""<div class="transclusion transclusion-notice">"""
+            f"""<a class="wikilink" href="/wiki{link}">{label}</a> {message}</div>"""
+        )
+        return {
+            "html": html,
+            "embeds": {file_path: file_stamp(file_path)},
+            "links": [],
+            "complete": complete,
+        }
+
+    if not os.path.isfile(file_path):
+        return notice("doesn't exist yet.")
+    key = f"{file_path}#{section}"
+    if key in stack:
+        return notice("is already embedded above, not repeated here.", complete=False)
+    if len(stack) >= TRANSCLUSION_MAX_DEPTH:
+        return notice("is embedded too deep to show.", complete=False)
+
+    if shared_cache is not None:
+        generation = existence_index.refresh()
+        stamp = render_stamp(file_path)
+        fragment = shared_cache.get("fragment", key, stamp)
+        if (
+            fragment is not None
+            and embeds_unchanged(fragment)
+            and query_results_unchanged(fragment)
+            and anchors_unchanged(fragment)
+        ):
+            return fragment
+
+    own_stamp = file_stamp(file_path)
+    with open(file_path, "r", newline="", encoding=DEFAULT_ENCODING) as file:
+        text = file.read()
+    if section:
+        text = extract_section(text, section)
+        if text is None:
+            return notice(f"has no section {escape(section)}.")
+
+    md = make_markdown(
+        "/".join(url_pieces.path_list),
+        transclusion_stack=(*stack, key),
+    )
+    # headings get ids from the embedded page's own toc pass, they'd clash
+    # with the embedding page's: #intro must be its intro, not this one's
+    prefix = normalize_anchor(url.strip("/").replace("/", " ")) + "--"
+    body = namespace_ids(md.convert(text), prefix)
+    fragment = {
+        "html": f"""<div class="transclusion" data-page="{link}">{body}</div>""",
+        "embeds": {**md.pymdwiki_embeds, file_path: own_stamp},  # pylint: disable=no-member
+        "queries": md.pymdwiki_queries,  # pylint: disable=no-member
+        "anchors": md.pymdwiki_anchors,  # pylint: disable=no-member
+        "links": sorted(md.pymdwiki_links),  # pylint: disable=no-member
+        "has_latex": md.pymdwiki_has_latex,  # pylint: disable=no-member
+        "has_jupyter": md.pymdwiki_has_jupyter,  # pylint: disable=no-member
+        "complete": md.pymdwiki_embeds_complete,  # pylint: disable=no-member
+    }
+    if shared_cache is not None and fragment["complete"]:
+        # one cut short by a cycle depends on who embeds it, don't share it
+        cache_render("fragment", key, stamp, fragment, fragment["links"], generation)
+    return fragment
+
+
+def render_page(file_path, path):
+    """
+    Converts a markdown file to { html, toc, has_latex, has_jupyter, queries,
+    embeds }, or gets it from the shared render cache when the file, the
+    pages it embeds, the set of existing pages and the code are all
+    unchanged since it was rendered.
+    """
+    if shared_cache is not None:
+        # other workers may have dropped renders this one has in memory
+        shared_cache.refresh_memory()
+        generation = existence_index.refresh()
+        stamp = render_stamp(file_path)
+        page = shared_cache.get("render", file_path, stamp)
+        if (
+            page is not None
+            and embeds_unchanged(page)
+            and query_results_unchanged(page)
+            and anchors_unchanged(page)
+        ):
+            return page
+
+    # time all the existence checks made while converting
+    page_check = timed_callback("wikilinks", wikilink_page_check)
+
+    # a page embedding itself stops at once
+    md = make_markdown(
+        path, page_exists_callback=page_check, transclusion_stack=(f"{file_path}#",)
+    )
+    with stage("read"):
+        with open(file_path, "r", newline="", encoding=DEFAULT_ENCODING) as file:
+            html = file.read()
+    with stage("convert"):
+        html = md.convert(html)
+    page_check.finish()
+
+    page = {
+        "html": html,
+        "toc": md.toc,  # pylint: disable=no-member
+        "has_latex": md.pymdwiki_has_latex,  # pylint: disable=no-member
+        "has_jupyter": md.pymdwiki_has_jupyter,  # pylint: disable=no-member
+        "queries": md.pymdwiki_queries,  # pylint: disable=no-member
+        "embeds": md.pymdwiki_embeds,  # pylint: disable=no-member
+        "anchors": md.pymdwiki_anchors,  # pylint: disable=no-member
+    }
+    if shared_cache is not None:
+        cache_render(
+            "render", file_path, stamp, page, md.pymdwiki_links, generation  # pylint: disable=no-member
+        )
+    return page
+
+
+def query_results_unchanged(page):
+    """are the ```query results a cached render shows still current"""
+    queries = page.get("queries")
+    if not queries:
+        return True
+    return page_index.query_generations(queries) == queries
+
+
+def reindex_page(file_path):
+    """the page index and related pages, after file_path changed"""
+    page_index.update(file_path)
+    if RELATED_PAGES and file_path.endswith(".md"):
+        related_pages.update(page_index.page_name(file_path))
+
+
+def forget_page(file_path, created_or_deleted):
+    """drop a page from the render cache in every worker, and reindex it"""
+    reindex_page(file_path)
+    if shared_cache is None:
+        return
+    shared_cache.delete("render", file_path)
+    if created_or_deleted:
+        # wikilinks to it on other pages change colour
+        existence_index.invalidate()
+        shared_cache.invalidate_dependents([file_path])
+
+
+def invalidate_changed_pages(changes):
+    """change feed subscriber, drops cached renders of files changed on disk"""
+    if shared_cache is None:
+        return
+    for path, kind in changes.items():
+        if path.endswith(".md"):
+            shared_cache.delete("render", path)
+    if any(kind == "rescan" for kind in changes.values()):
+        # events were lost, anything may have come or gone
+        existence_index.invalidate()
+        shared_cache.clear("render")
+        shared_cache.clear("fragment")
+        return
+    # pages linking to these change, an image's new size too
+    targets = [
+        path
+        for path, kind in changes.items()
+        if kind != "modified" or not path.endswith(".md")
+    ]
+    if targets:
+        existence_index.invalidate()
+        shared_cache.invalidate_dependents(targets)
+
+
+change_feed.subscribe(invalidate_changed_pages)
+
+
+async def reindex_changed_pages(changes):
+    """change feed subscriber, keeps the page index up to date"""
+    await asyncio.to_thread(page_index.apply_changes, changes)
+    if RELATED_PAGES:
+        for path, kind in changes.items():
+            if kind != "rescan" and path.endswith(".md"):
+                await asyncio.to_thread(
+                    related_pages.update, page_index.page_name(path)
+                )
+
+
+change_feed.subscribe(reindex_changed_pages)
+
+
 # Define the catch-all endpoint
 async def catch_all(request):
 
@@ -275,10 +743,11 @@ async def catch_all(request):
     # it exists, or to /edit/document if it doesn't?
 
     url_pieces = parse_url_path(request.url.path)
-    path = url_pieces["path"]
-    path_list = url_pieces["path_list"]
-    file_name = url_pieces["file_name"]
-    file_ext = url_pieces["file_ext"]
+    path = url_pieces.path
+    # a copy, parsed paths are shared
+    path_list = list(url_pieces.path_list)
+    file_name = url_pieces.file_name
+    file_ext = url_pieces.file_ext
 
     # kind of annoying that browsers always request this file.
     if file_name == "favicon.ico":
@@ -300,7 +769,7 @@ async def catch_all(request):
             file_path = os.path.join(os.getcwd(), template_path, *path_list, file_name)
             print(file_path)
             if Path(file_path).exists():
-                return FileResponse(file_path, filename=file_name)
+                return static_file_response(request, file_path, file_name)
             else:
                 print("file doesn't exist")
 
@@ -325,47 +794,26 @@ async def view_document(request):
 
     url_pieces = parse_url_path(request.url.path)
 
-    path = url_pieces["path"]
-    path_list = url_pieces["path_list"]
-    file_name = url_pieces["file_name"]
-    file_ext = url_pieces["file_ext"]
-    file_name_base = url_pieces["file_name_no_ext"]
+    path = url_pieces.path
+    path_list = url_pieces.path_list
+    file_name = url_pieces.file_name
+    file_ext = url_pieces.file_ext
+    file_name_base = url_pieces.file_name_no_ext
 
     file_path = markdown_file_exists(url_pieces, any_type=False)
 
     if file_path:
 
-        page_name = markdown_page_name(url_pieces)
-
-        # custom extensions need to be configured on creation,
-        # and this one needs the current path
-        all_extensions = MD_EXTENSIONS + [
-            WikiLinkExtension(
-                base_url="/wiki",
-                current_path=path,
-                page_exists_callback=wikilink_page_check,
-            )
-        ]
-
-        md = markdown.Markdown(
-            extensions=all_extensions,
-            extension_configs=MD_EXTENSION_CONFIG,
-            output_format="html",
-        )
-        with open(file_path, "r", newline="", encoding=DEFAULT_ENCODING) as file:
-            html = file.read()
-        html = md.convert(html)
+        page = render_page(file_path, path)
+        html = page["html"]
 
-        doc_data["title"] = file_name_base
-        doc_data["page_name"] = page_name
-        doc_data["page_path"] = path
-        doc_data["toc"] = md.toc  # pylint: disable=no-member
+        doc_data.update(page_data(file_path, url_pieces, page))
         doc_data["scripts"] = ""
 
         # this here allows for including it only on the document page.
         # and only if LaTeX was in the markdown and got processed.
 
-        if md.pymdwiki_has_latex:  # pylint: disable=no-member
+        if page["has_latex"]:
             doc_data[
                 "scripts"
             ] += """
@@ -384,28 +832,101 @@ async def view_document(request):
                         });
                     </script>"""
 
-        if md.pymdwiki_has_jupyter:  # pylint: disable=no-member
-            doc_data["is_jupyter"] = True
+        if page["has_jupyter"]:
             doc_data["scripts"] += """<script src="/template/jupyter.js"></script>"""
 
-        doc_data["document"] = html
+        if CHANGE_FEED:
+            doc_data["scripts"] += """<script src="/template/live.js"></script>"""
+
+        if CLIENT_ROUTER:
+            doc_data["scripts"] += """<script defer src="/template/router.js"></script>"""
+
+        if STREAMING_RESPONSES and len(html) >= STREAMING_MINIMUM_SIZE:
+            # big page, send it in pieces rather than rendering
+            # the whole thing into yet another string first.
+            return StreamingResponse(
+                stream_template(
+                    doc_template,
+                    doc_data,
+                    chunk_size=STREAMING_CHUNK_SIZE,
+                    encoding=DEFAULT_ENCODING,
+                ),
+                media_type="text/html",
+            )
 
-        response_content = doc_template.render(doc_data)
+        with stage("render"):
+            response_content = doc_template.render(doc_data)
 
         return HTMLResponse(response_content)
     else:
-        if file_ext in ["png", "jpg", "jpeg", "gif"]:
-            file_path = os.path.join(FILE_PATH, *path_list, file_name)
-            if Path(file_path).exists():
-                return FileResponse(file_path, filename=file_name)
-            else:
-                raise HTTPException(status_code=404, detail="File not found.")
+        # any other file in the wiki: images, pdfs, canvases, video...
+        hidden = HIDE_DOT_DIRECTORY and any(
+            each.startswith(".") for each in [*path_list, file_name]
+        )
+        file_path = os.path.join(FILE_PATH, *path_list, file_name)
+        if file_ext and not hidden and os.path.isfile(file_path):
+            return attachment_response(request, file_path, file_name)
+        if file_ext.lower() in ["png", "jpg", "jpeg", "gif", "webp", "pdf"]:
+            raise HTTPException(status_code=404, detail="File not found.")
 
         # response_content = f"<h1>Edit: {file_name}</h1><p>Method: {method}</p>"
         # return HTMLResponse(response_content)
         return RedirectResponse("/".join(["/edit", *path_list, file_name]))
 
 
+def page_data(file_path, url_pieces, page):
+    """what document.html and the header show of a rendered page"""
+    page_name = markdown_page_name(url_pieces)
+    data = {
+        "title": url_pieces.file_name_no_ext,
+        "page_name": page_name,
+        "page_path": url_pieces.path,
+        # headings get links to edit their section
+        "edit_url": "/edit/" + quote("/".join(filter(None, [url_pieces.path, page_name]))),
+        "toc": page["toc"],
+        "document": page["html"],
+        "is_jupyter": page["has_jupyter"],
+    }
+    if RELATED_PAGES:
+        # worked out on save, this only looks them up
+        data["related"] = [
+            {"url": "/wiki/" + quote(each["page"]), "title": escape(each["title"])}
+            for each in related_pages.related(page_index.page_name(file_path))
+        ]
+    return data
+
+
+# /api/page/
+async def page_fragment(request):
+    """
+    The parts of a page that differ from one page to the next, for the
+    template's router to swap in without loading the rest again: JSON {
+    title, header, toc, document, has_latex, has_jupyter }, header and
+    document being the template's _header.html and _document.html.
+    """
+    url_pieces = parse_url_path(request.path_params["path"])
+    file_path = markdown_file_exists(url_pieces, any_type=False)
+    if not file_path:
+        # attachments and missing pages are for a full page load
+        return JSONResponse({"error": "Not a page."}, status_code=404)
+
+    page = render_page(file_path, url_pieces.path)
+    doc_data = page_data(file_path, url_pieces, page)
+    doc_data["default_wiki_page"] = DEFAULT_WIKI_PAGE
+
+    jinja_env = Environment(loader=FileSystemLoader(os.path.join("template", TEMPLATE)))
+    with stage("render"):
+        fragment = {
+            "title": doc_data["title"],
+            "header": jinja_env.get_template("_header.html").render(doc_data),
+            "toc": doc_data["toc"],
+            "document": jinja_env.get_template("_document.html").render(doc_data),
+            "has_latex": page["has_latex"],
+            "has_jupyter": page["has_jupyter"],
+        }
+    return JSONResponse(fragment)
+
+
 # /edit/
 async def edit_document(request):
 
@@ -418,11 +939,11 @@ async def edit_document(request):
 
     url_pieces = parse_url_path(request.url.path)
 
-    path = url_pieces["path"]
-    path_list = url_pieces["path_list"]
-    file_name = url_pieces["file_name"]
-    file_ext = url_pieces["file_ext"]
-    file_name_base = url_pieces["file_name_no_ext"]
+    path = url_pieces.path
+    path_list = url_pieces.path_list
+    file_name = url_pieces.file_name
+    file_ext = url_pieces.file_ext
+    file_name_base = url_pieces.file_name_no_ext
 
     file_path = ""
 
@@ -439,10 +960,20 @@ async def edit_document(request):
         page_name = file_name
 
     if len(file_path) > 0 and Path(file_path).exists():
-        with open(file_path, "r", newline="", encoding=DEFAULT_ENCODING) as file:
-            raw_markdown = file.read()
+        raw_markdown, doc_data["revision"] = read_page_revision(file_path)
         page_title = f"Editing {file_name}"
         doc_data["document_mode"] = "edit"
+
+        # just one heading's section, big pages are slow to ship whole
+        section = request.query_params.get("section", "")
+        lines, _ = split_lines(raw_markdown)
+        found = section_lines(lines, section) if section else None
+        if found is not None:
+            start, end = found
+            raw_markdown = join_lines(lines[start:end])
+            doc_data["section"] = escape(section)
+            doc_data["section_start"] = start
+            doc_data["section_end"] = end
     else:
         # file doesn't exist,
         raw_markdown = f"""Title: {file_name}\nSummary:\nAuthors: \nDate: {datetime.datetime.now(datetime.timezone.utc)}\nKeywords: \n\n# Header \n Edit your document {file_name}"""
@@ -506,6 +1037,8 @@ async def edit_document(request):
     </script>
     """
 
+    doc_data["scripts"] += """<script src="/template/edit.js"></script>"""
+
     doc_data["document"] = escape(raw_markdown)
     doc_data["file_path"] = escape(file_path)
 
@@ -514,6 +1047,67 @@ async def edit_document(request):
     return HTMLResponse(response_content)
 
 
+def read_page_revision(file_path):
+    """(text, revision) of a page as it is on disk"""
+    with open(file_path, "rb") as file:
+        data = file.read()
+    return data.decode(DEFAULT_ENCODING), page_revision(data)
+
+
+def write_page(file_path, text):
+    """write a page's text, all or nothing, returns its new revision"""
+    data = text.encode(DEFAULT_ENCODING, errors="xmlcharrefreplace")
+    write_atomic(file_path, data)
+    return page_revision(data)
+
+
+def patch_page(file_path, base, hunks):
+    """
+    apply_patch hunks to a page if it's still at revision base, raises
+    StaleRevision if not.  Returns the new revision.
+    """
+    with page_locks.file_lock(file_path):
+        text, current = read_page_revision(file_path)
+        if current != base:
+            raise StaleRevision(current)
+        if not hunks:
+            return current
+        lines, crlf = split_lines(text)
+        new_revision = write_page(file_path, join_lines(apply_patch(lines, hunks), crlf))
+    forget_page(file_path, created_or_deleted=False)
+    return new_revision
+
+
+def save_page(file_path, text, base=None):
+    """
+    Write a page whole if it's still at revision base, "" meaning it must
+    not exist yet and None not checking.  Raises StaleRevision if it
+    isn't, returns the new revision.
+    """
+    with page_locks.file_lock(file_path):
+        try:
+            _, current = read_page_revision(file_path)
+        except FileNotFoundError:
+            current = ""
+        if base is not None and current != base:
+            raise StaleRevision(current)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        new_revision = write_page(file_path, text)
+    forget_page(file_path, created_or_deleted=not current)
+    return new_revision
+
+
+def saved_file_path(document_name):
+    """(file path, /wiki/ url) of a page the editor names"""
+    url_pieces = parse_url_path(document_name)
+    file_name = url_pieces.file_name
+    if url_pieces.file_ext == "":
+        file_name = file_name + ".md"
+    file_path = os.path.join(FILE_PATH, *url_pieces.path_list, file_name)
+    page = "/".join([*url_pieces.path_list, url_pieces.file_name_no_ext]).strip("/")
+    return file_path, "/wiki/" + quote(page)
+
+
 # /save/ process documenbt saves
 async def save_document(request):
     # do we really care if this was a POST or GET?
@@ -524,16 +1118,18 @@ async def save_document(request):
     document_name = form["document_name"]
     if "delete_button" in form:
         return await delete_document(request)
+    if "rename_button" in form:
+        return await rename_document(request)
 
     if not document_name:
         return RedirectResponse(f"/wiki/{DEFAULT_WIKI_PAGE}")
 
     url_pieces = parse_url_path(document_name)
-    path = url_pieces["path"]
-    path_list = url_pieces["path_list"]
-    file_name = url_pieces["file_name"]
-    file_ext = url_pieces["file_ext"]
-    file_name_base = url_pieces["file_name_no_ext"]
+    path = url_pieces.path
+    path_list = url_pieces.path_list
+    file_name = url_pieces.file_name
+    file_ext = url_pieces.file_ext
+    file_name_base = url_pieces.file_name_no_ext
 
     file_path = ""
     if file_ext == "":
@@ -542,27 +1138,84 @@ async def save_document(request):
 
     file_path = os.path.join(FILE_PATH, *path_list, file_name)
 
-    if len(file_path) > 0:
-        if Path(file_path).exists():
-            # any special consideratin when overwriting a file?
-            # backup old file? versioning?
-            ...
-
-        os.makedirs(os.path.join(FILE_PATH, *path_list), exist_ok=True)
+    if form.get("section_start"):
+        # a section, sent whole when the editor's script didn't patch it
+        hunk = {
+            "start": form["section_start"],
+            "end": form["section_end"],
+            "lines": split_lines(updated_markdown)[0],
+        }
+        try:
+            async with page_locks.lock(file_path):
+                await asyncio.to_thread(
+                    patch_page, file_path, form.get("base_revision", ""), [hunk]
+                )
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="File not found.")
+        except PatchError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        _, url = saved_file_path(document_name)
+        return RedirectResponse(url + "#" + quote(form.get("section", "")), status_code=303)
 
-        with open(
-            file_path,
-            "w",
-            newline="\n",
-            encoding=DEFAULT_ENCODING,
-            errors="xmlcharrefreplace",
-        ) as file:
-            file.write(updated_markdown)
+    if len(file_path) > 0:
+        # the revision the editor opened, "" for a new page; a form
+        # without one (a script, say) overwrites whatever is there
+        base = form.get("base_revision")
+        try:
+            async with page_locks.lock(file_path):
+                await asyncio.to_thread(save_page, file_path, updated_markdown, base)
+        except StaleRevision as e:
+            if not base:
+                detail = "Someone else created this page meanwhile, reopen the editor to see it."
+            elif not e.revision:
+                detail = "The page was deleted since it was opened for editing."
+            else:
+                detail = f"{e} It is now at revision {e.revision}, reopen the editor to see it."
+            raise HTTPException(status_code=409, detail=detail)
         # do we want to catch case when we write an empty file?
 
     return RedirectResponse("/".join(["/wiki", *path_list, file_name_base]))
 
 
+# /api/save/
+async def save_patch(request):
+    """
+    Saves an edit as a patch, only the changed lines sent: JSON {
+    document_name, base, hunks: [{ start, end, lines }] }, base being the
+    revision the editor started from.  409 and the page's revision if it
+    has changed since, the editor can't know its lines still line up.
+    """
+    try:
+        patch = await request.json()
+        document_name, base, hunks = patch["document_name"], patch["base"], patch["hunks"]
+    except (ValueError, KeyError, TypeError):
+        return JSONResponse({"error": "Expected document_name, base and hunks."}, status_code=400)
+    if not isinstance(hunks, list):
+        return JSONResponse({"error": "Expected a list of hunks."}, status_code=400)
+
+    file_path, url = saved_file_path(document_name)
+    try:
+        async with page_locks.lock(file_path):
+            new_revision = await asyncio.to_thread(patch_page, file_path, base, hunks)
+    except FileNotFoundError:
+        return JSONResponse({"error": "No such page."}, status_code=404)
+    except StaleRevision as e:
+        return JSONResponse({"error": str(e), "revision": e.revision}, status_code=409)
+    except PatchError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return JSONResponse({"revision": new_revision, "url": url})
+
+
+def delete_page(file_path):
+    """remove a page, if it's there, and forget it everywhere"""
+    with page_locks.file_lock(file_path):
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            return
+    forget_page(file_path, created_or_deleted=True)
+
+
 # /delete/
 async def delete_document(request):
     """Deletes a file.  Does not delete directories."""
@@ -577,11 +1230,11 @@ async def delete_document(request):
             return RedirectResponse(f"/wiki/{DEFAULT_WIKI_PAGE}")
 
         url_pieces = parse_url_path(document_name)
-        path = url_pieces["path"]
-        path_list = url_pieces["path_list"]
-        file_name = url_pieces["file_name"]
-        file_ext = url_pieces["file_ext"]
-        file_name_base = url_pieces["file_name_no_ext"]
+        path = url_pieces.path
+        path_list = url_pieces.path_list
+        file_name = url_pieces.file_name
+        file_ext = url_pieces.file_ext
+        file_name_base = url_pieces.file_name_no_ext
 
         file_path = ""
         if file_ext == "":
@@ -591,8 +1244,8 @@ async def delete_document(request):
         file_path = os.path.join(FILE_PATH, *path_list, file_name)
 
         if len(file_path) > 0:
-            if Path(file_path).exists():
-                os.remove(file_path)
+            async with page_locks.lock(file_path):
+                await asyncio.to_thread(delete_page, file_path)
     elif method == "GET":
         ...
 
@@ -600,6 +1253,69 @@ async def delete_document(request):
     # return RedirectResponse("/".join(["/edit", *path_list, file_name_base]))
 
 
+def forget_renamed(moves, rewritten):
+    """render cache and page index after a rename, for every worker"""
+    for old, new in moves.items():
+        is_page = os.path.isfile(os.path.join(FILE_PATH, new + ".md"))
+        for target in (old, new):
+            if is_page:
+                forget_page(os.path.join(FILE_PATH, target + ".md"), created_or_deleted=True)
+            elif shared_cache is not None:
+                # an image or file, pages linking to it change
+                existence_index.invalidate()
+                shared_cache.invalidate_dependents([os.path.join(FILE_PATH, target)])
+    for file_path in rewritten:
+        forget_page(file_path, created_or_deleted=False)
+
+
+# /rename/
+async def rename_document(request):
+    """
+    Renames or moves a page, a file or a directory, and rewrites the
+    links to it on every page.  new_name is from the top of the wiki.
+    """
+    if request.method != "POST":
+        return RedirectResponse("/index/")
+
+    form = await request.form()
+    document_name = form.get("document_name", "")
+    new_name = form.get("new_name", "").strip()
+    # parse_url_path makes nothing into DEFAULT_WIKI_PAGE, a blank box
+    # would move the page onto the main page
+    if not document_name.strip("/\\ ") or not new_name.strip("/\\ "):
+        raise HTTPException(status_code=400, detail="Give both the old and the new name.")
+
+    url_pieces = parse_url_path(document_name)
+    old_name = "/".join([*url_pieces.path_list, url_pieces.file_name]).strip("/")
+    if url_pieces.file_ext == "md":
+        old_name = old_name[: -len(".md")]
+    new_pieces = parse_url_path(new_name)
+    new_name = "/".join([*new_pieces.path_list, new_pieces.file_name]).strip("/")
+    if new_pieces.file_ext == "md":
+        new_name = new_name[: -len(".md")]
+
+    try:
+        moves, rewritten = await asyncio.to_thread(
+            rename,
+            page_index,
+            FILE_PATH,
+            old_name,
+            new_name,
+            RENAME_JOURNAL,
+            DEFAULT_ENCODING,
+            page_locks,
+        )
+    except RenameError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    print(f"Renamed {old_name} to {new_name}, rewrote links on {len(rewritten)} pages.")
+    await asyncio.to_thread(forget_renamed, moves, rewritten)
+
+    if old_name not in moves:
+        # a directory
+        return RedirectResponse("/index/" + quote(new_name), status_code=303)
+    return RedirectResponse("/wiki/" + quote(moves[old_name]), status_code=303)
+
+
 def find_last_match_index(A, B):
     """Given two lists, find the index of last match"""
     min_len = min(len(A), len(B))
@@ -611,123 +1327,70 @@ def find_last_match_index(A, B):
     return min_len - 1
 
 
-def parse_file_path(path, remove_reserved=True):
-    """helper to break path into some commonly used components"""
-    path = unquote(path)
-    while ".." in path:
-        path = path.replace("..", "")
-    while "\\" in path:
-        path = path.replace("\\", "/")
-    while "//" in path:
-        path = path.replace("//", "/")
-    path_split = path.split("/")
-    path_split = [each for each in path_split if each]
-    is_md = False
-
-    if remove_reserved and path_split and path_split[0] in RESERVED_PATHS:
-        path_split.pop(0)
-
-    if path_split:
-        file_name = path_split.pop()
-        if len(path_split) == 0:
-            path_split = [""]
-        file_name_parts = file_name.split(".")
-        if len(file_name_parts) > 1:
-            file_ext = file_name_parts.pop()
-            file_name_no_ext = file_name[: -1 - len(file_ext)]
-        else:
-            file_ext = ""
-            file_name_no_ext = file_name
-
-        if file_ext == "md":
-            is_md = True
-            path_split.append(file_name_no_ext)
+# markdown and the wiki's extensions leave these alone as entities
+MARKDOWN_ENTITIES = {ord(c): f"&#{ord(c)};" for c in "\\`*_{}[]()#+-.!$=~|:^"}
 
-        if not path_split[0]:
-            path_split.pop(0)
-    else:
-        path_split = [""]
-        file_name = DEFAULT_WIKI_PAGE
-        file_ext = ""
-        file_name_no_ext = DEFAULT_WIKI_PAGE
-
-    response = {
-        "path": "/".join(path_split),
-        "path_list": path_split,
-        "file_name": file_name,
-        "file_ext": file_ext,
-        "file_name_no_ext": file_name_no_ext,
-        "is_md": is_md,
-    }
-    return response
 
+def markdown_text(text):
+    """text to show as is in a markdown document, html and markdown escaped"""
+    return escape(text, quote=False).translate(MARKDOWN_ENTITIES)
 
-# /index/
-async def index_document(request):
 
-    template_path = os.path.join("template", TEMPLATE)
-    jinja_env = Environment(loader=FileSystemLoader(template_path))
-    doc_template = jinja_env.get_template("document.html")
-
-    doc_data = {}
-    doc_data["default_wiki_page"] = DEFAULT_WIKI_PAGE
-
-    url_pieces = parse_url_path(request.url.path)
-
-    path = url_pieces["path"]
-    path_list = url_pieces["path_list"]
-    file_name = url_pieces["file_name"]
-    file_ext = url_pieces["file_ext"]
-    file_name_base = url_pieces["file_name_no_ext"]
-
-    file_path = ""
-
-    # file_path = os.path.join(".", FILE_PATH)
-    file_path = os.path.join(FILE_PATH)
-    # specify the file extension you want to search for
-    extension = "*.md"
-    # use the glob module to find all files with the specified extension in the directory and its subdirectories
+def index_page_description(page, summaries):
+    """title and summary shown after a page in the index, as markdown"""
+    if page in summaries:
+        title, summary = summaries[page]
+    else:
+        # not in the page index yet
+        header = page_header(
+            os.path.join(FILE_PATH, *page.split("/")) + ".md", PAGE_HEADER_BYTES
+        )
+        if header is None:
+            return ""
+        title, summary = header["title"], header["summary"]
 
-    file_list = []
-    for extension in ["*.md", "*.png", "*.jpg", "*.jpeg", "*.pdf", "*.canvas"]:
+    description = ""
+    name = page.split("/")[-1]
+    if title and title.replace(" ", "_") != name.replace(" ", "_"):
+        description += f""" <span class="list_title">{markdown_text(title)}</span>"""
+    if summary:
+        description += f""" <span class="list_summary">{markdown_text(summary)}</span>"""
+    return description
 
-        file_list = file_list + glob.glob(
-            f"{file_path}/**/{extension}",
-            recursive=True,
-            include_hidden=not HIDE_DOT_DIRECTORY,
-        )
 
-    md_list = ""
+def index_markdown_entries(file_list, summaries=None):
+    """
+    yields the markdown list lines for each file in the index, in order.
+    With summaries, { page: (title, summary) }, pages get those after them.
+    """
     last_list_depth = 0
     current_list_depth = 0
 
-    last_path_list = []
+    last_path_list = ()
     last_path = ""
-    file_list = [f if f[-3:] != ".md" else f[:-3] for f in file_list]
-    file_list = list(set(file_list))
-    file_list.sort(key=str.lower)
 
     for each in file_list:
         d = parse_file_path(each)
+        entry = ""
 
-        if not d["path"]:
+        if not d.path:
             current_list_depth = 0
         else:
-            current_list_depth = len(d["path_list"])
+            current_list_depth = len(d.path_list)
 
             # # ignore any hidden folders, anything that begins with .
             # if any(
             #     [
             #         True if directory_name[0] == "." else False
-            #         for directory_name in d["path_list"]
+            #         for directory_name in d.path_list
             #     ]
             # ):
             #     if HIDE_DOT_DIRECTORY:
             #         continue
 
-        if not (last_path_list == d["path_list"]):
+        if not (last_path_list == d.path_list):
             # path has changed.
-            branch_index = find_last_match_index(last_path_list, d["path_list"])
+            branch_index = find_last_match_index(last_path_list, d.path_list)
             if branch_index == -1:
                 # branch_index = 0  # just starting
                 ...
@@ -742,81 +1405,152 @@ async def index_document(request):
             for depth in range(branch_index + 1, current_list_depth):
 
                 if depth == (current_list_depth - 1):
-                    if d["is_md"]:
-                        md_list += (
+                    if d.is_md:
+                        entry += (
                             f"{depth * '    '}* [["
-                            + "/".join(d["path_list"])
+                            + "/".join(d.path_list)
                             + "]]\n"
-                            + f"{{: .list_file .file_{d['file_ext']} }}\n"
+                            + f"{{: .list_file .file_{d.file_ext} }}\n"
                         )
                         break
 
                 if DIRECTORY_AS_MD_FILE_LINK:
-                    md_list += (
+                    entry += (
                         f"{depth * '    '}* [["
-                        + "/".join(d["path_list"][: depth + 1])
+                        + "/".join(d.path_list[: depth + 1])
                         + "]] \n"
                         + "{: .list_dir_link }\n"
                     )
                 else:
-                    md_list += (
+                    entry += (
                         f"{depth * '    '}* "
-                        + d["path_list"][depth]
+                        + d.path_list[depth]
                         + "\n"
                         + "{: .list_dir }\n"
                     )
         else:
             ...
 
-        if not d["is_md"]:
-            md_list += (
+        if not d.is_md:
+            description = ""
+            if summaries is not None and not d.file_ext:
+                # a page, the index lists them without .md
+                description = index_page_description(
+                    "/".join([*d.path_list, d.file_name]), summaries
+                )
+            entry += (
                 f"{current_list_depth * '    '}* [["
-                + "/".join([*d["path_list"], d["file_name"]])
-                + "]]\n"
-                + f"{{: .list_file .file_{d['file_ext']} }}\n"
+                + "/".join([*d.path_list, d.file_name])
+                + "]]"
+                + description
+                + "\n"
+                + f"{{: .list_file .file_{d.file_ext} }}\n"
             )
         # else:
-        #     md_list += (
+        #     entry += (
         #         f"{current_list_depth * '    '}* <<[["
-        #         + "/".join(d["path_list"])
+        #         + "/".join(d.path_list)
         #         + "]]>>\n"
-        #         # + f"{{: .list_file .file_{d['file_ext']} }}\n"
+        #         # + f"{{: .list_file .file_{d.file_ext} }}\n"
         #     )
 
-        # md_list += (
+        # entry += (
         #     f"{current_list_depth * '    '}* <<[["
-        #     + "/".join(d["path_list"])
+        #     + "/".join(d.path_list)
         #     + "/"
-        #     + d["file_name_no_ext"]
+        #     + d.file_name_no_ext
         #     + "]]>>\n"
-        #     # + f"{{: .list_file .file_{d['file_ext']} }}\n"
+        #     # + f"{{: .list_file .file_{d.file_ext} }}\n"
         # )
 
         # current becomes last on next iteration.
         last_list_depth = current_list_depth
-        last_path_list = d["path_list"].copy()
-        last_path = d["path"]
+        last_path_list = d.path_list
+        last_path = d.path
 
-    # custom extensions need to be configured on creation,
-    # and this one needs the current path
-    all_extensions = MD_EXTENSIONS + [
-        WikiLinkExtension(
-            base_url="/wiki",
-            current_path=path,
-            page_exists_callback=wikilink_page_check,
+        yield entry
+
+
+def index_html_chunks(file_list, path, batch_lines=INDEX_BATCH_LINES, summaries=None):
+    """
+    Converts the index list to html a batch at a time, so the first part
+    of the tree can be sent before the rest has been converted.
+    Batches only break between top level entries, so nesting is kept.
+    """
+    md = make_markdown(path)
+
+    md_list = []
+    line_count = 0
+    for entry in index_markdown_entries(file_list, summaries):
+        if line_count >= batch_lines and entry.startswith("* "):
+            yield md.reset().convert("".join(md_list))
+            md_list = []
+            line_count = 0
+        md_list.append(entry)
+        line_count += entry.count("\n")
+
+    if md_list:
+        yield md.reset().convert("".join(md_list))
+
+
+# /index/
+async def index_document(request):
+
+    template_path = os.path.join("template", TEMPLATE)
+    jinja_env = Environment(loader=FileSystemLoader(template_path))
+    doc_template = jinja_env.get_template("document.html")
+
+    doc_data = {}
+    doc_data["default_wiki_page"] = DEFAULT_WIKI_PAGE
+
+    url_pieces = parse_url_path(request.url.path)
+
+    path = url_pieces.path
+    path_list = url_pieces.path_list
+    file_name = url_pieces.file_name
+    file_ext = url_pieces.file_ext
+    file_name_base = url_pieces.file_name_no_ext
+
+    file_path = ""
+
+    # file_path = os.path.join(".", FILE_PATH)
+    file_path = os.path.join(FILE_PATH)
+    # specify the file extension you want to search for
+    extension = "*.md"
+    # use the glob module to find all files with the specified extension in the directory and its subdirectories
+
+    file_list = []
+    for extension in ["*.md", "*.png", "*.jpg", "*.jpeg", "*.pdf", "*.canvas"]:
+
+        file_list = file_list + glob.glob(
+            f"{file_path}/**/{extension}",
+            recursive=True,
+            include_hidden=not HIDE_DOT_DIRECTORY,
         )
-    ]
-    md = markdown.Markdown(
-        extensions=all_extensions,
-        extension_configs=MD_EXTENSION_CONFIG,
-        output_format="html",
-    )
-    html = md.convert(md_list)
+
+    file_list = [f if f[-3:] != ".md" else f[:-3] for f in file_list]
+    file_list = list(set(file_list))
+    file_list.sort(key=str.lower)
 
     doc_data["scripts"] = ""
     doc_data["unlinked_title"] = "Index"
-    # doc_data["document"] = "<pre>" + md_list + "</pre><pre>" + debug_text + "</pre>"
-    doc_data["document"] = html
+
+    # titles and summaries, from the page index rather than the pages
+    summaries = page_index.summaries()
+
+    if STREAMING_RESPONSES:
+        return StreamingResponse(
+            stream_template(
+                doc_template,
+                doc_data,
+                body_chunks=index_html_chunks(file_list, path, summaries=summaries),
+                chunk_size=STREAMING_CHUNK_SIZE,
+                encoding=DEFAULT_ENCODING,
+            ),
+            media_type="text/html",
+        )
+
+    doc_data["document"] = "".join(index_html_chunks(file_list, path, summaries=summaries))
 
     response_content = doc_template.render(doc_data)
 
@@ -824,7 +1558,7 @@ async def index_document(request):
 
 
 from src.jupyter_client import jupyter_manager
-from src.tasks import kernel_reaper_loop
+from src.tasks import kernel_reaper_loop, metrics_flush_loop
 
 import asyncio
 from contextlib import asynccontextmanager
@@ -833,19 +1567,62 @@ from contextlib import asynccontextmanager
 @asynccontextmanager
 async def lifespan(app):
     # --- Startup ---
+    startup.mark("server")
+    # build .gz/.br siblings of the template's css/js once, so serving
+    # them compressed costs nothing per request.
+    with startup.phase("precompress"):
+        written = precompress_directory(os.path.join("template", TEMPLATE))
+    print(f"Precompressed {written} static files.")
+
+    # a rename the last run didn't finish, before anything reads the pages
+    if recover_rename(RENAME_JOURNAL):
+        print("Finished an interrupted rename.")
+
+    # reading 20k page headers takes a while the first time, serve meanwhile
+    async def build_page_index():
+        changed = await asyncio.to_thread(page_index.sync)
+        print(f"Page index up to date, {changed} pages (re)indexed.")
+        removed = await asyncio.to_thread(remove_temporary_files, FILE_PATH)
+        if removed:
+            print(f"Removed {removed} temporary files left by interrupted saves.")
+        await asyncio.to_thread(page_completer.refresh)
+        if RELATED_PAGES and (changed or related_pages.is_empty()):
+            pages = await asyncio.to_thread(related_pages.rebuild)
+            print(f"Related pages worked out for {pages} pages.")
+        report = await asyncio.to_thread(page_index.link_report)
+        print(
+            f"Link report: {len(report['broken_links'])} broken links, "
+            f"{len(report['broken_anchors'])} links to missing sections, see /api/links/report"
+        )
+
+    index_task = asyncio.create_task(build_page_index())
+
+    if CHANGE_FEED:
+        with startup.phase("change feed"):
+            await change_feed.start()
+
     print("Starting Kernel Reaper...")
     # Create the background task
     reaper_task = asyncio.create_task(kernel_reaper_loop())
+    metrics_task = asyncio.create_task(metrics_flush_loop()) if SHARED_METRICS else None
+    startup.ready()
 
     yield
 
     # --- Shutdown ---
+    index_task.cancel()
     print("Stopping Kernel Reaper...")
     reaper_task.cancel()
     try:
         await reaper_task
     except asyncio.CancelledError:
         pass
+    if metrics_task is not None:
+        metrics_task.cancel()
+        await asyncio.gather(metrics_task, return_exceptions=True)
+    await jupyter_manager.shutdown()
+    if CHANGE_FEED:
+        await change_feed.stop()
 
 
 async def jupyter_websocket_endpoint(websocket: WebSocket):
@@ -879,6 +1656,42 @@ async def jupyter_websocket_endpoint(websocket: WebSocket):
         await websocket.close()
 
 
+async def live_reload_websocket(websocket: WebSocket):
+    """/ws/live?page=/wiki/Some/Page, tells the browser when the page's file changes"""
+    await websocket.accept()
+    url_pieces = parse_url_path(websocket.query_params.get("page", ""))
+    file_path = markdown_file_exists(url_pieces, any_type=False)
+    if not file_path:
+        await websocket.close()
+        return
+    await live_reload.watch(file_path, websocket)
+
+
+# /media/{width}/
+async def media_variant(request):
+    """An embedded image resized to one of IMAGE_VARIANT_WIDTHS, for srcset."""
+    width = request.path_params["width"]
+    url_pieces = parse_url_path(request.path_params["path"])
+    file_path = os.path.join(FILE_PATH, *url_pieces.path_list, url_pieces.file_name)
+    if url_pieces.file_ext.lower() not in ["png", "jpg", "jpeg", "gif", "webp"]:
+        raise HTTPException(status_code=404, detail="File not found.")
+    if not Path(file_path).exists():
+        raise HTTPException(status_code=404, detail="File not found.")
+
+    size = image_size(file_path)
+    if (
+        not RESIZE_IMAGES
+        or width not in IMAGE_VARIANT_WIDTHS
+        or size is None
+        or width >= size[0]
+    ):
+        return FileResponse(file_path)
+
+    # decoding and resizing a photo takes a while, keep it off the event loop
+    variant = await asyncio.to_thread(image_variants.get, file_path, width)
+    return FileResponse(variant, headers={"Cache-Control": "public, max-age=86400"})
+
+
 async def manage_jupyter(request):
     # /manage/jupyter
     k_list = jupyter_manager.list_kernels()
@@ -937,43 +1750,173 @@ async def markdown_convert(request):
     document_name = form["document_name"]
 
     url_pieces = parse_url_path(document_name)
-    path = url_pieces["path"]
+    path = url_pieces.path
     # page_name = markdown_page_name(url_pieces)
 
-    # custom extensions need to be configured on creation,
-    # and this one needs the current path
-    all_extensions = MD_EXTENSIONS + [
-        WikiLinkExtension(
-            base_url="/wiki",
-            current_path=path,
-            page_exists_callback=wikilink_page_check,
-        )
-    ]
+    md = make_markdown(path)
+    html = md.convert(raw_markdown)
+
+    return HTMLResponse(html)
+
+
+# /api/complete?q=...
+async def complete_pages(request):
+    """pages whose path or title match what's been typed so far, best first"""
+    query = request.query_params.get("q", "")
+    try:
+        limit = min(int(request.query_params.get("limit", 10)), 50)
+    except ValueError:
+        limit = 10
+    pages = await asyncio.to_thread(page_completer.complete, query, max(limit, 1))
+    return JSONResponse(
+        [
+            {"page": each["page"], "title": each["title"], "url": "/wiki/" + quote(each["page"])}
+            for each in pages
+        ]
+    )
+
+
+# /api/links/report
+async def link_report(request):
+    """every [[link]] to a page that doesn't exist, or to a section it doesn't have"""
+    report = await asyncio.to_thread(page_index.link_report)
+    return JSONResponse(
+        {
+            "broken_links": [
+                {"page": page, "target": target} for page, target in report["broken_links"]
+            ],
+            "broken_anchors": [
+                {"page": page, "target": target, "anchor": anchor}
+                for page, target, anchor in report["broken_anchors"]
+            ],
+        }
+    )
+
+
+# /debug/profile/
+async def debug_profile(request):
+    """Renders a page with every markdown processor timed, opt-in via config."""
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiling is disabled.")
+
+    url_pieces = parse_url_path(request.path_params["path"])
+    path = url_pieces.path
+    file_name_base = url_pieces.file_name_no_ext
+
+    file_path = markdown_file_exists(url_pieces, any_type=False)
+    if not file_path:
+        raise HTTPException(status_code=404, detail="File not found.")
+
+    with open(file_path, "r", newline="", encoding=DEFAULT_ENCODING) as file:
+        raw_page = file.read()
+
+    md = make_markdown(path)
+    cprofile_mode = request.query_params.get("cprofile")
+
+    if cprofile_mode:
+        # one conversion under cProfile
+        html, stats = cprofile_convert(md, raw_page)
+        if cprofile_mode == "dump":
+            return Response(
+                cprofile_dump(stats),
+                media_type="application/octet-stream",
+                headers={
+                    "Content-Disposition": f'attachment; filename="{file_name_base}.prof"'
+                },
+            )
+        raw_markdown = "```text\n" + cprofile_summary(stats) + "\n```\n"
+    else:
+        profile = MarkdownProfile()
+        profile.attach(md)
+        profile.convert(md, raw_page)
+        raw_markdown = profile.markdown_table()
+
+    page_url = "/".join(["/wiki", *url_pieces.path_list, file_name_base])
+    raw_markdown = (
+        f"[View page]({page_url}) | [Per processor](?) | "
+        "[cProfile summary](?cprofile=1) | [Download .prof](?cprofile=dump)\n\n"
+        + raw_markdown
+    )
 
+    template_path = os.path.join("template", TEMPLATE)
+    jinja_env = Environment(loader=FileSystemLoader(template_path))
+    doc_template = jinja_env.get_template("document.html")
+    doc_data = {}
+    doc_data["default_wiki_page"] = DEFAULT_WIKI_PAGE
+    doc_data["unlinked_title"] = f"Profile: {file_name_base}"
     md = markdown.Markdown(
-        extensions=all_extensions,
+        extensions=MD_EXTENSIONS,
         extension_configs=MD_EXTENSION_CONFIG,
         output_format="html",
     )
-    html = md.convert(raw_markdown)
+    doc_data["document"] = md.convert(raw_markdown)
+    response_content = doc_template.render(doc_data)
+    return HTMLResponse(response_content)
 
-    return HTMLResponse(html)
+
+# /debug/startup
+async def debug_startup(request):
+    """Startup phases of this process, and an import time breakdown of main."""
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiling is disabled.")
+
+    raw_markdown = "## This process\n\n" + startup.markdown_table()
+    # a fresh interpreter, so nothing is imported already
+    raw_markdown += "\n## import main\n\n" + await asyncio.to_thread(
+        import_time_report, "main"
+    )
+
+    template_path = os.path.join("template", TEMPLATE)
+    jinja_env = Environment(loader=FileSystemLoader(template_path))
+    doc_template = jinja_env.get_template("document.html")
+    doc_data = {}
+    doc_data["default_wiki_page"] = DEFAULT_WIKI_PAGE
+    doc_data["unlinked_title"] = "Startup"
+    md = markdown.Markdown(
+        extensions=MD_EXTENSIONS,
+        extension_configs=MD_EXTENSION_CONFIG,
+        output_format="html",
+    )
+    doc_data["document"] = md.convert(raw_markdown)
+    response_content = doc_template.render(doc_data)
+    return HTMLResponse(response_content)
 
 
 routes = [
     WebSocketRoute("/ws/run_jupyter", jupyter_websocket_endpoint),
+    WebSocketRoute("/ws/live", live_reload_websocket),
+    Route("/metrics", endpoint=metrics_endpoint, methods=["GET"]),
+    Route("/debug/profile/{path:path}", endpoint=debug_profile, methods=["GET"]),
+    Route("/debug/startup", endpoint=debug_startup, methods=["GET"]),
+    Route("/media/{width:int}/{path:path}", endpoint=media_variant, methods=["GET"]),
     Route("/manage/{path:path}", endpoint=manage_jupyter, methods=["GET", "POST"]),
     Route("/api/markdown/code/", endpoint=markdown_convert_code, methods=["POST"]),
     Route("/api/markdown/", endpoint=markdown_convert, methods=["POST"]),
+    Route("/api/save/", endpoint=save_patch, methods=["POST"]),
+    Route("/api/page/{path:path}", endpoint=page_fragment, methods=["GET"]),
+    Route("/api/complete", endpoint=complete_pages, methods=["GET"]),
+    Route("/api/links/report", endpoint=link_report, methods=["GET"]),
     Route("/index/{path:path}", endpoint=index_document, methods=["GET", "POST"]),
     Route("/delete/{path:path}", endpoint=delete_document, methods=["GET", "POST"]),
+    Route("/rename/{path:path}", endpoint=rename_document, methods=["GET", "POST"]),
     Route("/save/{path:path}", endpoint=save_document, methods=["GET", "POST"]),
     Route("/edit/{path:path}", endpoint=edit_document, methods=["GET", "POST"]),
     Route("/wiki/{path:path}", endpoint=view_document, methods=["GET", "POST"]),
     Route("/{path:path}", endpoint=catch_all, methods=["GET", "POST"]),
 ]
 
-app = Starlette(debug=True, routes=routes, lifespan=lifespan)
+middleware = [
+    Middleware(MetricsMiddleware),
+    Middleware(
+        CompressionMiddleware,
+        minimum_size=COMPRESSION_MINIMUM_SIZE,
+        compresslevel=COMPRESSION_LEVEL,
+    ),
+]
+
+startup.mark("kernel backend and routes")
+
+app = Starlette(debug=DEBUG, routes=routes, middleware=middleware, lifespan=lifespan)
 
 
 @app.on_event("shutdown")
@@ -0,0 +1,96 @@
+# attachments.py
+# Serving the non-markdown files in the vault: pdfs, images, canvases,
+# whatever else is in there.  starlette's FileResponse already does the
+# hard parts: Range and multi-range requests, reading in chunks so memory
+# stays flat however big the file, and handing the path to the server
+# (http.response.pathsend, zero copy) when the server supports it.
+# On top of that: content types, 304s for conditional requests, and not
+# letting html or svg from the vault run as part of the site.
+
+import mimetypes
+import os
+from email.utils import parsedate_to_datetime
+
+from starlette.responses import FileResponse, Response
+
+# types python doesn't know everywhere, and Obsidian's own
+mimetypes.add_type("application/json", ".canvas")
+mimetypes.add_type("text/markdown", ".md")
+mimetypes.add_type("image/webp", ".webp")
+mimetypes.add_type("image/avif", ".avif")
+mimetypes.add_type("image/heic", ".heic")
+
+# shown in the browser rather than downloaded, apart from these which
+# could run scripts in the wiki's origin
+DOWNLOAD_TYPES = ("text/html", "application/xhtml+xml", "image/svg+xml")
+
+# headers a 304 carries over from the full response
+NOT_MODIFIED_HEADERS = ("cache-control", "content-location", "etag", "expires", "vary")
+
+
+class AttachmentResponse(FileResponse):
+    # fewer, bigger reads for multi hundred MB files, still constant memory
+    chunk_size = 256 * 1024
+
+
+def _etag_matches(if_none_match, etag):
+    if if_none_match.strip() == "*":
+        return True
+    # weak comparison, W/"x" matches "x"
+    etag = etag.removeprefix("W/")
+    return any(
+        candidate.strip().removeprefix("W/") == etag
+        for candidate in if_none_match.split(",")
+    )
+
+
+def is_not_modified(request_headers, response_headers):
+    """would the browser's cached copy do, RFC 9110 13.2.2 order"""
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        etag = response_headers.get("etag")
+        return etag is not None and _etag_matches(if_none_match, etag)
+
+    if_modified_since = request_headers.get("if-modified-since")
+    last_modified = response_headers.get("last-modified")
+    if if_modified_since and last_modified:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(
+                if_modified_since
+            )
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def attachment_response(request, file_path, file_name):
+    """a vault file, with Range, conditional requests and its content type"""
+    stat = os.stat(file_path)
+    media_type = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+    if media_type.startswith("text/") and "charset" not in media_type:
+        media_type += "; charset=utf-8"
+    disposition = (
+        "attachment" if media_type.startswith(DOWNLOAD_TYPES) else "inline"
+    )
+
+    response = AttachmentResponse(
+        file_path,
+        media_type=media_type,
+        filename=file_name,
+        stat_result=stat,
+        content_disposition_type=disposition,
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Content-Type-Options": "nosniff",
+        },
+    )
+    if request.method in ("GET", "HEAD") and is_not_modified(
+        request.headers, response.headers
+    ):
+        headers = {
+            key: value
+            for key, value in response.headers.items()
+            if key in NOT_MODIFIED_HEADERS or key == "last-modified"
+        }
+        return Response(status_code=304, headers=headers)
+    return response
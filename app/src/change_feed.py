@@ -0,0 +1,340 @@
+# change_feed.py
+# Watches the wiki directory for changes made outside the app (Obsidian
+# on the host, git pull, ...) and tells whoever subscribed: the render
+# cache, and browsers viewing a page that changed.
+#
+# inotify through ctypes on linux, no extra dependency, and polling
+# where inotify isn't available or doesn't see the changes (bind mounts
+# from Docker Desktop on Windows and macOS).
+
+import asyncio
+import ctypes
+import os
+import struct
+
+from starlette.websockets import WebSocketDisconnect
+
+
+def _coalesce(previous, kind):
+    """what two events in a row on the same path amount to, None for nothing"""
+    if previous is None or previous == kind:
+        return kind
+    if "rescan" in (previous, kind):
+        return "rescan"
+    if previous == "created":
+        # created then deleted never existed as far as anyone knows
+        return None if kind == "deleted" else "created"
+    if previous == "deleted":
+        # deleted then written again, e.g. an editor's atomic save
+        return "modified"
+    return kind
+
+
+class ChangeFeed(object):
+    """
+    Collects file events, waits until they have been quiet for `debounce`
+    seconds (at most `max_delay` after the first one), then calls every
+    subscriber once with { path: "created" | "modified" | "deleted" }.
+    Paths start with root, e.g. "wiki/some/Page.md".  A "rescan" entry
+    means events were lost under that path and anything may have changed.
+    """
+
+    def __init__(
+        self,
+        root,
+        mode="auto",
+        debounce=0.25,
+        max_delay=2.0,
+        poll_interval=2.0,
+        include_hidden=False,
+    ):
+        self.root = os.path.normpath(root)
+        self.mode = mode
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.include_hidden = include_hidden
+        self.subscribers = []
+        self.pending = {}
+        self.first_event = None
+        self.last_event = None
+        self.wakeup = None
+        self.watcher = None
+        self.tasks = []
+
+    def subscribe(self, callback):
+        """callback(changes), a plain function or a coroutine function"""
+        self.subscribers.append(callback)
+
+    def record(self, path, kind):
+        now = asyncio.get_running_loop().time()
+        self.pending[path] = _coalesce(self.pending.get(path), kind)
+        if self.first_event is None:
+            self.first_event = now
+        self.last_event = now
+        self.wakeup.set()
+
+    def hidden(self, name):
+        return not self.include_hidden and name.startswith(".")
+
+    async def start(self):
+        self.wakeup = asyncio.Event()
+        if self.mode in ("auto", "inotify"):
+            try:
+                self.watcher = _InotifyWatcher(self)
+            except OSError as e:
+                if self.mode == "inotify":
+                    raise
+                print(f"inotify unavailable ({e}), polling for file changes instead")
+        if self.watcher is None:
+            self.watcher = _PollingWatcher(self)
+        # setting up walks the whole vault, do it in the background
+        # so pages are served meanwhile
+        self.tasks.append(asyncio.create_task(self._watch()))
+        self.tasks.append(asyncio.create_task(self._dispatch_loop()))
+
+    async def _watch(self):
+        await self.watcher.start()
+        print(f"Watching {self.root} for changes ({self.watcher.name}).")
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        for task in self.tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self.tasks = []
+        if self.watcher is not None:
+            await self.watcher.stop()
+            self.watcher = None
+
+    async def _dispatch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.wakeup.wait()
+            # let a burst of events (a sync, a save in several writes) settle
+            while True:
+                wait = (
+                    min(
+                        self.last_event + self.debounce,
+                        self.first_event + self.max_delay,
+                    )
+                    - loop.time()
+                )
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+
+            changes = {path: kind for path, kind in self.pending.items() if kind}
+            self.pending = {}
+            self.first_event = None
+            self.wakeup.clear()
+            if changes:
+                await self.publish(changes)
+
+    async def publish(self, changes):
+        for callback in self.subscribers:
+            try:
+                result = callback(changes)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                print(f"Change feed subscriber {callback!r} failed: {e}")
+
+
+class _InotifyWatcher(object):
+    """one inotify watch per directory, new directories are watched as they appear"""
+
+    name = "inotify"
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    MASK = (
+        IN_MODIFY
+        | IN_CLOSE_WRITE
+        | IN_MOVED_FROM
+        | IN_MOVED_TO
+        | IN_CREATE
+        | IN_DELETE
+        | IN_DELETE_SELF
+    )
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self, feed):
+        self.feed = feed
+        libc = ctypes.CDLL(None, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("no inotify in this libc")
+        self.libc = libc
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # { watch descriptor: directory }
+        self.directories = {}
+
+    def add_tree(self, directory, report=False):
+        """watch directory and everything under it, report its files as created"""
+        for current, dirnames, filenames in os.walk(directory):
+            dirnames[:] = [name for name in dirnames if not self.feed.hidden(name)]
+            wd = self.libc.inotify_add_watch(
+                self.fd, os.fsencode(current), self.MASK
+            )
+            if wd < 0:
+                print(f"Can't watch {current}: {os.strerror(ctypes.get_errno())}")
+                continue
+            self.directories[wd] = current
+            if report:
+                for name in filenames:
+                    if not self.feed.hidden(name):
+                        self.feed.record(os.path.join(current, name), "created")
+
+    async def start(self):
+        # a big vault has a lot of directories, keep the walk off the loop
+        await asyncio.to_thread(self.add_tree, self.feed.root)
+        asyncio.get_running_loop().add_reader(self.fd, self.read_events)
+
+    async def stop(self):
+        asyncio.get_running_loop().remove_reader(self.fd)
+        os.close(self.fd)
+
+    def read_events(self):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            self.handle(wd, mask, os.fsdecode(name))
+
+    def handle(self, wd, mask, name):
+        if mask & self.IN_Q_OVERFLOW:
+            self.feed.record(self.feed.root, "rescan")
+            return
+        if mask & self.IN_IGNORED:
+            self.directories.pop(wd, None)
+            return
+        directory = self.directories.get(wd)
+        if directory is None or mask & self.IN_DELETE_SELF:
+            return
+        if self.feed.hidden(name):
+            return
+        path = os.path.join(directory, name)
+
+        if mask & self.IN_ISDIR:
+            if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                self.add_tree(path, report=True)
+            elif mask & self.IN_MOVED_FROM:
+                # its files are gone without an event each
+                self.feed.record(path, "rescan")
+            return
+
+        if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+            self.feed.record(path, "created")
+        elif mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+            self.feed.record(path, "deleted")
+        else:
+            self.feed.record(path, "modified")
+
+
+class _PollingWatcher(object):
+    """compares mtimes and sizes of every file every poll_interval seconds"""
+
+    name = "polling"
+
+    def __init__(self, feed):
+        self.feed = feed
+        self.snapshot = {}
+        self.task = None
+
+    def scan(self):
+        files = {}
+        for current, dirnames, filenames in os.walk(self.feed.root):
+            dirnames[:] = [name for name in dirnames if not self.feed.hidden(name)]
+            for name in filenames:
+                if self.feed.hidden(name):
+                    continue
+                path = os.path.join(current, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files[path] = (stat.st_mtime_ns, stat.st_size)
+        return files
+
+    async def start(self):
+        self.snapshot = await asyncio.to_thread(self.scan)
+        self.task = asyncio.create_task(self.poll_loop())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+    async def poll_loop(self):
+        while True:
+            await asyncio.sleep(self.feed.poll_interval)
+            current = await asyncio.to_thread(self.scan)
+            for path, stamp in current.items():
+                previous = self.snapshot.get(path)
+                if previous is None:
+                    self.feed.record(path, "created")
+                elif previous != stamp:
+                    self.feed.record(path, "modified")
+            for path in self.snapshot.keys() - current.keys():
+                self.feed.record(path, "deleted")
+            self.snapshot = current
+
+
+class LiveReload(object):
+    """
+    Browsers viewing a page, keyed by its file, each with a websocket
+    open on /ws/live.  Subscribed to the change feed, tells them when
+    their page's file changes so they can reload.
+    """
+
+    def __init__(self):
+        # { "wiki/some/Page.md": set(websocket) }
+        self.viewers = {}
+
+    async def watch(self, file_path, websocket):
+        """keep websocket registered for file_path until the browser goes away"""
+        key = os.path.normpath(file_path)
+        self.viewers.setdefault(key, set()).add(websocket)
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            viewers = self.viewers.get(key)
+            if viewers is not None:
+                viewers.discard(websocket)
+                if not viewers:
+                    del self.viewers[key]
+
+    async def publish(self, changes):
+        for path, kind in changes.items():
+            for websocket in list(self.viewers.get(os.path.normpath(path), ())):
+                try:
+                    await websocket.send_json({"event": "page_changed", "kind": kind})
+                except Exception:
+                    # it's gone, watch() cleans up
+                    pass
@@ -0,0 +1,205 @@
+# completion.py
+# Page names for the quick switcher and [[ autocompletion in the editor.
+# An in-memory trigram index over every page's path and title, made from
+# the page index and kept up to date with it.  Entries are numbered
+# shortest first, so walking a posting list in order meets the likeliest
+# pages first and can stop early.
+
+import bisect
+import heapq
+import math
+import re
+import threading
+from array import array
+from collections import Counter
+
+SEPARATORS = re.compile(r"[\s_\-./]+")
+
+# exact matches collected before ranking, enough to have the best ones
+EXACT_CANDIDATES = 200
+
+# postings counted for fuzzy matches, past the few every match is in
+FUZZY_POSTINGS = 10000
+
+# fuzzy candidates, those sharing the most trigrams, checked properly
+FUZZY_CANDIDATES = 300
+
+
+def _normal(text):
+    return SEPARATORS.sub(" ", text.lower()).strip()
+
+
+def _trigrams(text):
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+class PageCompleter(object):
+    """
+    complete("meet notes") -> [{ page, title }] best first.  Substring
+    matches of the query rank first, then pages sharing at least a third
+    of its trigrams, so typos and missing words still find things.
+    Pages changed since (by any worker) are swapped in on the next query,
+    only a lot of them at once builds it all again.
+    """
+
+    def __init__(self, page_index, limit=10):
+        self.page_index = page_index
+        self.limit = limit
+        self.generation = None
+        self.lock = threading.Lock()
+        self.entries = []
+        self.numbers = {}
+        self.postings = {}
+        self.prefixes = []
+        self.removed = 0
+
+    @staticmethod
+    def _entry(page, title):
+        name, path, normal_title = (
+            _normal(page.rpartition("/")[2]),
+            _normal(page),
+            _normal(title),
+        )
+        # what's searched, spaces around for whole word matches
+        text = f" {path} {normal_title} "
+        return (name, normal_title, path, text, page, title)
+
+    def _build(self, rows):
+        entries = sorted(
+            (self._entry(page, title) for page, title in rows),
+            key=lambda entry: (len(entry[3]), entry[2]),
+        )
+        postings = {}
+        for number, entry in enumerate(entries):
+            for trigram in _trigrams(entry[3]):
+                posting = postings.get(trigram)
+                if posting is None:
+                    posting = postings[trigram] = array("I")
+                posting.append(number)
+        # names and titles in order, for queries too short for trigrams
+        prefixes = sorted(
+            [(entry[0], number) for number, entry in enumerate(entries)]
+            + [(entry[1], number) for number, entry in enumerate(entries)]
+        )
+        self.entries = entries
+        self.numbers = {entry[4]: number for number, entry in enumerate(entries)}
+        self.postings = postings
+        self.prefixes = prefixes
+        self.removed = 0
+
+    def _remove(self, page):
+        number = self.numbers.pop(page, None)
+        if number is not None:
+            # left in the postings, skipped when found
+            self.entries[number] = None
+            self.removed += 1
+
+    def _add(self, page, title):
+        entry = self._entry(page, title)
+        number = len(self.entries)
+        self.entries.append(entry)
+        self.numbers[page] = number
+        for trigram in _trigrams(entry[3]):
+            posting = self.postings.get(trigram)
+            if posting is None:
+                posting = self.postings[trigram] = array("I")
+            posting.append(number)
+        bisect.insort(self.prefixes, (entry[0], number))
+        bisect.insort(self.prefixes, (entry[1], number))
+
+    def refresh(self):
+        """catch up with pages added, removed or retitled since"""
+        if self.page_index.generation() == self.generation:
+            return
+        with self.lock:
+            generation, pages = (
+                (self.page_index.generation(), None)
+                if self.generation is None
+                else self.page_index.changes_since(self.generation)
+            )
+            if generation == self.generation:
+                return
+            if pages is None or len(pages) > len(self.numbers) // 10:
+                self._build(self.page_index.titles())
+            else:
+                for page in pages:
+                    self._remove(page)
+                    row = self.page_index.page(page)
+                    if row is not None:
+                        self._add(page, row["title"])
+                if self.removed > len(self.numbers) // 5:
+                    self._build(self.page_index.titles())
+            self.generation = generation
+
+    def complete(self, query, limit=None):
+        self.refresh()
+        limit = limit or self.limit
+        query = _normal(query)
+        entries, postings, prefixes = self.entries, self.postings, self.prefixes
+        if not query:
+            return []
+
+        if len(query) < 3:
+            numbers = set()
+            start = bisect.bisect_left(prefixes, (query,))
+            for position in range(start, len(prefixes)):
+                text, number = prefixes[position]
+                if not text.startswith(query) or len(numbers) >= EXACT_CANDIDATES:
+                    break
+                if entries[number] is not None:
+                    numbers.add(number)
+            best = sorted(numbers)[:limit]
+            return [self._result(entries[number]) for number in best]
+
+        trigrams = sorted(_trigrams(query), key=lambda t: len(postings.get(t, ())))
+        scores = {}
+
+        # the query as it is, in path or title
+        for number in postings.get(trigrams[0], ()):
+            entry = entries[number]
+            if entry is not None and query in entry[3]:
+                scores[number] = self._score(query, entry, 1.0)
+                if len(scores) >= EXACT_CANDIDATES:
+                    break
+
+        # a long query found as it is was typed right, no need for near misses
+        if len(scores) < limit and not (scores and len(query) >= 8):
+            # pages with at least a third of the query's trigrams have one
+            # of the rarest len - third + 1, count those (and more while
+            # it's cheap) then check the ones with the most properly
+            needed = max(1, math.ceil(len(trigrams) / 3))
+            counts = Counter()
+            counted = 0
+            for position, trigram in enumerate(trigrams):
+                posting = postings.get(trigram, ())
+                if position > len(trigrams) - needed and counted + len(posting) > FUZZY_POSTINGS:
+                    break
+                counts.update(posting)
+                counted += len(posting)
+            for number, _ in counts.most_common(FUZZY_CANDIDATES):
+                entry = entries[number]
+                if entry is None or number in scores:
+                    continue
+                shared = sum(1 for trigram in trigrams if trigram in entry[3])
+                if shared >= needed:
+                    scores[number] = self._score(query, entry, shared / len(trigrams) / 2)
+
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
+        return [self._result(entries[number]) for number, _ in best]
+
+    @staticmethod
+    def _score(query, entry, match):
+        name, title, path, text = entry[:4]
+        score = match
+        if name.startswith(query) or title.startswith(query):
+            score += 1.0
+        elif query in name or query in title:
+            score += 0.5
+        if f" {query} " in text:
+            score += 0.25
+        # shorter paths first, among equals
+        return score - len(path) / 1000
+
+    @staticmethod
+    def _result(entry):
+        return {"page": entry[4], "title": entry[5]}
@@ -0,0 +1,260 @@
+# compression.py
+# Negotiated gzip / brotli compression for dynamic responses, and
+# precompressed .gz / .br siblings for the static files in the template folder.
+
+import gzip
+import mimetypes
+import os
+import uuid
+from pathlib import Path
+
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipResponder, IdentityResponder
+from starlette.responses import FileResponse
+
+from src.metrics import record_cache
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+
+# only bother compressing things that are text-like,
+# images and such are already compressed.
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+)
+
+# static files that get a precompressed sibling at startup
+PRECOMPRESS_EXTENSIONS = [".css", ".js", ".svg"]
+
+# file extension of the precompressed sibling for each encoding
+ENCODING_SUFFIX = {"br": ".br", "gzip": ".gz"}
+
+
+def available_encodings():
+    """encodings this server can produce, best first"""
+    if brotli is not None:
+        return ["br", "gzip"]
+    return ["gzip"]
+
+
+def choose_encoding(accept_encoding, available=None):
+    """
+    Pick the best encoding from an Accept-Encoding header.
+    Honors q-values, q=0 means "not acceptable".  Returns None for identity.
+    """
+    if available is None:
+        available = available_encodings()
+    if not accept_encoding:
+        return None
+
+    q_values = {}
+    for part in accept_encoding.split(","):
+        pieces = part.strip().split(";")
+        name = pieces[0].strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in pieces[1:]:
+            param = param.strip()
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        q_values[name] = q
+
+    best = None
+    best_q = 0.0
+    for encoding in available:
+        q = q_values.get(encoding, q_values.get("*", 0.0))
+        # ties go to the earlier (preferred) encoding
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def is_compressible(content_type):
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+class _TypeCheckMixin:
+    """
+    Skip compression for content types that don't benefit from it, and
+    for ranges of a file, the byte offsets are into the uncompressed file.
+    """
+
+    async def send_with_compression(self, message):
+        await super().send_with_compression(message)
+        if message["type"] == "http.response.start":
+            headers = Headers(raw=message["headers"])
+            if (
+                not is_compressible(headers.get("content-type", ""))
+                or "content-range" in headers
+                or message.get("status") == 206
+            ):
+                self.content_type_is_excluded = True
+
+
+class _GZipResponder(_TypeCheckMixin, GZipResponder):
+    def apply_compression(self, body, *, more_body):
+        self.gzip_file.write(body)
+        if more_body:
+            # sync flush so streamed chunks reach the browser right away
+            self.gzip_file.flush()
+        else:
+            self.gzip_file.close()
+
+        body = self.gzip_buffer.getvalue()
+        self.gzip_buffer.seek(0)
+        self.gzip_buffer.truncate()
+        return body
+
+
+class _BrotliResponder(_TypeCheckMixin, IdentityResponder):
+    content_encoding = "br"
+
+    def __init__(self, app, minimum_size, quality=5):
+        super().__init__(app, minimum_size)
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def apply_compression(self, body, *, more_body):
+        data = self.compressor.process(body)
+        if more_body:
+            return data + self.compressor.flush()
+        return data + self.compressor.finish()
+
+
+class _IdentityResponder(_TypeCheckMixin, IdentityResponder):
+    content_encoding = "identity"
+
+
+class CompressionMiddleware:
+    """
+    Like starlette's GZipMiddleware, but negotiates brotli when the
+    brotli package is installed and the browser asks for it.
+    Responses that already carry a Content-Encoding (the precompressed
+    static files) pass through untouched.
+    """
+
+    def __init__(self, app, minimum_size=500, compresslevel=6, brotli_quality=5):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.compresslevel = compresslevel
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        encoding = choose_encoding(headers.get("Accept-Encoding", ""))
+
+        if encoding == "br":
+            responder = _BrotliResponder(
+                self.app, self.minimum_size, quality=self.brotli_quality
+            )
+        elif encoding == "gzip":
+            responder = _GZipResponder(
+                self.app, self.minimum_size, compresslevel=self.compresslevel
+            )
+        else:
+            responder = _IdentityResponder(self.app, self.minimum_size)
+
+        await responder(scope, receive, send)
+
+
+def _compress_bytes(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def precompress_directory(directory, extensions=None):
+    """
+    Write .gz (and .br if brotli is installed) next to every static file
+    in directory.  Only rewrites siblings that are missing or older than
+    the source, so restarts are cheap.  Returns the number of files written.
+    """
+    if extensions is None:
+        extensions = PRECOMPRESS_EXTENSIONS
+
+    written = 0
+    for root, dirs, files in os.walk(directory):
+        for name in files:
+            source = Path(root, name)
+            if source.suffix.lower() not in extensions:
+                continue
+            source_mtime = source.stat().st_mtime
+            data = None
+            for encoding in available_encodings():
+                target = Path(str(source) + ENCODING_SUFFIX[encoding])
+                try:
+                    if target.stat().st_mtime >= source_mtime:
+                        continue
+                except FileNotFoundError:
+                    pass
+                if data is None:
+                    data = source.read_bytes()
+                compressed = _compress_bytes(data, encoding)
+                if len(compressed) >= len(data):
+                    # not worth it, and don't leave an old sibling around
+                    try:
+                        target.unlink()
+                    except FileNotFoundError:
+                        pass
+                    continue
+                # workers starting together all do this, each writes its
+                # own temporary file and whichever rename is last wins
+                tmp = target.with_name(f"{target.name}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp")
+                try:
+                    tmp.write_bytes(compressed)
+                    os.replace(tmp, target)
+                except BaseException:
+                    try:
+                        tmp.unlink()
+                    except FileNotFoundError:
+                        pass
+                    raise
+                written += 1
+    return written
+
+
+def static_file_response(request, file_path, file_name):
+    """
+    FileResponse for a static file, swapping in a precompressed sibling
+    when the browser accepts it.  FileResponse hands the sibling off to
+    the server with sendfile / pathsend, so nothing is compressed per request.
+    """
+    media_type = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+    headers = {"Vary": "Accept-Encoding"}
+
+    if is_compressible(media_type):
+        available = [
+            encoding
+            for encoding in available_encodings()
+            if Path(str(file_path) + ENCODING_SUFFIX[encoding]).exists()
+        ]
+        accept_encoding = request.headers.get("Accept-Encoding", "")
+        encoding = choose_encoding(accept_encoding, available)
+        if choose_encoding(accept_encoding):
+            # the browser wanted it compressed, did we have a copy ready?
+            record_cache("static_precompressed", encoding is not None)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+            return FileResponse(
+                str(file_path) + ENCODING_SUFFIX[encoding],
+                media_type=media_type,
+                headers=headers,
+            )
+
+    return FileResponse(
+        file_path, filename=file_name, media_type=media_type, headers=headers
+    )
@@ -1,25 +1,75 @@
 # jupyter_client.py
+import abc
 import json
+import os
 import uuid
 import asyncio
-import httpx
-import websockets
+import time
 from datetime import datetime, timezone
 
-JUPYTER_HOST = "http://jupyter:8888"  # Hostname defined in docker-compose
-JUPYTER_WS = "ws://jupyter:8888"
+from src.metrics import registry, KERNEL_SPAWN, KERNEL_EXECUTE, KERNEL_OUTPUT_BYTES
 
+from src.kernel_registry import KernelRegistry, SharedKernelMap, WORKER_ID
 
-class AsyncJupyterManager(object):
-    def __init__(self):
-        # In-memory store: { "page_id": "kernel_uuid" }
-        self.kernels = {}
+from config import (
+    JUPYTER_HOST,
+    JUPYTER_WS,
+    JUPYTER_BACKEND,
+    STATE_DIRECTORY,
+    SHARED_KERNEL_REGISTRY,
+)
+
+# how long one worker may wait for another to finish starting a page's kernel
+SPAWN_LEASE_SECONDS = 60
+
+
+class KernelBackend(abc.ABC):
+    """
+    What the wiki needs from a place that runs code.  Kernels are mapped
+    to the page that started them, and output is yielded as
+    wrap_msg() json strings ready to send to the browser.
+
+    Subclasses implement _create_kernel, _execute_code_stream,
+    list_kernels, delete_kernel_by_id and prune_stale_kernels.
+    """
 
     def __new__(cls):
-        if not hasattr(cls, "instance"):
-            cls.instance = super(AsyncJupyterManager, cls).__new__(cls)
+        # one instance per backend class
+        if "instance" not in cls.__dict__:
+            cls.instance = super(KernelBackend, cls).__new__(cls)
         return cls.instance
 
+    def __init__(self):
+        if hasattr(self, "kernels"):
+            # already set up, don't lose the page mapping
+            return
+        # shared with the other workers, or None for an in-process dict
+        self.registry = self.make_registry()
+        # { "page_id": "kernel_uuid" }
+        if self.registry is not None:
+            self.kernels = SharedKernelMap(self.registry)
+        else:
+            self.kernels = {}
+        # one lock per page, so concurrent runs on a new page share one kernel
+        self.spawn_locks = {}
+
+    def make_registry(self):
+        return None
+
+    def is_reaper(self, ttl):
+        """
+        True if this worker should run the reaper.  With a shared registry
+        only the holder of the reaper lease does, otherwise every worker
+        looks after its own kernels.
+        """
+        if self.registry is None:
+            return True
+        return self.registry.acquire_lease("kernel_reaper", WORKER_ID, ttl=ttl)
+
+    def release_reaper(self):
+        if self.registry is not None:
+            self.registry.release_lease("kernel_reaper", WORKER_ID)
+
     async def get_or_create_kernel(self, page_id: str):
         """
         Checks if a kernel exists for the page. If not, creates one.
@@ -28,18 +78,178 @@ class AsyncJupyterManager(object):
             # Optionally verify kernel is still alive via API here
             return self.kernels[page_id]
 
+        lock = self.spawn_locks.setdefault(page_id, asyncio.Lock())
+        async with lock:
+            if page_id in self.kernels:
+                # someone else started it while we waited
+                return self.kernels[page_id]
+            if self.registry is not None:
+                kernel_id = await self._wait_for_spawn_lease(page_id)
+                if kernel_id is not None:
+                    # another worker started it
+                    return kernel_id
+            try:
+                start = time.perf_counter()
+                kernel_id = await self._create_kernel(page_id)
+                KERNEL_SPAWN.observe(time.perf_counter() - start)
+                self.kernels[page_id] = kernel_id
+                return kernel_id
+            finally:
+                if self.registry is not None:
+                    self.registry.release_lease(f"spawn:{page_id}", WORKER_ID)
+
+    async def _wait_for_spawn_lease(self, page_id):
+        """
+        Take the cross-worker lease for starting this page's kernel.
+        Returns a kernel id if another worker got there first, else None
+        once we hold the lease.
+        """
+        lease = f"spawn:{page_id}"
+        while not self.registry.acquire_lease(lease, WORKER_ID, SPAWN_LEASE_SECONDS):
+            await asyncio.sleep(0.1)
+            if (kernel_id := self.registry.get(page_id)) is not None:
+                return kernel_id
+        return self.registry.get(page_id)
+
+    @abc.abstractmethod
+    async def _create_kernel(self, page_id):
+        """start a kernel, return its id"""
+
+    @abc.abstractmethod
+    def _execute_code_stream(self, kernel_id, code):
+        """an async generator, yields wrap_msg() strings until the kernel goes idle"""
+
+    @abc.abstractmethod
+    async def list_kernels(self, max_age_seconds=3600):
+        """the running kernels, with their age and the pages they're mapped to"""
+
+    @abc.abstractmethod
+    async def delete_kernel_by_id(self, kernel_id):
+        """shut a kernel down and unmap it from its pages"""
+
+    @abc.abstractmethod
+    async def prune_stale_kernels(self, max_age_seconds=3600):
+        """delete the kernels idle for more than max_age_seconds"""
+
+    async def shutdown(self):
+        """called when the app stops"""
+        pass
+
+    def pages_for_kernel(self, kernel_id):
+        return [page for page, k_id in self.kernels.items() if k_id == kernel_id]
+
+    def _unmap_kernel(self, kernel_id):
+        # We must find which page owns this kernel_id
+        for page in self.pages_for_kernel(kernel_id):
+            del self.kernels[page]
+            print(f"   - Unmapped from page: {page}")
+
+    def wrap_msg(self, msg_type, msg_data):
+        return json.dumps({msg_type: msg_data})
+
+    async def execute_code_stream(self, kernel_id: str, code: str):
+        """
+        Yields output chunks as they arrive from Jupyter.
+        """
+        start = time.perf_counter()
+        output_bytes = 0
+        if self.registry is not None:
+            self.registry.touch(kernel_id)
+        try:
+            async for chunk in self._execute_code_stream(kernel_id, code):
+                output_bytes += len(chunk)
+                yield chunk
+        finally:
+            KERNEL_EXECUTE.observe(time.perf_counter() - start)
+            KERNEL_OUTPUT_BYTES.observe(output_bytes)
+
+    def format_message(self, msg_type, content):
+        """
+        Turns one iopub message into the html chunks shown under the cell.
+        Shared by every backend so the browser sees the same stream.
+        """
+        # Standard Output (print statements)
+        if msg_type == "stream":
+            # yield content["text"]
+            d = content["text"]
+            d = d.replace("\n", "<br/>")
+            yield self.wrap_msg("html", d)
+
+        # Errors
+        elif msg_type == "error":
+            d = f"<pre>Error: {content['evalue']}</pre>"
+            yield self.wrap_msg("html", d)
+
+        #
+        elif (msg_type == "execute_result") | (msg_type == "display_data"):
+            data = content["data"]
+            # print(data)
+            if (d := data.get("text/plain")) and not data.get(
+                "application/vnd.jupyter.widget-view+json"
+            ):
+                # print("this looks like TEXT ", d)
+                # this doesn't seem to be getting called anymore.
+                d = f"<pre>{d}</pre>"
+                yield self.wrap_msg("html", d)
+
+            if d := data.get("text/html"):
+                # print("this looks like HTML", d)
+                yield self.wrap_msg("html", d)
+            if d := data.get("image/png"):
+                d = f'<img src="data:image/png;base64,{d}">'
+                yield self.wrap_msg("html", d)
+            if d := data.get("image/svg+xml"):
+                yield self.wrap_msg("html", d)
+            # //  ipywidgets  // not working
+            # if viewSpec := data.get("application/vnd.jupyter.widget-view+json"):
+            #     #print("~_~_~_~_~_~_~_~_~_~_~_~_~_~")
+            #     ## print(msg)
+            #     #print(data)
+            #     #print(viewSpec)
+            #     #print("+#+#+#+#+#+#+#+#+#+#+#+#+#+")
+            #     ## yield json.dumps({"hello": "world"})
+
+            #     modelId = viewSpec["model_id"]
+            #     d = f"""
+            #     <script>
+            #         const mgr = await ensureWidgetManager();
+            #         const model = await mgr.get_model("{modelId}");
+
+            #        if (model):
+            #           const w = await mgr.create_view(model);
+            #           await mgr.display_view(undefined, w, {{ el: this}});
+            #     </script>
+            #     """
+
+            #     yield self.wrap_msg("js", d)
+
+
+class AsyncJupyterManager(KernelBackend):
+    """Kernels on a jupyter-server, over its REST api and websockets."""
+
+    def make_registry(self):
+        if not SHARED_KERNEL_REGISTRY:
+            return None
+        return KernelRegistry(os.path.join(STATE_DIRECTORY, "kernels.sqlite3"))
+
+    async def _create_kernel(self, page_id):
+        # httpx and websockets are imported on first use,
+        # most pages never run code and startup shouldn't pay for them
+        import httpx
+
         async with httpx.AsyncClient() as client:
             # Spawn a new kernel
             response = await client.post(f"{JUPYTER_HOST}/api/kernels")
             if response.status_code == 201:
                 kernel_id = response.json()["id"]
-                self.kernels[page_id] = kernel_id
                 return kernel_id
             else:
                 raise Exception(f"Failed to spawn kernel: {response.text}")
 
     async def list_kernels(self, max_age_seconds=3600):
 
+        import httpx
+
         kernel_list = []
 
         async with httpx.AsyncClient() as client:
@@ -67,10 +277,7 @@ class AsyncJupyterManager(object):
 
                     idle_seconds = (now - last_activity).total_seconds()
 
-                    page_list = []
-                    for each_page in self.kernels:
-                        if kernel_id == self.kernels[each_page]:
-                            page_list.append(each_page)
+                    page_list = self.pages_for_kernel(kernel_id)
 
                     kc = kernel.copy()
                     kc.update({"pages": page_list, "idle": idle_seconds})
@@ -88,21 +295,19 @@ class AsyncJupyterManager(object):
         return kernel_list
 
     async def delete_kernel_by_id(self, kernel_id):
+        import httpx
+
         async with httpx.AsyncClient() as client:
             try:
                 await self._delete_kernel(client, kernel_id)
             except Exception as e:
                 print(f"Error deleting kernel: {e}")
 
-    def wrap_msg(self, msg_type, msg_data):
-        return json.dumps({msg_type: msg_data})
-
-    async def execute_code_stream(self, kernel_id: str, code: str):
-        """
-        Yields output chunks as they arrive from Jupyter.
-        """
+    async def _execute_code_stream(self, kernel_id, code):
         ws_url = f"{JUPYTER_WS}/api/kernels/{kernel_id}/channels"
 
+        import websockets
+
         async with websockets.connect(ws_url) as ws:
             msg_id = uuid.uuid4().hex
 
@@ -138,68 +343,15 @@ class AsyncJupyterManager(object):
 
                 msg_type = msg["msg_type"]
                 content = msg["content"]
-                # print("_____________________________")
-                # print(msg)
-
-                # Standard Output (print statements)
-                if msg_type == "stream":
-                    # yield content["text"]
-                    d = content["text"]
-                    d = d.replace("\n", "<br/>")
-                    yield self.wrap_msg("html", d)
-
-                # Errors
-                elif msg_type == "error":
-                    d = f"<pre>Error: {content['evalue']}</pre>"
-                    yield self.wrap_msg("html", d)
-
-                #
-                elif (msg_type == "execute_result") | (msg_type == "display_data"):
-                    data = content["data"]
-                    # print(data)
-                    if (d := data.get("text/plain")) and not data.get(
-                        "application/vnd.jupyter.widget-view+json"
-                    ):
-                        # print("this looks like TEXT ", d)
-                        # this doesn't seem to be getting called anymore.
-                        d = f"<pre>{d}</pre>"
-                        yield self.wrap_msg("html", d)
-
-                    if d := data.get("text/html"):
-                        # print("this looks like HTML", d)
-                        yield self.wrap_msg("html", d)
-                    if d := data.get("image/png"):
-                        d = f'<img src="data:image/png;base64,{d}">'
-                        yield self.wrap_msg("html", d)
-                    if d := data.get("image/svg+xml"):
-                        yield self.wrap_msg("html", d)
-                    # //  ipywidgets  // not working
-                    # if viewSpec := data.get("application/vnd.jupyter.widget-view+json"):
-                    #     #print("~_~_~_~_~_~_~_~_~_~_~_~_~_~")
-                    #     ## print(msg)
-                    #     #print(data)
-                    #     #print(viewSpec)
-                    #     #print("+#+#+#+#+#+#+#+#+#+#+#+#+#+")
-                    #     ## yield json.dumps({"hello": "world"})
-
-                    #     modelId = viewSpec["model_id"]
-                    #     d = f"""
-                    #     <script>
-                    #         const mgr = await ensureWidgetManager();
-                    #         const model = await mgr.get_model("{modelId}");
-
-                    #        if (model):
-                    #           const w = await mgr.create_view(model);
-                    #           await mgr.display_view(undefined, w, {{ el: this}});
-                    #     </script>
-                    #     """
-
-                    #     yield self.wrap_msg("js", d)
 
                 # Execution Finished
-                elif msg_type == "status":
+                if msg_type == "status":
                     if content["execution_state"] == "idle":
                         break
+                    continue
+
+                for chunk in self.format_message(msg_type, content):
+                    yield chunk
 
     async def prune_stale_kernels(self, max_age_seconds=3600):
         """
@@ -208,6 +360,8 @@ class AsyncJupyterManager(object):
         """
         print(f"[{datetime.now()}] 🧹 Reaper running...")
 
+        import httpx
+
         async with httpx.AsyncClient() as client:
             try:
                 # 1. Get list of running kernels from Docker service
@@ -218,6 +372,13 @@ class AsyncJupyterManager(object):
 
                 active_kernels = response.json()
 
+                # forget pages whose kernel is gone, e.g. jupyter restarted
+                active_ids = {kernel["id"] for kernel in active_kernels}
+                for page, kernel_id in list(self.kernels.items()):
+                    if kernel_id not in active_ids:
+                        print(f"   - Kernel {kernel_id} is gone, unmapping {page}")
+                        del self.kernels[page]
+
                 for kernel in active_kernels:
                     kernel_id = kernel["id"]
                     last_activity_str = kernel["last_activity"]
@@ -246,15 +407,27 @@ class AsyncJupyterManager(object):
         # remove kernel from jupyter server
         await client.delete(f"{JUPYTER_HOST}/api/kernels/{kernel_id}")
 
-        # We must find which page owns this kernel_id
-        pages_to_remove = [
-            page for page, k_id in self.kernels.items() if k_id == kernel_id
-        ]
+        self._unmap_kernel(kernel_id)
 
-        for page in pages_to_remove:
-            del self.kernels[page]
-            print(f"   - Unmapped from page: {page}")
+
+def create_kernel_backend(name):
+    """the backend named by JUPYTER_BACKEND in config.py"""
+    if name == "local":
+        from src.local_kernels import AsyncLocalKernelManager
+
+        return AsyncLocalKernelManager()
+    if name != "server":
+        print(f"Unknown JUPYTER_BACKEND {name!r}, using the jupyter-server backend")
+    return AsyncJupyterManager()
 
 
 # Singleton instance for the app
-jupyter_manager = AsyncJupyterManager()
+jupyter_manager = create_kernel_backend(JUPYTER_BACKEND)
+
+registry.gauge(
+    "pymdwiki_jupyter_kernels",
+    "Kernels currently mapped to a page.",
+    callback=lambda: len(set(jupyter_manager.kernels.values())),
+    # with the shared registry every worker sees all the kernels
+    aggregate="sum" if jupyter_manager.registry is None else "max",
+)
@@ -57,13 +57,15 @@ class JupyterCellPreprocessor(Preprocessor):
 
         new = RE_FENCE.sub(repl, text)
 
-        if text != original_text:
+        if new != original_text:
             self.md.pymdwiki_has_jupyter = True
         return new.split("\n")
 
 
 class JupyterCellExtension(Extension):
     def extendMarkdown(self, md):
-        md.pymdwiki_has_jupyter = True
+        # set by the preprocessor when there are cells, pages without
+        # them don't need jupyter.js
+        md.pymdwiki_has_jupyter = False
         md.registerExtension(self)  # this do anything?
         md.preprocessors.register(JupyterCellPreprocessor(md), "jupyter_cell", 26)
@@ -0,0 +1,157 @@
+# kernel_registry.py
+# Page to kernel mapping, last activity and leases in a SQLite file,
+# so every uvicorn worker agrees on which kernel belongs to which page
+# and only one of them runs the reaper.
+
+import os
+import time
+import uuid
+from collections.abc import MutableMapping
+
+from src.sqlite_store import SQLiteStore
+
+# identifies this worker process in the lease table
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+class KernelRegistry(SQLiteStore):
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS kernels (
+            page_id TEXT PRIMARY KEY,
+            kernel_id TEXT NOT NULL,
+            created REAL NOT NULL,
+            last_activity REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS kernels_by_id ON kernels (kernel_id);
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires REAL NOT NULL
+        );
+    """
+
+    # page <-> kernel mapping
+
+    def get(self, page_id):
+        with self.connection() as db:
+            row = db.execute(
+                "SELECT kernel_id FROM kernels WHERE page_id = ?", (page_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, page_id, kernel_id):
+        now = time.time()
+        with self.connection() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO kernels VALUES (?, ?, ?, ?)",
+                (page_id, kernel_id, now, now),
+            )
+
+    def remove_page(self, page_id):
+        with self.connection() as db:
+            db.execute("DELETE FROM kernels WHERE page_id = ?", (page_id,))
+
+    def remove_kernel(self, kernel_id):
+        """unmap a kernel from every page, returns the pages it had"""
+        with self.connection() as db:
+            pages = [
+                row[0]
+                for row in db.execute(
+                    "SELECT page_id FROM kernels WHERE kernel_id = ?", (kernel_id,)
+                )
+            ]
+            db.execute("DELETE FROM kernels WHERE kernel_id = ?", (kernel_id,))
+        return pages
+
+    def pages_for_kernel(self, kernel_id):
+        with self.connection() as db:
+            return [
+                row[0]
+                for row in db.execute(
+                    "SELECT page_id FROM kernels WHERE kernel_id = ?", (kernel_id,)
+                )
+            ]
+
+    def touch(self, kernel_id):
+        with self.connection() as db:
+            db.execute(
+                "UPDATE kernels SET last_activity = ? WHERE kernel_id = ?",
+                (time.time(), kernel_id),
+            )
+
+    def last_activity(self, kernel_id):
+        with self.connection() as db:
+            row = db.execute(
+                "SELECT MAX(last_activity) FROM kernels WHERE kernel_id = ?",
+                (kernel_id,),
+            ).fetchone()
+        return row[0] if row else None
+
+    def items(self):
+        with self.connection() as db:
+            return db.execute("SELECT page_id, kernel_id FROM kernels").fetchall()
+
+    # leases
+
+    def acquire_lease(self, name, owner=WORKER_ID, ttl=60):
+        """
+        Take or renew a named lease for ttl seconds.  True if owner holds it
+        afterwards.  A lease whose holder stopped renewing it expires and
+        can be taken by someone else.
+        """
+        now = time.time()
+        with self.connection() as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute(
+                "SELECT owner, expires FROM leases WHERE name = ?", (name,)
+            ).fetchone()
+            if row is None or row[0] == owner or row[1] < now:
+                db.execute(
+                    "INSERT OR REPLACE INTO leases VALUES (?, ?, ?)",
+                    (name, owner, now + ttl),
+                )
+                return True
+            return False
+
+    def release_lease(self, name, owner=WORKER_ID):
+        with self.connection() as db:
+            db.execute(
+                "DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner)
+            )
+
+
+class SharedKernelMap(MutableMapping):
+    """
+    A dict-like { page_id: kernel_id } view of a KernelRegistry,
+    so code written against a plain dict keeps working.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    def __getitem__(self, page_id):
+        kernel_id = self.registry.get(page_id)
+        if kernel_id is None:
+            raise KeyError(page_id)
+        return kernel_id
+
+    def __setitem__(self, page_id, kernel_id):
+        self.registry.set(page_id, kernel_id)
+
+    def __delitem__(self, page_id):
+        self.registry.remove_page(page_id)
+
+    def __contains__(self, page_id):
+        return self.registry.get(page_id) is not None
+
+    def __iter__(self):
+        return iter([page_id for page_id, kernel_id in self.registry.items()])
+
+    def __len__(self):
+        return len(self.registry.items())
+
+    def items(self):
+        return self.registry.items()
+
+    def values(self):
+        return [kernel_id for page_id, kernel_id in self.registry.items()]
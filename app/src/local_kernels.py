@@ -0,0 +1,165 @@
+# local_kernels.py
+# Kernel backend that starts kernels in this process' container with
+# jupyter_client and talks to them directly over ZMQ, no jupyter-server.
+
+import asyncio
+import time
+from datetime import datetime, timezone
+
+from src.jupyter_client import KernelBackend
+
+from config import JUPYTER_KERNEL_NAME
+
+
+class _LocalKernel(object):
+    """A running kernel, its client, and who is waiting on its output."""
+
+    def __init__(self, kernel_id, manager, client):
+        self.kernel_id = kernel_id
+        self.manager = manager
+        self.client = client
+        # { "msg_id": asyncio.Queue } one per execution in flight
+        self.waiting = {}
+        self.execution_state = "starting"
+        self.last_activity = datetime.now(timezone.utc)
+        self.reader_task = None
+
+    def touch(self):
+        self.last_activity = datetime.now(timezone.utc)
+
+
+class AsyncLocalKernelManager(KernelBackend):
+    """
+    Kernels started with jupyter_client.AsyncKernelManager.
+    One task per kernel reads iopub and hands each message to the
+    execution it belongs to, so several websockets can run code on
+    the same page's kernel at once.
+    """
+
+    def __init__(self):
+        super().__init__()
+        if not hasattr(self, "running"):
+            # { "kernel_id": _LocalKernel }
+            self.running = {}
+
+    async def _create_kernel(self, page_id):
+        # only needed for this backend, so only imported here
+        from jupyter_client import AsyncKernelManager
+
+        manager = AsyncKernelManager(kernel_name=JUPYTER_KERNEL_NAME)
+        await manager.start_kernel()
+        client = manager.client()
+        client.start_channels()
+        try:
+            await client.wait_for_ready(timeout=60)
+        except Exception:
+            client.stop_channels()
+            await manager.shutdown_kernel(now=True)
+            raise
+
+        kernel = _LocalKernel(manager.kernel_id, manager, client)
+        kernel.execution_state = "idle"
+        kernel.reader_task = asyncio.create_task(self._read_iopub(kernel))
+        self.running[kernel.kernel_id] = kernel
+        return kernel.kernel_id
+
+    async def _read_iopub(self, kernel):
+        """route iopub messages to the execution that asked for them"""
+        try:
+            while True:
+                msg = await kernel.client.get_iopub_msg()
+                kernel.touch()
+                msg_type = msg["header"]["msg_type"]
+                if msg_type == "status":
+                    kernel.execution_state = msg["content"]["execution_state"]
+                queue = kernel.waiting.get(msg["parent_header"].get("msg_id"))
+                if queue is not None:
+                    queue.put_nowait(msg)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"Kernel {kernel.kernel_id} iopub reader stopped: {e}")
+            # wake up anyone still waiting so they don't hang forever
+            for queue in kernel.waiting.values():
+                queue.put_nowait(None)
+
+    async def _execute_code_stream(self, kernel_id, code):
+        kernel = self.running.get(kernel_id)
+        if kernel is None:
+            raise Exception(f"Kernel {kernel_id} is not running")
+
+        queue = asyncio.Queue()
+        msg_id = kernel.client.execute(code, store_history=True, stop_on_error=True)
+        kernel.waiting[msg_id] = queue
+        kernel.touch()
+        try:
+            while True:
+                msg = await queue.get()
+                if msg is None:
+                    yield self.wrap_msg("html", "<pre>Error: kernel died</pre>")
+                    break
+
+                msg_type = msg["header"]["msg_type"]
+                content = msg["content"]
+
+                # Execution Finished
+                if msg_type == "status":
+                    if content["execution_state"] == "idle":
+                        break
+                    continue
+
+                for chunk in self.format_message(msg_type, content):
+                    yield chunk
+        finally:
+            kernel.waiting.pop(msg_id, None)
+
+    async def list_kernels(self, max_age_seconds=3600):
+        kernel_list = []
+        now = datetime.now(timezone.utc)
+        for kernel_id, kernel in self.running.items():
+            kernel_list.append(
+                {
+                    "id": kernel_id,
+                    "name": kernel.manager.kernel_name,
+                    "last_activity": kernel.last_activity.isoformat(),
+                    "execution_state": kernel.execution_state,
+                    "connections": len(kernel.waiting),
+                    "pages": self.pages_for_kernel(kernel_id),
+                    "idle": (now - kernel.last_activity).total_seconds(),
+                }
+            )
+        return kernel_list
+
+    async def delete_kernel_by_id(self, kernel_id):
+        try:
+            await self._delete_kernel(kernel_id)
+        except Exception as e:
+            print(f"Error deleting kernel: {e}")
+
+    async def prune_stale_kernels(self, max_age_seconds=3600):
+        """shut down kernels that have been idle longer than max_age_seconds"""
+        print(f"[{datetime.now()}] 🧹 Reaper running...")
+        now = datetime.now(timezone.utc)
+        for kernel_id, kernel in list(self.running.items()):
+            idle_seconds = (now - kernel.last_activity).total_seconds()
+            if idle_seconds > max_age_seconds:
+                print(f"💀 Killing stale kernel {kernel_id} (Idle: {idle_seconds:.0f}s)")
+                await self.delete_kernel_by_id(kernel_id)
+
+    async def shutdown(self):
+        # these kernels are our children, don't leave them behind
+        await self.prune_stale_kernels(-1)
+
+    async def _delete_kernel(self, kernel_id):
+        kernel = self.running.pop(kernel_id, None)
+        self._unmap_kernel(kernel_id)
+        if kernel is None:
+            return
+        if kernel.reader_task is not None:
+            kernel.reader_task.cancel()
+        for queue in kernel.waiting.values():
+            queue.put_nowait(None)
+        kernel.client.stop_channels()
+        start = time.perf_counter()
+        await kernel.manager.shutdown_kernel(now=True)
+        print(f"   - Shut down in {time.perf_counter() - start:.2f}s")
@@ -4,7 +4,9 @@ from markdown.extensions import Extension
 from markdown.preprocessors import Preprocessor
 from markdown.blockprocessors import BlockProcessor
 from markdown.inlinepatterns import InlineProcessor
+from markdown.extensions.toc import slugify
 import xml.etree.ElementTree as etree
+import posixpath
 import re
 
 # from ..main import parse_url_path, markdown_file_exists
@@ -43,16 +45,23 @@ def normalize_page_name(page_name: str) -> str:
     return "/".join(p.strip().replace(" ", "_") for p in parts if p.strip())
 
 
+def resolve_page_name(page_name: str, current_path: str) -> str:
+    """Resolve page names with relative/absolute rules."""
+    resolved = page_name.strip()
+
+    resolved = resolved.rstrip("/")
+
+    if resolved.startswith("/"):
+        resolved = resolved.lstrip("/")
+    elif current_path:
+        resolved = "/".join([current_path, resolved])
+    return resolved
+
+
 def normalize_anchor(anchor: str) -> str:
-    """Normalize anchor like the Python Markdown TOC extension."""
-    anchor = anchor.lower()
-    # Replace spaces with dash
-    anchor = re.sub(r"\s+", "-", anchor)
-    # Remove all punctuation except letters, numbers, dash
-    anchor = re.sub(r"[^a-z0-9\-]", "", anchor)
-    # Collapse multiple dashes
-    anchor = re.sub(r"-+", "-", anchor)
-    return anchor.strip("-")
+    """Normalize anchor with the Python Markdown TOC extension's own slugify,
+    so it's the id the heading gets (separator "-", as configured in main)."""
+    return slugify(anchor.strip(), "-")
 
 
 class WikiLinkInlineProcessor(InlineProcessor):
@@ -61,24 +70,12 @@ class WikiLinkInlineProcessor(InlineProcessor):
         self.base_url = config["base_url"].rstrip("/")
         self.current_path = config["current_path"]  # e.g. "docs/Install_Guide"
         self.page_exists_callback = config["page_exists_callback"]
+        self.anchor_exists_callback = config["anchor_exists_callback"]
 
     def resolve_page_name(self, page_name: str) -> str:
         """Resolve page names with relative/absolute rules."""
-        resolved = page_name.strip()
-
-        resolved = resolved.rstrip("/")
-
-        print(f"{self.current_path=}")
-
-        if resolved.startswith("/"):
-            resolved = resolved.lstrip("/")
-            print("@@@@ path A", resolved)
-        elif self.current_path:
-            resolved = "/".join([self.current_path, resolved])
-            print("$$$$ path B", resolved)
-        # else:
-        #     resolved = resolved
-        return resolved
+        # shared with the link index, src/wikilinks.py
+        return resolve_page_name(page_name, self.current_path)
 
     def default_link_text(self, page_name: str, resolved_name: str) -> str:
         """Choose a default display text if user didn't specify one."""
@@ -170,6 +167,11 @@ class WikiLinkInlineProcessor(InlineProcessor):
         if self.page_exists_callback is not None:
             if not self.page_exists_callback(resolved_name):
                 el.set("class", "missing")
+            elif anchor and page_name.strip():
+                # Missing-section check, [[#anchor]] on the page itself isn't
+                if not self.anchor_exists_callback(resolved_name, normalized_anchor):
+                    el.set("class", "wikilink broken-anchor")
+                    el.set("title", f"{anchor} (no such section)")
 
         return el, m.start(0), m.end(0)
 
@@ -187,6 +189,10 @@ class WikiLinkExtension(Extension):
                 lambda x: True,
                 "Function to check if a page exists",
             ],
+            "anchor_exists_callback": [
+                lambda page, anchor: True,
+                "Function to check if an existing page has a heading with this id",
+            ],
         }
         # this super sets the config parameters and overwrites the defaults.
         super().__init__(**kwargs)
@@ -204,20 +210,176 @@ class WikiLinkExtension(Extension):
         )
 
 
+def is_page_embed(target: str) -> bool:
+    """![[Page]], ![[Page#Section]] and ![[Page.md]] embed pages, not images"""
+    name = target.split("|", 1)[0].split("#", 1)[0].strip()
+    extension = posixpath.splitext(name)[1].lower()
+    return extension in ("", ".md")
+
+
+RE_HEADING = re.compile(r"^[ ]{0,3}(#{1,6})[ \t]+(.*?)[ \t#]*$")
+RE_FENCE_LINE = re.compile(r"^[ ]{0,3}(```|~~~)")
+
+
+def extract_section(text: str, anchor: str) -> str | None:
+    """
+    The heading matching anchor and everything under it, up to the next
+    heading of the same or a higher level.  None if there's no such heading.
+    """
+    wanted = normalize_anchor(anchor)
+    lines = text.split("\n")
+    start = level = None
+    in_fence = False
+    for number, line in enumerate(lines):
+        if RE_FENCE_LINE.match(line):
+            in_fence = not in_fence
+            continue
+        match = None if in_fence else RE_HEADING.match(line)
+        if not match:
+            continue
+        if start is None:
+            if normalize_anchor(match.group(2)) == wanted:
+                start, level = number, len(match.group(1))
+        elif len(match.group(1)) <= level:
+            return "\n".join(lines[start:number])
+    if start is None:
+        return None
+    return "\n".join(lines[start:])
+
+
+RE_ID_ATTRIBUTE = re.compile(r'(?<![\w-])(id="|href="#)([^"]*)"')
+
+
+def namespace_ids(html: str, prefix: str) -> str:
+    """
+    An embedded page's ids (headings, footnotes) and the links within it
+    to them, prefixed so they can't clash with the page embedding it.
+    """
+    return RE_ID_ATTRIBUTE.sub(lambda match: f'{match.group(1)}{prefix}{match.group(2)}"', html)
+
+
+class TransclusionPreprocessor(Preprocessor):
+    """
+    A line that is only ![[Other Page]] or ![[Other Page#Section]] becomes
+    that page or section, rendered by transclusion_callback, which also
+    says what the result depends on.  Runs after fenced code blocks are
+    stashed, so embeds in code are left alone.
+    """
+
+    RE_EMBED_LINE = re.compile(r"^[ ]{0,3}!\[\[([^\]]+)\]\][ \t]*$")
+
+    def __init__(self, md, config):
+        super().__init__(md)
+        self.transclusion_callback = config["transclusion_callback"]
+
+    def run(self, lines):
+        new_lines = []
+        for line in lines:
+            match = self.RE_EMBED_LINE.match(line)
+            if not match or not is_page_embed(match.group(1)):
+                new_lines.append(line)
+                continue
+            fragment = self.transclusion_callback(match.group(1).split("|", 1)[0])
+            self.md.pymdwiki_embeds.update(fragment["embeds"])
+            self.md.pymdwiki_links.update(fragment.get("links", ()))
+            self.md.pymdwiki_queries.update(fragment.get("queries", {}))
+            self.md.pymdwiki_anchors.update(fragment.get("anchors", {}))
+            if fragment.get("has_latex"):
+                self.md.pymdwiki_has_latex = True
+            if fragment.get("has_jupyter"):
+                self.md.pymdwiki_has_jupyter = True
+            if not fragment.get("complete", True):
+                self.md.pymdwiki_embeds_complete = False
+            new_lines += ["", self.md.htmlStash.store(fragment["html"]), ""]
+        return new_lines
+
+
+class TransclusionExtension(Extension):
+    def __init__(self, **kwargs):
+        self.config = {
+            "transclusion_callback": [
+                lambda target: {"html": "", "embeds": {}},
+                "Function giving { html, embeds, ... } for an embedded page",
+            ],
+        }
+        super().__init__(**kwargs)
+
+    def extendMarkdown(self, md):
+        # { file path: stamp } of every page embedded, however deep
+        md.pymdwiki_embeds = {}
+        # False if a cycle or the depth limit cut an embed short
+        md.pymdwiki_embeds_complete = True
+        # queries, links and anchors come from other extensions, if they're there
+        if not hasattr(md, "pymdwiki_queries"):
+            md.pymdwiki_queries = {}
+        if not hasattr(md, "pymdwiki_links"):
+            md.pymdwiki_links = set()
+        if not hasattr(md, "pymdwiki_anchors"):
+            md.pymdwiki_anchors = {}
+        self.md = md
+        md.registerExtension(self)
+        md.preprocessors.register(
+            TransclusionPreprocessor(md, config=self.getConfigs()), "transclusion", 24
+        )
+
+    def reset(self):
+        self.md.pymdwiki_embeds = {}
+        self.md.pymdwiki_embeds_complete = True
+
+
 class ImageEmbedInlineProcessor(InlineProcessor):
+    def __init__(self, pattern: str, md, config):
+        super().__init__(pattern, md)
+        self.current_path = config["current_path"]  # e.g. "docs"
+        self.image_attributes_callback = config["image_attributes_callback"]
+
     def handleMatch(self, m, data):
         src = m.group(1)
+        if is_page_embed(src):
+            # a page embedded in the middle of a paragraph, link to it instead
+            target, _, text = src.partition("|")
+            page_name, _, anchor = target.partition("#")
+            page_name = page_name.strip()
+            if not page_name.startswith("/"):
+                page_name = posixpath.join(self.current_path, page_name)
+            href = "/wiki" + posixpath.normpath("/" + normalize_page_name(page_name))
+            if anchor:
+                href += "#" + normalize_anchor(anchor)
+            link = etree.Element("a")
+            link.set("href", href)
+            link.set("class", "wikilink transclusion-link")
+            link.text = (text or target).strip()
+            return link, m.start(0), m.end(0)
         img = etree.Element("img")
         img.set("src", src)
         img.set("alt", "")
+        if "://" not in src:
+            # the url the browser will ask for, relative to the page's directory
+            url = posixpath.normpath(posixpath.join("/", self.current_path, src))
+            for key, value in self.image_attributes_callback(url).items():
+                img.set(key, str(value))
+        img.set("loading", "lazy")
+        img.set("decoding", "async")
         return img, m.start(0), m.end(0)
 
 
 class ImageEmbedExtension(Extension):
+    def __init__(self, **kwargs):
+        self.config = {
+            "current_path": ["", "Current page's directory, for relative images"],
+            "image_attributes_callback": [
+                lambda url: {},
+                "Function giving extra <img> attributes (width, height, srcset) for a url",
+            ],
+        }
+        super().__init__(**kwargs)
+
     def extendMarkdown(self, md):
         IMAGE_EMBED_RE = r"!\[\[([^\]]+)\]\]"  # Matches ![[filename]]
         md.inlinePatterns.register(
-            ImageEmbedInlineProcessor(IMAGE_EMBED_RE, md), "image_embed", 175
+            ImageEmbedInlineProcessor(IMAGE_EMBED_RE, md, config=self.getConfigs()),
+            "image_embed",
+            175,
         )
 
 
@@ -0,0 +1,213 @@
+# media.py
+# Images embedded in pages: their size read from the file header, without
+# decoding them, so <img> gets width/height and the page doesn't jump
+# around while they load.  And smaller copies for srcset, made on first
+# request and kept in a size-bounded cache directory.
+#
+# Resizing needs Pillow.  Without it pages still get width/height and
+# lazy loading, just no srcset.
+
+import hashlib
+import importlib.util
+import os
+import struct
+import threading
+from functools import lru_cache
+
+
+def _png_size(head):
+    if head[:8] == b"\x89PNG\r\n\x1a\n" and head[12:16] == b"IHDR":
+        return struct.unpack(">II", head[16:24])
+    return None
+
+
+def _gif_size(head):
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return struct.unpack("<HH", head[6:10])
+    return None
+
+
+def _webp_size(head):
+    if head[:4] != b"RIFF" or head[8:12] != b"WEBP":
+        return None
+    chunk = head[12:16]
+    if chunk == b"VP8 " and head[23:26] == b"\x9d\x01\x2a":
+        width, height = struct.unpack("<HH", head[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L" and head[20:21] == b"\x2f":
+        bits = int.from_bytes(head[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        return (
+            int.from_bytes(head[24:27], "little") + 1,
+            int.from_bytes(head[27:30], "little") + 1,
+        )
+    return None
+
+
+def _exif_orientation(exif):
+    """the orientation tag from an APP1 Exif segment, 1 if there isn't one"""
+    if exif[:6] != b"Exif\0\0":
+        return 1
+    tiff = exif[6:]
+    if tiff[:2] == b"II":
+        endian = "<"
+    elif tiff[:2] == b"MM":
+        endian = ">"
+    else:
+        return 1
+    try:
+        (ifd_offset,) = struct.unpack(endian + "I", tiff[4:8])
+        (entries,) = struct.unpack(endian + "H", tiff[ifd_offset : ifd_offset + 2])
+        for n in range(entries):
+            entry = ifd_offset + 2 + n * 12
+            tag, kind, count, value = struct.unpack(
+                endian + "HHI4s", tiff[entry : entry + 12]
+            )
+            if tag == 0x0112:
+                return struct.unpack(endian + "H", value[:2])[0]
+    except struct.error:
+        pass
+    return 1
+
+
+def _jpeg_size(file):
+    """walk the jpeg segments up to the frame header, reading only their headers"""
+    if file.read(2) != b"\xff\xd8":
+        return None
+    orientation = 1
+    while True:
+        marker = file.read(2)
+        while marker[:1] == b"\xff" and marker[1:] == b"\xff":
+            # fill bytes
+            marker = marker[1:] + file.read(1)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        code = marker[1]
+        if code in (0xD8, 0x01) or 0xD0 <= code <= 0xD7:
+            continue
+        (length,) = struct.unpack(">H", file.read(2))
+        if code == 0xE1 and orientation == 1:
+            segment = file.read(length - 2)
+            orientation = _exif_orientation(segment)
+            continue
+        # start of frame, all but DHT (c4), JPG (c8) and DAC (cc)
+        if 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack(">xHH", file.read(5))
+            if orientation >= 5:
+                # rotated 90 degrees, browsers show it that way
+                width, height = height, width
+            return width, height
+        file.seek(length - 2, os.SEEK_CUR)
+
+
+@lru_cache(maxsize=8192)
+def _image_size(file_path, mtime_ns, size):
+    with open(file_path, "rb") as file:
+        head = file.read(32)
+        dimensions = _png_size(head) or _gif_size(head) or _webp_size(head)
+        if dimensions is None and head[:2] == b"\xff\xd8":
+            file.seek(0)
+            dimensions = _jpeg_size(file)
+    return dimensions
+
+
+def image_size(file_path):
+    """
+    (width, height) of a png, gif, webp or jpeg as displayed, or None.
+    Remembered per file until its mtime or size changes.
+    """
+    try:
+        stat = os.stat(file_path)
+        return _image_size(file_path, stat.st_mtime_ns, stat.st_size)
+    except (OSError, struct.error, ValueError):
+        return None
+
+
+def can_resize():
+    """is Pillow installed, without paying for importing it"""
+    return importlib.util.find_spec("PIL") is not None
+
+
+class VariantCache(object):
+    """
+    Resized copies of images in a directory, dropped least recently used
+    first when they add up to more than max_bytes.  Files are named after
+    the original's path, mtime and size, so an edited image gets new ones.
+    """
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, quality=82):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def variant_path(self, file_path, width):
+        stat = os.stat(file_path)
+        key = hashlib.sha1(
+            f"{file_path}:{stat.st_mtime_ns}:{stat.st_size}".encode()
+        ).hexdigest()
+        extension = os.path.splitext(file_path)[1].lower()
+        if extension not in (".png", ".gif", ".webp"):
+            extension = ".jpg"
+        return os.path.join(self.directory, f"{key}_{width}{extension}")
+
+    def get(self, file_path, width):
+        """path of file_path resized to width, made if it isn't cached"""
+        variant = self.variant_path(file_path, width)
+        try:
+            # mtime is the "last used" that eviction goes by
+            os.utime(variant)
+            return variant
+        except FileNotFoundError:
+            pass
+
+        self.resize(file_path, variant, width)
+        self.evict()
+        return variant
+
+    def resize(self, file_path, variant, width):
+        from PIL import Image, ImageOps
+
+        with Image.open(file_path) as image:
+            image = ImageOps.exif_transpose(image)
+            height = max(1, round(image.height * width / image.width))
+            image.thumbnail((width, height), Image.Resampling.LANCZOS)
+            if variant.endswith(".jpg") and image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            # another worker may be making the same one, last rename wins
+            temporary = f"{variant}.{os.getpid()}.{threading.get_ident()}.tmp"
+            image.save(
+                temporary,
+                format=Image.registered_extensions()[os.path.splitext(variant)[1]],
+                quality=self.quality,
+                optimize=True,
+            )
+        os.replace(temporary, variant)
+
+    def evict(self):
+        with self.lock:
+            entries = []
+            total = 0
+            with os.scandir(self.directory) as scan:
+                for entry in scan:
+                    if entry.name.endswith(".tmp"):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+            if total <= self.max_bytes:
+                return
+            entries.sort()
+            for mtime, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
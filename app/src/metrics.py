@@ -0,0 +1,481 @@
+# metrics.py
+# A small in-process metrics registry with Prometheus text output.
+# Recording is a dict lookup and a bisect, all formatting happens
+# when /metrics is scraped.  With several uvicorn workers each one
+# writes its values to a SQLite file now and then, and /metrics adds
+# them up, whichever worker gets the scrape.
+
+import asyncio
+import json
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from starlette.datastructures import MutableHeaders
+from starlette.responses import PlainTextResponse
+
+from src.sqlite_store import SQLiteStore
+
+
+# seconds, roughly prometheus_client's defaults with a few more on the low end
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+# a worker that wrote nothing for a day is gone, its rows are dropped
+# (its counts leave the totals, Prometheus sees that as a counter reset)
+FORGET_WORKERS_AFTER = 24 * 3600
+
+# bytes, for output sizes
+BYTE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        value = value.replace("\n", "\\n")
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric(object):
+    metric_type = "untyped"
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def header(self):
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+
+    def snapshot(self):
+        """this worker's values, {label values: value}"""
+        with self.lock:
+            return dict(self.values)
+
+    def merge(self, snapshots):
+        """several workers' snapshots as one, counts add up"""
+        merged = {}
+        for values in snapshots:
+            for key, value in values.items():
+                merged[key] = merged.get(key, 0) + value
+        return merged
+
+    def collect(self, values=None):
+        lines = self.header()
+        if values is None:
+            values = self.snapshot()
+        for key, value in sorted(values.items()):
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}{labels} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    A gauge, either set directly or read from a callback at scrape time.
+    aggregate says how workers' values make one: "sum" when each worker
+    has its own share, "max" when they all see the same thing.
+    """
+
+    metric_type = "gauge"
+
+    def __init__(self, name, documentation, label_names=(), callback=None, aggregate="sum"):
+        super().__init__(name, documentation, label_names)
+        self.callback = callback
+        self.aggregate = aggregate
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def snapshot(self):
+        if self.callback is None:
+            return super().snapshot()
+        try:
+            return {(): self.callback()}
+        except Exception as e:
+            print(f"metrics callback error for {self.name}: {e}")
+            return {}
+
+    def merge(self, snapshots):
+        if self.aggregate != "max":
+            return super().merge(snapshots)
+        merged = {}
+        for values in snapshots:
+            for key, value in values.items():
+                merged[key] = max(merged.get(key, value), value)
+        return merged
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                # per bucket counts (plus +Inf), sum, count
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {k: [list(v[0]), v[1], v[2]] for k, v in self.values.items()}
+
+    def merge(self, snapshots):
+        merged = {}
+        for values in snapshots:
+            for key, (counts, total, count) in values.items():
+                if len(counts) != len(self.buckets) + 1:
+                    continue  # written with other buckets, by an older version
+                entry = merged.setdefault(key, [[0] * len(counts), 0.0, 0])
+                entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                entry[1] += total
+                entry[2] += count
+        return merged
+
+    def collect(self, values=None):
+        lines = self.header()
+        if values is None:
+            values = self.snapshot()
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(
+                    self.label_names, key, ("le", _format_value(bound))
+                )
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsStore(SQLiteStore):
+    """
+    Every worker's latest values, one row per metric and label values.
+    Values are totals since the worker started, so /metrics adds up the
+    rows of all workers, including ones that have since exited.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS samples (
+            worker TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            labels TEXT NOT NULL,
+            value TEXT NOT NULL,
+            updated REAL NOT NULL,
+            PRIMARY KEY (worker, metric, labels)
+        );
+    """
+
+    def write(self, worker, samples, forget_after):
+        """samples: (metric, label values, value). Drops workers gone for forget_after seconds"""
+        now = time.time()
+        rows = [
+            (worker, metric, json.dumps(key), json.dumps(value), now)
+            for metric, key, value in samples
+        ]
+        with self.connection() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.executemany("INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?, ?)", rows)
+            db.execute("DELETE FROM samples WHERE updated < ?", (now - forget_after,))
+
+    def read(self):
+        """{metric: {worker: (updated, {label values: value})}}"""
+        result = {}
+        with self.connection() as db:
+            rows = db.execute("SELECT worker, metric, labels, value, updated FROM samples").fetchall()
+        for worker, metric, key, value, updated in rows:
+            entry = result.setdefault(metric, {}).setdefault(worker, [updated, {}])
+            entry[0] = max(entry[0], updated)
+            entry[1][tuple(json.loads(key))] = json.loads(value)
+        return result
+
+
+class MetricsRegistry(object):
+    def __init__(self):
+        self.metrics = {}
+        self.store = None
+        self.worker = None
+        self.flush_interval = None
+
+    def _register(self, metric):
+        if metric.name in self.metrics:
+            return self.metrics[metric.name]
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, label_names=()):
+        return self._register(Counter(name, documentation, label_names))
+
+    def gauge(self, name, documentation, label_names=(), callback=None, aggregate="sum"):
+        return self._register(Gauge(name, documentation, label_names, callback, aggregate))
+
+    def histogram(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, label_names, buckets))
+
+    def share(self, path, worker, flush_interval):
+        """
+        add up every uvicorn worker's metrics in /metrics: each one writes
+        its values to the SQLite file at path every flush_interval seconds
+        """
+        self.store = MetricsStore(path)
+        self.worker = worker
+        self.flush_interval = flush_interval
+
+    def flush(self):
+        if self.store is None:
+            return
+        samples = [
+            (name, key, value)
+            for name, metric in self.metrics.items()
+            for key, value in metric.snapshot().items()
+        ]
+        self.store.write(self.worker, samples, forget_after=FORGET_WORKERS_AFTER)
+
+    def render(self):
+        lines = []
+        if self.store is None:
+            for metric in self.metrics.values():
+                lines.extend(metric.collect())
+            return "\n".join(lines) + "\n"
+
+        self.flush()
+        stored = self.store.read()
+        # a gauge is what's true now, not from workers that stopped
+        alive_since = time.time() - 3 * self.flush_interval
+        for name, metric in self.metrics.items():
+            workers = stored.get(name, {}).values()
+            if isinstance(metric, Gauge):
+                workers = [entry for entry in workers if entry[0] >= alive_since]
+            lines.extend(metric.collect(metric.merge(values for _, values in workers)))
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+REQUEST_COUNT = registry.counter(
+    "pymdwiki_requests_total",
+    "Requests handled, by route, method and status.",
+    ("route", "method", "status"),
+)
+REQUEST_LATENCY = registry.histogram(
+    "pymdwiki_request_duration_seconds",
+    "Time spent handling a request, by route.",
+    ("route",),
+)
+RENDER_STAGE = registry.histogram(
+    "pymdwiki_render_stage_seconds",
+    "Time spent in each stage of rendering a page.",
+    ("stage",),
+)
+CACHE_REQUESTS = registry.counter(
+    "pymdwiki_cache_requests_total",
+    "Cache lookups, by cache and result (hit or miss).",
+    ("cache", "result"),
+)
+KERNEL_SPAWN = registry.histogram(
+    "pymdwiki_jupyter_kernel_spawn_seconds",
+    "Time to start a new Jupyter kernel.",
+)
+KERNEL_EXECUTE = registry.histogram(
+    "pymdwiki_jupyter_execute_seconds",
+    "Time from sending code to a kernel until it goes idle.",
+)
+KERNEL_OUTPUT_BYTES = registry.histogram(
+    "pymdwiki_jupyter_output_bytes",
+    "Bytes of output sent to the browser per execution.",
+    buckets=BYTE_BUCKETS,
+)
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+# stage timings for the current request, read back for the Server-Timing header
+_request_timings = ContextVar("pymdwiki_request_timings", default=None)
+
+
+def add_timing(stage, seconds):
+    """record a stage duration that was measured some other way"""
+    RENDER_STAGE.observe(seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a block of code as a named render stage.
+        with stage("convert"):
+            html = md.convert(text)
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(name, time.perf_counter() - start)
+
+
+def timed_callback(name, callback):
+    """
+    Wrap a function so every call adds to one stage total,
+    e.g. the wikilink existence checks done during convert.
+    The histogram gets a single observation per request.
+    """
+    total = [0.0]
+
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return callback(*args, **kwargs)
+        finally:
+            total[0] += time.perf_counter() - start
+
+    def finish():
+        add_timing(name, total[0])
+
+    wrapper.finish = finish
+    return wrapper
+
+
+def server_timing_header(timings):
+    return ", ".join(
+        f"{stage_name};dur={seconds * 1000:.2f}"
+        for stage_name, seconds in timings.items()
+    )
+
+
+def _route_label(route_path):
+    """/wiki/{path:path} -> /wiki"""
+    label = route_path.split("{", 1)[0].rstrip("/")
+    return label or "/"
+
+
+class MetricsMiddleware:
+    """
+    Counts requests and times them per route, and adds a Server-Timing
+    header with whatever stages the endpoint recorded before it responded.
+    Websocket routes get a count and the connection duration.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.route_labels = None
+
+    def route_label(self, scope):
+        if self.route_labels is None:
+            router = scope.get("router")
+            self.route_labels = {}
+            for route in getattr(router, "routes", []):
+                self.route_labels[getattr(route, "endpoint", None)] = _route_label(
+                    route.path
+                )
+        return self.route_labels.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        timings = {}
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+        status = {"code": "websocket" if scope["type"] == "websocket" else 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if timings:
+                    headers = MutableHeaders(raw=message["headers"])
+                    headers.append("Server-Timing", server_timing_header(timings))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_timings.reset(token)
+            elapsed = time.perf_counter() - start
+            route = self.route_label(scope)
+            REQUEST_LATENCY.observe(elapsed, route=route)
+            REQUEST_COUNT.inc(
+                route=route, method=scope.get("method", "WS"), status=status["code"]
+            )
+
+
+async def metrics_endpoint(request):
+    # /metrics
+    return PlainTextResponse(
+        await asyncio.to_thread(registry.render),
+        media_type="text/plain; version=0.0.4",
+    )
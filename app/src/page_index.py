@@ -0,0 +1,973 @@
+# page_index.py
+# Every page's meta header (Title, Summary, Authors, Date, Keywords...),
+# its headings, words and the pages it links to, in a SQLite file in
+# STATE_DIRECTORY, kept up to date on save, delete and outside changes, so
+# listings, ```query blocks, renames, the link report and related pages
+# don't read the vault.
+#
+# Query results are kept too, with the pages they matched.  A page
+# changing only drops the results it was in or now belongs in, so a
+# dashboard page full of queries isn't re-run on every unrelated save.
+
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+
+from markdown.extensions.toc import slugify, unique
+
+from src.related import page_terms
+from src.sqlite_store import SQLiteStore
+from src.wikilinks import link_anchors
+
+# the same header the meta extension reads, see markdown/extensions/meta.py
+META_BEGIN = re.compile(r"^-{3}(\s.*)?")
+META_END = re.compile(r"^(-{3}|\.{3})(\s.*)?")
+META_LINE = re.compile(r"^[ ]{0,3}(?P<key>[A-Za-z0-9_-]+):\s*(?P<value>.*)")
+META_MORE = re.compile(r"^[ ]{4,}(?P<value>.*)")
+
+HEADING = re.compile(r"^[ ]{0,3}(#{1,6})[ \t]+(.*?)[ \t#]*$")
+SETEXT_UNDERLINE = re.compile(r"^[ ]{0,3}(=+|-+)[ \t]*$")
+FENCE = re.compile(r"^[ ]{0,3}(```|~~~)")
+# ## Heading {#its-id}, from attr_list
+HEADING_ID = re.compile(r"[ \t]*\{:?[^}]*?#([\w-]+)[^}]*\}[ \t]*$")
+# what of a heading's markdown doesn't make it into its text, and its id
+INLINE_LINK = re.compile(r"!?\[([^\]]*)\]\([^)]*\)")
+INLINE_MARKUP = re.compile(r"<[^>]+>|[*`]|~~|==")
+
+# longest summary taken from a page's first paragraph
+SUMMARY_LENGTH = 200
+
+# meta keys whose values are tags, comma or space separated
+TAG_KEYS = ("keywords", "tags")
+
+# columns every page has, anything else is looked up in its meta fields
+PAGE_COLUMNS = ("page", "title", "date", "summary", "modified")
+
+
+def parse_meta(lines):
+    """
+    { key: [values] } from the lines at the top of a page, keys lower
+    case, like md.Meta after rendering.  Stops at the first line that
+    isn't part of the header.
+    """
+    meta = {}
+    key = None
+    for number, line in enumerate(lines):
+        line = line.rstrip("\r\n")
+        if number == 0 and META_BEGIN.match(line):
+            continue
+        if line.strip() == "" or META_END.match(line):
+            break
+        match = META_LINE.match(line)
+        if match:
+            key = match.group("key").lower().strip()
+            meta.setdefault(key, []).append(match.group("value").strip())
+            continue
+        more = META_MORE.match(line)
+        if more and key:
+            meta[key].append(more.group("value").strip())
+            continue
+        break
+    return meta
+
+
+def _first_heading_and_paragraph(lines):
+    """the first heading's text and the first paragraph's, skipping code blocks"""
+    heading = ""
+    paragraph = []
+    paragraph_done = False
+    in_fence = False
+    for line in lines:
+        if FENCE.match(line):
+            in_fence = not in_fence
+            continue
+        if in_fence:
+            continue
+        stripped = line.strip()
+        match = HEADING.match(line)
+        if not match and len(paragraph) == 1 and not paragraph_done:
+            if SETEXT_UNDERLINE.match(line):
+                # the line before was a heading, not a paragraph
+                heading = heading or paragraph.pop()
+                continue
+        if not paragraph and (SETEXT_UNDERLINE.match(line) or META_END.match(line)):
+            # a rule, or the end of the meta block
+            continue
+        if match:
+            heading = heading or match.group(2)
+            paragraph_done = paragraph_done or bool(paragraph)
+        elif not stripped:
+            paragraph_done = paragraph_done or bool(paragraph)
+        elif not paragraph_done and not stripped.startswith(
+            ("|", "<", "!", "[TOC]", "{:")
+        ):
+            paragraph.append(stripped)
+        if heading and paragraph_done:
+            break
+    return heading, " ".join(paragraph)
+
+
+def split_meta(lines):
+    """(meta, the lines after the meta header)"""
+    meta = parse_meta(lines)
+    # the page starts after the meta lines, and the --- before them if any
+    skip = sum(len(values) for values in meta.values())
+    if meta and META_BEGIN.match(lines[0]):
+        skip += 1
+    return meta, lines[skip:]
+
+
+def heading_text(text):
+    """roughly the text the toc extension sees of a heading, links and emphasis gone"""
+    return INLINE_MARKUP.sub("", INLINE_LINK.sub(r"\1", text)).strip()
+
+
+def iter_headings(lines):
+    """
+    (line number, level, text, id) of the headings in a page's lines (after
+    the meta header), ids as the toc extension gives them: slugified, _1,
+    _2 on repeats, or the {#id} given.  Headings in fenced code don't
+    count.  A setext heading's line is its text's, not the underline's.
+    """
+    ids = set()
+    in_fence = False
+    previous = ""
+    for number, line in enumerate(lines):
+        if FENCE.match(line):
+            in_fence = not in_fence
+            previous = ""
+            continue
+        if in_fence:
+            continue
+        match = HEADING.match(line)
+        if match:
+            level, text, start = len(match.group(1)), match.group(2), number
+        elif previous.strip() and SETEXT_UNDERLINE.match(line):
+            level, text, start = (1 if line.strip()[0] == "=" else 2), previous.strip(), number - 1
+            # the line before was this heading's, not a paragraph
+        else:
+            previous = "" if line.startswith(("    ", "\t")) else line
+            continue
+        previous = ""
+        custom = HEADING_ID.search(text)
+        if custom:
+            text = text[: custom.start()]
+            ids.add(custom.group(1))
+            yield start, level, heading_text(text), custom.group(1)
+        else:
+            text = heading_text(text)
+            yield start, level, text, unique(slugify(text, "-"), ids)
+
+
+def parse_headings(lines):
+    """[(level, text, id)] of the headings in a page's lines, see iter_headings"""
+    return [(level, text, anchor) for _, level, text, anchor in iter_headings(lines)]
+
+
+@lru_cache(maxsize=32768)
+def _page_headings(file_path, mtime_ns, size):
+    with open(file_path, "r", encoding="utf-8", errors="replace") as file:
+        lines = file.read().splitlines()
+    headings = tuple(parse_headings(split_meta(lines)[1]))
+    anchors = frozenset(anchor for _, _, anchor in headings)
+    return {
+        "headings": headings,
+        "anchors": anchors,
+        "digest": hashlib.sha1("\n".join(sorted(anchors)).encode()).hexdigest()[:12],
+    }
+
+
+def page_headings(file_path):
+    """
+    { headings: ((level, text, id)...), anchors: set of ids, digest } of a
+    page, digest changing only when its ids do.  Remembered per file until
+    its mtime or size changes, None if unreadable.
+    """
+    try:
+        stat = os.stat(file_path)
+        return _page_headings(file_path, stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+
+def _shorten(text, length=SUMMARY_LENGTH):
+    if len(text) <= length:
+        return text
+    return text[:length].rsplit(" ", 1)[0] + "…"
+
+
+@lru_cache(maxsize=32768)
+def _page_header(file_path, mtime_ns, size, max_bytes):
+    with open(file_path, "rb") as file:
+        head = file.read(max_bytes)
+    lines = head.decode("utf-8", errors="replace").splitlines()
+    if len(head) == max_bytes and lines:
+        # cut off somewhere in the last line
+        lines.pop()
+
+    meta, body = split_meta(lines)
+    heading, paragraph = _first_heading_and_paragraph(body)
+
+    name = os.path.basename(file_path)
+    name = name[: -len(".md")] if name.endswith(".md") else name
+    title = (meta.get("title") or [""])[0] or heading or name
+    summary = " ".join(meta.get("summary", [])).strip() or _shorten(paragraph)
+    return {
+        "meta": meta,
+        "title": title,
+        "heading": heading,
+        "summary": summary,
+        "date": (meta.get("date") or [""])[0],
+    }
+
+
+def page_header(file_path, max_bytes=16 * 1024):
+    """
+    { meta, title, heading, summary, date } of a page from its first
+    max_bytes, without rendering it.  title falls back to the first heading
+    then the file name, summary to the start of the first paragraph.
+    Remembered per file until its mtime or size changes, None if unreadable.
+    """
+    try:
+        stat = os.stat(file_path)
+        return _page_header(file_path, stat.st_mtime_ns, stat.st_size, max_bytes)
+    except OSError:
+        return None
+
+
+def meta_tags(meta):
+    tags = set()
+    for key in TAG_KEYS:
+        for value in meta.get(key, []):
+            for tag in re.split(r"[,\s]+", value):
+                tag = tag.strip().lstrip("#").lower()
+                if tag:
+                    tags.add(tag)
+    return sorted(tags)
+
+
+def read_page(file_path, page, header_bytes=16 * 1024):
+    """
+    Everything the index keeps of a page, None if it's unreadable.
+    Only reads the file, so sync can run it in other processes.
+    """
+    try:
+        stat = os.stat(file_path)
+        header = page_header(file_path, header_bytes)
+        if header is None:
+            return None
+        # links and headings can be anywhere, this reads the whole page
+        with open(file_path, "r", encoding="utf-8", errors="replace") as file:
+            lines = file.read().splitlines()
+    except OSError:
+        return None
+    text = "\n".join(lines)
+    body = split_meta(lines)[1]
+    return {
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "title": header["title"],
+        "date": header["date"],
+        "summary": header["summary"],
+        "fields": [(key, "\n".join(values)) for key, values in header["meta"].items()],
+        "tags": meta_tags(header["meta"]),
+        "links": sorted(link_anchors(text, page.rpartition("/")[0])),
+        "headings": parse_headings(body),
+        "terms": page_terms(body),
+    }
+
+
+def _read_pages(batch, header_bytes):
+    """read_page for [(file path, page)], in a worker process"""
+    return [(page, read_page(file_path, page, header_bytes)) for file_path, page in batch]
+
+
+class QueryError(ValueError):
+    pass
+
+
+QUERY_WHERE = re.compile(
+    r"^(?P<field>[\w.-]+)\s*(?P<op>!=|<=|>=|=|<|>|\bcontains\b)\s*(?P<value>.*)$",
+    re.IGNORECASE,
+)
+
+
+def _unquote(value):
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'":
+        return value[1:-1]
+    return value
+
+
+def parse_query(text):
+    """
+    A Dataview-ish query, one clause per line, clauses in any order:
+
+        TABLE title, date, authors     (or LIST, the default)
+        FROM "some/folder"             (or FROM #tag)
+        WHERE authors contains alice   (=, !=, <, <=, >, >=, contains)
+        SORT date DESC, title
+        LIMIT 10
+
+    WHERE and FROM can be repeated, all of them have to match.
+    """
+    query = {
+        "mode": "list",
+        "columns": [],
+        "folders": [],
+        "tags": [],
+        "where": [],
+        "sort": [],
+        "limit": None,
+    }
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("//"):
+            continue
+        keyword, _, rest = line.partition(" ")
+        keyword = keyword.upper()
+        rest = rest.strip()
+
+        if keyword in ("LIST", "TABLE"):
+            query["mode"] = keyword.lower()
+            query["columns"] = [
+                column.strip().lower() for column in rest.split(",") if column.strip()
+            ]
+        elif keyword == "FROM":
+            for source in re.split(r"\s+(?:and|AND)\s+", rest):
+                source = source.strip()
+                if source.startswith("#"):
+                    query["tags"].append(source[1:].lower())
+                elif source:
+                    query["folders"].append(_unquote(source).strip("/"))
+        elif keyword == "WHERE":
+            for condition in re.split(r"\s+(?:and|AND)\s+", rest):
+                match = QUERY_WHERE.match(condition.strip())
+                if not match:
+                    raise QueryError(f"can't read WHERE {condition}")
+                query["where"].append(
+                    [
+                        match.group("field").lower(),
+                        match.group("op").lower(),
+                        _unquote(match.group("value")),
+                    ]
+                )
+        elif keyword == "SORT":
+            for item in rest.split(","):
+                parts = item.split()
+                if not parts:
+                    continue
+                direction = parts[1].lower() if len(parts) > 1 else "asc"
+                if direction not in ("asc", "desc"):
+                    raise QueryError(f"SORT {item.strip()}: asc or desc?")
+                query["sort"].append([parts[0].lower(), direction])
+        elif keyword == "LIMIT":
+            try:
+                query["limit"] = int(rest)
+            except ValueError:
+                raise QueryError(f"LIMIT {rest} isn't a number")
+        else:
+            raise QueryError(f"unknown clause {keyword}")
+    return query
+
+
+def query_key(query):
+    return hashlib.sha1(json.dumps(query, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class PageIndex(SQLiteStore):
+    """
+    Pages by their path under the wiki directory, without .md, which is
+    also the wikilink to them: "some/dir/Page".  Files are only read again
+    when their mtime or size changes.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS pages (
+            page TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            date TEXT NOT NULL,
+            summary TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS fields (
+            page TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS fields_by_page ON fields (page);
+        CREATE INDEX IF NOT EXISTS fields_by_key ON fields (key, value);
+        CREATE TABLE IF NOT EXISTS tags (
+            page TEXT NOT NULL,
+            tag TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS tags_by_page ON tags (page);
+        CREATE INDEX IF NOT EXISTS tags_by_tag ON tags (tag);
+        CREATE TABLE IF NOT EXISTS links (
+            page TEXT NOT NULL,
+            target TEXT NOT NULL,
+            anchor TEXT NOT NULL,
+            PRIMARY KEY (page, target, anchor)
+        );
+        CREATE INDEX IF NOT EXISTS links_by_target ON links (target);
+        CREATE TABLE IF NOT EXISTS headings (
+            page TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            level INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            anchor TEXT NOT NULL,
+            PRIMARY KEY (page, position)
+        );
+        CREATE INDEX IF NOT EXISTS headings_by_anchor ON headings (page, anchor);
+        CREATE TABLE IF NOT EXISTS terms (
+            page TEXT NOT NULL,
+            term TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (page, term)
+        );
+        CREATE INDEX IF NOT EXISTS terms_by_term ON terms (term);
+        CREATE TABLE IF NOT EXISTS page_changes (
+            generation INTEGER PRIMARY KEY AUTOINCREMENT,
+            page TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS queries (
+            key TEXT PRIMARY KEY,
+            query TEXT NOT NULL,
+            generation INTEGER NOT NULL,
+            result TEXT,
+            used REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS query_pages (
+            key TEXT NOT NULL,
+            page TEXT NOT NULL,
+            PRIMARY KEY (key, page)
+        );
+        CREATE INDEX IF NOT EXISTS query_pages_by_page ON query_pages (page);
+    """
+
+    TABLES = (
+        "pages",
+        "fields",
+        "tags",
+        "links",
+        "headings",
+        "terms",
+        "queries",
+        "query_pages",
+        "page_changes",
+    )
+
+    # bumped when what's stored per page changes, older rows are reindexed
+    VERSION = 5
+
+    # fewer pages than this to read aren't worth starting processes for
+    PARALLEL_MINIMUM = 500
+    PARALLEL_BATCH = 200
+
+    def __init__(
+        self,
+        path,
+        root,
+        include_hidden=False,
+        result_limit=1000,
+        header_bytes=16 * 1024,
+        workers=1,
+    ):
+        super().__init__(path)
+        with self.connection() as db:
+            db.execute("BEGIN IMMEDIATE")
+            if db.execute("PRAGMA user_version").fetchone()[0] != self.VERSION:
+                # made again from SCHEMA, columns may have changed
+                for table in self.TABLES:
+                    db.execute(f"DROP TABLE IF EXISTS {table}")
+                db.execute(f"PRAGMA user_version = {self.VERSION}")
+        with self.connection() as db:
+            db.executescript(self.SCHEMA)
+        self.root = os.path.normpath(root)
+        self.include_hidden = include_hidden
+        self.result_limit = result_limit
+        self.header_bytes = header_bytes
+        self.workers = workers or os.cpu_count() or 1
+
+    def page_name(self, file_path):
+        """wiki/some/Page.md -> some/Page"""
+        relative = os.path.relpath(file_path, self.root).replace(os.sep, "/")
+        return relative[: -len(".md")]
+
+    def file_path(self, page):
+        return os.path.join(self.root, *page.split("/")) + ".md"
+
+    # keeping it up to date
+
+    def update(self, file_path):
+        """(re)index one .md file, or forget it if it's gone. True if anything changed"""
+        page = self.page_name(file_path)
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return self.remove(file_path)
+
+        with self.connection() as db:
+            row = db.execute(
+                "SELECT mtime_ns, size FROM pages WHERE page = ?", (page,)
+            ).fetchone()
+        if row is not None and row[0] == stat.st_mtime_ns and row[1] == stat.st_size:
+            return False
+
+        entry = read_page(file_path, page, self.header_bytes)
+        if entry is None:
+            return self.remove(file_path)
+        with self.connection() as db:
+            db.execute("BEGIN IMMEDIATE")
+            self._store(db, page, entry)
+        return True
+
+    def _store(self, db, page, entry):
+        db.execute(
+            "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+            (page, entry["mtime_ns"], entry["size"], entry["title"], entry["date"], entry["summary"]),
+        )
+        self._forget(db, page)
+        db.executemany(
+            "INSERT INTO fields VALUES (?, ?, ?)",
+            [(page, key, value) for key, value in entry["fields"]],
+        )
+        db.executemany(
+            "INSERT INTO tags VALUES (?, ?)", [(page, tag) for tag in entry["tags"]]
+        )
+        db.executemany(
+            "INSERT INTO links VALUES (?, ?, ?)",
+            [(page, target, anchor) for target, anchor in entry["links"]],
+        )
+        db.executemany(
+            "INSERT INTO headings VALUES (?, ?, ?, ?, ?)",
+            [
+                (page, position, level, text, anchor)
+                for position, (level, text, anchor) in enumerate(entry["headings"])
+            ],
+        )
+        db.executemany(
+            "INSERT INTO terms VALUES (?, ?, ?)",
+            [(page, term, count) for term, count in entry["terms"]],
+        )
+        self._drop_results(db, page)
+        self._changed(db, page)
+
+    def _changed(self, db, page):
+        db.execute("INSERT INTO page_changes (page) VALUES (?)", (page,))
+
+    def _forget(self, db, page):
+        for table in ("fields", "tags", "links", "headings", "terms"):
+            db.execute(f"DELETE FROM {table} WHERE page = ?", (page,))
+
+    def remove(self, file_path):
+        page = self.page_name(file_path)
+        with self.connection() as db:
+            db.execute("BEGIN IMMEDIATE")
+            removed = db.execute("DELETE FROM pages WHERE page = ?", (page,)).rowcount
+            self._forget(db, page)
+            if removed:
+                self._drop_results(db, page)
+                self._changed(db, page)
+        return bool(removed)
+
+    def _read_all(self, stale):
+        """(page, read_page) for [(file path, page)], in worker processes when there are many"""
+        if self.workers <= 1 or len(stale) < self.PARALLEL_MINIMUM:
+            for file_path, page in stale:
+                yield page, read_page(file_path, page, self.header_bytes)
+            return
+        batches = [
+            stale[start : start + self.PARALLEL_BATCH]
+            for start in range(0, len(stale), self.PARALLEL_BATCH)
+        ]
+        # spawn, forking a server with threads and sqlite connections isn't safe
+        try:
+            with ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            ) as pool:
+                for results in pool.map(
+                    _read_pages, batches, [self.header_bytes] * len(batches)
+                ):
+                    yield from results
+        except (BrokenProcessPool, OSError) as e:
+            # storing a page twice does no harm
+            print(f"Page index: worker processes failed ({e!r}), reading pages here.")
+            for file_path, page in stale:
+                yield page, read_page(file_path, page, self.header_bytes)
+
+    def sync(self, directory=None):
+        """
+        Index what changed under directory (default the whole wiki) since
+        last time, and forget pages that aren't there any more.  Pages are
+        read by self.workers processes when there are a lot to read.
+        """
+        directory = os.path.normpath(directory or self.root)
+        prefix = "" if directory == self.root else self.page_name(directory + ".md") + "/"
+        with self.connection() as db:
+            known = {
+                page: (mtime_ns, size)
+                for page, mtime_ns, size in db.execute(
+                    "SELECT page, mtime_ns, size FROM pages WHERE substr(page, 1, ?) = ?",
+                    (len(prefix), prefix),
+                )
+            }
+
+        seen = set()
+        stale = []
+        for current, dirnames, filenames in os.walk(directory):
+            if not self.include_hidden:
+                dirnames[:] = [name for name in dirnames if not name.startswith(".")]
+            for name in filenames:
+                if not name.endswith(".md"):
+                    continue
+                if not self.include_hidden and name.startswith("."):
+                    continue
+                file_path = os.path.join(current, name)
+                page = self.page_name(file_path)
+                seen.add(page)
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                if known.get(page) != (stat.st_mtime_ns, stat.st_size):
+                    stale.append((file_path, page))
+
+        changed = 0
+        batch = []
+        for page, entry in self._read_all(stale):
+            if entry is None:
+                seen.discard(page)
+                continue
+            batch.append((page, entry))
+            if len(batch) >= self.PARALLEL_BATCH:
+                changed += self._store_batch(batch)
+                batch = []
+        changed += self._store_batch(batch)
+
+        for page in known:
+            if page not in seen and self.remove(self.file_path(page)):
+                changed += 1
+
+        # results of queries no page has used for a month
+        with self.connection() as db:
+            db.execute("BEGIN IMMEDIATE")
+            stale = time.time() - 30 * 24 * 3600
+            db.execute(
+                "DELETE FROM query_pages WHERE key IN (SELECT key FROM queries WHERE used < ?)",
+                (stale,),
+            )
+            db.execute("DELETE FROM queries WHERE used < ?", (stale,))
+            db.execute(
+                "DELETE FROM page_changes WHERE generation <"
+                " (SELECT MAX(generation) FROM page_changes) - ?",
+                (self.CHANGES_KEPT,),
+            )
+        return changed
+
+    def _store_batch(self, batch):
+        if not batch:
+            return 0
+        with self.connection() as db:
+            db.execute("BEGIN IMMEDIATE")
+            for page, entry in batch:
+                self._store(db, page, entry)
+        return len(batch)
+
+    def apply_changes(self, changes):
+        """change feed subscriber"""
+        for path, kind in changes.items():
+            if kind == "rescan" or (kind == "deleted" and not path.endswith(".md")):
+                # a directory, or events were lost under it
+                self.sync(path if os.path.isdir(path) else os.path.dirname(path))
+            elif path.endswith(".md"):
+                self.update(path)
+
+    # reading it
+
+    def page(self, page):
+        with self.connection() as db:
+            row = db.execute(
+                "SELECT page, title, date, summary, mtime_ns FROM pages WHERE page = ?",
+                (page,),
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("page", "title", "date", "summary", "modified"), row))
+
+    def summaries(self):
+        """{ page: (title, summary) } for every indexed page, for listings"""
+        with self.connection() as db:
+            return {
+                page: (title, summary)
+                for page, title, summary in db.execute(
+                    "SELECT page, title, summary FROM pages"
+                )
+            }
+
+    def linking_pages(self, targets):
+        """pages with a link to, or an embed of, any of targets"""
+        targets = list(targets)
+        pages = set()
+        with self.connection() as db:
+            for start in range(0, len(targets), 500):
+                chunk = targets[start : start + 500]
+                marks = ", ".join("?" * len(chunk))
+                pages.update(
+                    row[0]
+                    for row in db.execute(
+                        f"SELECT DISTINCT page FROM links WHERE target IN ({marks})",
+                        chunk,
+                    )
+                )
+        return pages
+
+    def pages_under(self, directory):
+        """every indexed page in directory and its subdirectories"""
+        prefix = directory.strip("/") + "/"
+        with self.connection() as db:
+            return [
+                row[0]
+                for row in db.execute(
+                    "SELECT page FROM pages WHERE substr(page, 1, ?) = ?",
+                    (len(prefix), prefix),
+                )
+            ]
+
+    # changes kept for changes_since, older ones are forgotten by sync
+    CHANGES_KEPT = 10000
+
+    def generation(self):
+        """goes up whenever a page is added, changed or removed, by any worker"""
+        with self.connection() as db:
+            return db.execute("SELECT COALESCE(MAX(generation), 0) FROM page_changes").fetchone()[0]
+
+    def changes_since(self, generation):
+        """
+        (generation now, [pages added, changed or removed after generation]),
+        None for the pages if that's too long ago to know
+        """
+        with self.connection() as db:
+            oldest, newest = db.execute(
+                "SELECT MIN(generation), COALESCE(MAX(generation), 0) FROM page_changes"
+            ).fetchone()
+            if oldest is not None and oldest > generation + 1:
+                return newest, None
+            pages = [
+                row[0]
+                for row in db.execute(
+                    "SELECT DISTINCT page FROM page_changes WHERE generation > ?",
+                    (generation,),
+                )
+            ]
+        return newest, pages
+
+    def titles(self):
+        """[(page, title)] of every indexed page"""
+        with self.connection() as db:
+            return db.execute("SELECT page, title FROM pages").fetchall()
+
+    def headings(self, page):
+        """[(level, text, id)] of a page's headings, in order"""
+        with self.connection() as db:
+            return db.execute(
+                "SELECT level, text, anchor FROM headings WHERE page = ? ORDER BY position",
+                (page,),
+            ).fetchall()
+
+    def link_report(self):
+        """
+        { broken_links: [(page, target)], broken_anchors: [(page, target,
+        anchor)] } across the vault.  Targets that aren't pages count as
+        broken unless a file by that name exists, images and the like.
+        """
+        with self.connection() as db:
+            missing = db.execute(
+                """SELECT l.page, l.target FROM links l
+                   WHERE NOT EXISTS (SELECT 1 FROM pages p WHERE p.page = l.target)
+                   GROUP BY l.page, l.target ORDER BY l.page, l.target"""
+            ).fetchall()
+            broken_anchors = db.execute(
+                """SELECT l.page, l.target, l.anchor FROM links l
+                   JOIN pages p ON p.page = l.target
+                   WHERE l.anchor != '' AND NOT EXISTS (
+                       SELECT 1 FROM headings h
+                       WHERE h.page = l.target AND h.anchor = l.anchor
+                   )
+                   ORDER BY l.page, l.target, l.anchor"""
+            ).fetchall()
+        files = {}
+        broken_links = []
+        for page, target in missing:
+            if target not in files:
+                files[target] = os.path.isfile(os.path.join(self.root, *target.split("/")))
+            if not files[target]:
+                broken_links.append((page, target))
+        return {"broken_links": broken_links, "broken_anchors": broken_anchors}
+
+    # queries
+
+    def _drop_results(self, db, page):
+        """forget query results that had page in them, or would have now"""
+        affected = {
+            row[0]
+            for row in db.execute("SELECT key FROM query_pages WHERE page = ?", (page,))
+        }
+        for key, text in db.execute(
+            "SELECT key, query FROM queries WHERE result IS NOT NULL"
+        ).fetchall():
+            if key in affected:
+                continue
+            sql, parameters = self._compile(json.loads(text), page=page)
+            if db.execute(sql, parameters).fetchone() is not None:
+                affected.add(key)
+        for key in affected:
+            db.execute(
+                "UPDATE queries SET result = NULL, generation = generation + 1 WHERE key = ?",
+                (key,),
+            )
+            db.execute("DELETE FROM query_pages WHERE key = ?", (key,))
+
+    def _column(self, field):
+        """sql for one of a page's values, and its parameters"""
+        if field == "modified":
+            return "p.mtime_ns", []
+        if field in PAGE_COLUMNS:
+            return f"p.{field}", []
+        if field in ("tags", "tag"):
+            return "(SELECT group_concat(tag, ' ') FROM tags t WHERE t.page = p.page)", []
+        return "(SELECT value FROM fields f WHERE f.page = p.page AND f.key = ?)", [field]
+
+    def _compile(self, query, page=None):
+        where = []
+        parameters = []
+        if page is not None:
+            where.append("p.page = ?")
+            parameters.append(page)
+        if query["folders"]:
+            where.append(
+                "(" + " OR ".join("substr(p.page, 1, ?) = ?" for _ in query["folders"]) + ")"
+            )
+            for folder in query["folders"]:
+                parameters += [len(folder) + 1, folder + "/"]
+        for tag in query["tags"]:
+            where.append("EXISTS (SELECT 1 FROM tags t WHERE t.page = p.page AND t.tag = ?)")
+            parameters.append(tag)
+        for field, op, value in query["where"]:
+            if field in ("tags", "tag") and op in ("=", "contains"):
+                where.append(
+                    "EXISTS (SELECT 1 FROM tags t WHERE t.page = p.page AND t.tag = ?)"
+                )
+                parameters.append(value.lstrip("#").lower())
+                continue
+            column, column_parameters = self._column(field)
+            parameters += column_parameters
+            if op == "contains":
+                where.append(f"instr(lower({column}), lower(?)) > 0")
+            else:
+                where.append(f"{column} {op} ?")
+            parameters.append(value)
+
+        order = []
+        for field, direction in query["sort"]:
+            column, column_parameters = self._column(field)
+            order.append(f"{column} {direction.upper()}")
+            parameters += column_parameters
+        order.append("p.page")
+
+        limit = query["limit"] if query["limit"] is not None else self.result_limit
+        sql = (
+            "SELECT p.page, p.title, p.date, p.summary, p.mtime_ns FROM pages p"
+            + (" WHERE " + " AND ".join(where) if where else "")
+            + " ORDER BY "
+            + ", ".join(order)
+            + " LIMIT ?"
+        )
+        return sql, parameters + [min(limit, self.result_limit)]
+
+    def run_query(self, query):
+        """[{ page, title, date, summary, modified, ...the query's columns }]"""
+        sql, parameters = self._compile(query)
+        with self.connection() as db:
+            rows = [
+                dict(zip(("page", "title", "date", "summary", "modified"), row))
+                for row in db.execute(sql, parameters)
+            ]
+            extra = [column for column in query["columns"] if column not in PAGE_COLUMNS]
+            if rows and extra:
+                values = {}
+                pages = [row["page"] for row in rows]
+                for start in range(0, len(pages), 500):
+                    chunk = pages[start : start + 500]
+                    marks = ", ".join("?" * len(chunk))
+                    for page, key, value in db.execute(
+                        f"SELECT page, key, value FROM fields WHERE page IN ({marks})",
+                        chunk,
+                    ):
+                        values[(page, key)] = value
+                    for page, tag in db.execute(
+                        f"SELECT page, tag FROM tags WHERE page IN ({marks}) ORDER BY tag",
+                        chunk,
+                    ):
+                        values[(page, "tags")] = (
+                            values.get((page, "tags"), "") + " #" + tag
+                        ).strip()
+                for row in rows:
+                    for column in extra:
+                        key = "tags" if column == "tag" else column
+                        row[column] = values.get((row["page"], key), "")
+        return rows
+
+    def cached_query(self, text):
+        """(key, generation, rows) for a query's text, run only if a page it depends on changed"""
+        query = parse_query(text)
+        key = query_key(query)
+        with self.connection() as db:
+            row = db.execute(
+                "SELECT generation, result FROM queries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                db.execute("UPDATE queries SET used = ? WHERE key = ?", (time.time(), key))
+        if row is not None and row[1] is not None:
+            return key, row[0], json.loads(row[1])
+
+        rows = self.run_query(query)
+        with self.connection() as db:
+            db.execute("BEGIN IMMEDIATE")
+            current = db.execute(
+                "SELECT generation FROM queries WHERE key = ?", (key,)
+            ).fetchone()
+            generation = current[0] if current else 0
+            if row is not None and current is not None and current[0] != row[0]:
+                # a page changed while this ran, don't keep a stale result
+                return key, generation, rows
+            db.execute(
+                "INSERT OR REPLACE INTO queries VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(query), generation, json.dumps(rows), time.time()),
+            )
+            db.execute("DELETE FROM query_pages WHERE key = ?", (key,))
+            db.executemany(
+                "INSERT OR IGNORE INTO query_pages VALUES (?, ?)",
+                [(key, each["page"]) for each in rows],
+            )
+        return key, generation, rows
+
+    def query_generations(self, keys):
+        """{ key: generation } to check a cached render's query results against"""
+        if not keys:
+            return {}
+        keys = list(keys)
+        marks = ", ".join("?" * len(keys))
+        with self.connection() as db:
+            return dict(
+                db.execute(
+                    f"SELECT key, generation FROM queries WHERE key IN ({marks})", keys
+                ).fetchall()
+            )
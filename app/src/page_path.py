@@ -0,0 +1,167 @@
+# page_path.py
+# Urls and file paths split into the pieces the wiki works with.
+# Parsed once per distinct string, the same wikilinks and index entries
+# come up on every request.
+
+import sys
+from functools import lru_cache
+from urllib.parse import unquote
+
+from config import DEFAULT_WIKI_PAGE, PAGE_PATH_CACHE_SIZE
+
+# these aren't configurable
+RESERVED_PATHS = ("wiki", "edit", "save", "delete", "rename", "index")
+
+
+def _segments(path):
+    """the non empty pieces of a url or path, with .. and backslashes gone"""
+    if "%" in path:
+        path = unquote(path)
+    if ".." in path:
+        while ".." in path:
+            path = path.replace("..", "")
+    if "\\" in path:
+        path = path.replace("\\", "/")
+    return [sys.intern(each) for each in path.split("/") if each]
+
+
+class PagePath(object):
+    """
+    Immutable, and shared between everyone who parses the same string,
+    so path_list is a tuple.  Make a list of it before changing it.
+
+        path              "some/dir"
+        path_list         ("some", "dir")
+        file_name         "Page.md"
+        file_ext          "md"
+        file_name_no_ext  "Page"
+        is_md             True, only set by from_file_path
+    """
+
+    __slots__ = (
+        "path",
+        "path_list",
+        "file_name",
+        "file_ext",
+        "file_name_no_ext",
+        "is_md",
+    )
+
+    def __init__(self, path_list, file_name, file_ext, file_name_no_ext, is_md=False):
+        set_slot = object.__setattr__
+        set_slot(self, "path", "/".join(path_list))
+        set_slot(self, "path_list", tuple(path_list))
+        set_slot(self, "file_name", file_name)
+        set_slot(self, "file_ext", file_ext)
+        set_slot(self, "file_name_no_ext", file_name_no_ext)
+        set_slot(self, "is_md", is_md)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("PagePath is immutable")
+
+    def __eq__(self, other):
+        if not isinstance(other, PagePath):
+            return NotImplemented
+        return self.as_tuple() == other.as_tuple()
+
+    def __hash__(self):
+        return hash(self.as_tuple())
+
+    def __repr__(self):
+        return f"PagePath({self.path!r}, {self.file_name!r})"
+
+    def as_tuple(self):
+        return (
+            self.path_list,
+            self.file_name,
+            self.file_ext,
+            self.file_name_no_ext,
+            self.is_md,
+        )
+
+    def as_dict(self):
+        return {
+            "path": self.path,
+            "path_list": list(self.path_list),
+            "file_name": self.file_name,
+            "file_ext": self.file_ext,
+            "file_name_no_ext": self.file_name_no_ext,
+            "is_md": self.is_md,
+        }
+
+    @staticmethod
+    @lru_cache(maxsize=PAGE_PATH_CACHE_SIZE)
+    def from_url(path):
+        """
+        A url like /wiki/some/dir/Page.  The first reserved prefix is dropped,
+        path_list is the directories, [""] at the top level.
+        """
+        path_split = _segments(path)
+
+        if path_split and path_split[0] in RESERVED_PATHS:
+            path_split.pop(0)
+
+        if not path_split:
+            return PagePath([""], DEFAULT_WIKI_PAGE, "", DEFAULT_WIKI_PAGE)
+
+        file_name = path_split.pop()
+        if not path_split:
+            path_split = [""]
+
+        # .hidden has no extension, .hidden.md does
+        dot = file_name.rfind(".")
+        if dot > 0:
+            file_ext = file_name[dot + 1 :]
+            file_name_no_ext = file_name[:dot]
+        else:
+            file_ext = ""
+            file_name_no_ext = file_name
+
+        return PagePath(path_split, file_name, file_ext, file_name_no_ext)
+
+    @staticmethod
+    @lru_cache(maxsize=PAGE_PATH_CACHE_SIZE)
+    def from_file_path(path, remove_reserved=True):
+        """
+        A file path as listed by the index, like wiki/some/dir/Page.md.
+        For markdown files the page name is the last entry of path_list,
+        and there is no leading "" at the top level.
+        """
+        path_split = _segments(path)
+
+        if remove_reserved and path_split and path_split[0] in RESERVED_PATHS:
+            path_split.pop(0)
+
+        if not path_split:
+            return PagePath([""], DEFAULT_WIKI_PAGE, "", DEFAULT_WIKI_PAGE)
+
+        file_name = path_split.pop()
+        if not path_split:
+            path_split = [""]
+
+        dot = file_name.rfind(".")
+        if dot >= 0:
+            file_ext = file_name[dot + 1 :]
+            file_name_no_ext = file_name[:dot]
+        else:
+            file_ext = ""
+            file_name_no_ext = file_name
+
+        is_md = file_ext == "md"
+        if is_md:
+            path_split.append(file_name_no_ext)
+
+        if not path_split[0]:
+            path_split.pop(0)
+
+        return PagePath(path_split, file_name, file_ext, file_name_no_ext, is_md)
+
+
+def parse_url_path(path):
+    """helper to break url into some commonly used components"""
+    return PagePath.from_url(path)
+
+
+def parse_file_path(path, remove_reserved=True):
+    """helper to break path into some commonly used components"""
+    return PagePath.from_file_path(path, remove_reserved)
@@ -0,0 +1,140 @@
+# profiler.py
+# Opt-in timing of every processor registered in a markdown.Markdown
+# instance, to see which extension makes a page slow.
+
+import cProfile
+import io
+import marshal
+import pstats
+import time
+
+
+# (kind, registry attribute, methods to time)
+# the registries live on md, except block processors which live on md.parser
+PIPELINE_STAGES = [
+    ("preprocessor", "preprocessors", ["run"]),
+    ("blockprocessor", "parser.blockprocessors", ["test", "run"]),
+    ("inlinepattern", "inlinePatterns", ["handleMatch"]),
+    ("treeprocessor", "treeprocessors", ["run"]),
+    ("postprocessor", "postprocessors", ["run"]),
+]
+
+
+class MarkdownProfile(object):
+    """Wall time and call counts per registered processor."""
+
+    def __init__(self):
+        # {(kind, name): {"calls": int, "seconds": float, "class": str}}
+        self.stats = {}
+        self.total_seconds = 0.0
+
+    def _wrap(self, key, method, count_calls):
+        entry = self.stats[key]
+
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                entry["seconds"] += time.perf_counter() - start
+                if count_calls:
+                    entry["calls"] += 1
+
+        return wrapper
+
+    def attach(self, md):
+        """
+        Wrap the processors of md in place.  md should be a throw away
+        instance, the wrappers stay for as long as it lives.
+        """
+        for kind, attribute, methods in PIPELINE_STAGES:
+            registry = md
+            for part in attribute.split("."):
+                registry = getattr(registry, part)
+
+            for name, processor in list(registry._data.items()):
+                key = (kind, name)
+                self.stats[key] = {
+                    "calls": 0,
+                    "seconds": 0.0,
+                    "class": type(processor).__name__,
+                }
+                for method_name in methods:
+                    method = getattr(processor, method_name, None)
+                    if method is None:
+                        continue
+                    # block processors are asked test() for every block,
+                    # only count the run() calls, but time both.
+                    count_calls = method_name != "test"
+                    setattr(
+                        processor,
+                        method_name,
+                        self._wrap(key, method, count_calls),
+                    )
+        return md
+
+    def convert(self, md, text):
+        start = time.perf_counter()
+        html = md.convert(text)
+        self.total_seconds += time.perf_counter() - start
+        return html
+
+    def rows(self):
+        """stats sorted slowest first"""
+        rows = [
+            {"kind": kind, "name": name, **entry}
+            for (kind, name), entry in self.stats.items()
+        ]
+        rows.sort(key=lambda row: row["seconds"], reverse=True)
+        return rows
+
+    def markdown_table(self):
+        """the breakdown as a markdown table, for showing on a wiki page"""
+        lines = [
+            f"Total convert time: {self.total_seconds * 1000:.2f} ms\n",
+            "Stage | Name | Class | Calls | ms | % of total",
+            "----- | ----- | ----- | -----: | -----: | -----:",
+        ]
+        for row in self.rows():
+            percent = (
+                100 * row["seconds"] / self.total_seconds if self.total_seconds else 0
+            )
+            lines.append(
+                f"{row['kind']} | {row['name']} | {row['class']} | {row['calls']}"
+                f" | {row['seconds'] * 1000:.3f} | {percent:.1f}"
+            )
+        lines.append(
+            "\nInline pattern times are for handleMatch only, the regex"
+            " searching is counted under the `inline` treeprocessor."
+        )
+        return "\n".join(lines) + "\n"
+
+
+def cprofile_convert(md, text):
+    """
+    Run md.convert under cProfile.  Returns (html, stats), stats is
+    a pstats.Stats for the one conversion.
+    """
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        html = md.convert(text)
+    finally:
+        profile.disable()
+    return html, pstats.Stats(profile)
+
+
+def cprofile_dump(stats):
+    """
+    The same bytes pstats.Stats.dump_stats() would write to a .prof file,
+    readable by snakeviz, flameprof, gprof2dot or `python -m pstats`.
+    """
+    return marshal.dumps(stats.stats)
+
+
+def cprofile_summary(stats, limit=40):
+    """text summary of a cProfile run, sorted by cumulative time"""
+    out = io.StringIO()
+    stats.stream = out
+    stats.sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
@@ -0,0 +1,154 @@
+# query_extension.py
+# Python-Markdown extension to turn ```query``` code fences into a list or
+# table of pages from the metadata index, see page_index.parse_query.
+
+from markdown.extensions import Extension
+from markdown.preprocessors import Preprocessor
+from urllib.parse import quote
+import re
+import html
+import datetime
+
+from src.page_index import QueryError, parse_query
+
+# a fence line, ``` or ~~~ (or longer) and what follows, e.g. the language
+RE_FENCE = re.compile(r"^[ ]{0,3}(`{3,}|~{3,})(.*)$")
+
+
+def no_page_index(text):
+    raise QueryError("no page index to query")
+
+
+def format_value(column, value):
+    if column == "modified" and value:
+        return datetime.datetime.fromtimestamp(value / 1e9).strftime("%Y-%m-%d %H:%M")
+    return str(value)
+
+
+def page_link(base_url, row):
+    href = quote(f"{base_url}/{row['page']}")
+    return f"""<a class="wikilink" href="{href}">{html.escape(row["title"])}</a>"""
+
+
+def render_results(query, rows, base_url):
+    if not rows:
+        return """<div class="query-results query-empty">No pages match.</div>"""
+
+    if query["mode"] == "table":
+        columns = [column for column in query["columns"] if column != "title"]
+        out = ["""<table class="query-results">""", "<thead><tr><th>Page</th>"]
+        out += [f"<th>{html.escape(column.title())}</th>" for column in columns]
+        out.append("</tr></thead><tbody>")
+        for row in rows:
+            out.append(f"<tr><td>{page_link(base_url, row)}</td>")
+            for column in columns:
+                value = html.escape(format_value(column, row.get(column, "")))
+                out.append(f"<td>{value.replace(chr(10), '<br>')}</td>")
+            out.append("</tr>")
+        out.append("</tbody></table>")
+        return "".join(out)
+
+    out = ["""<ul class="query-results">"""]
+    for row in rows:
+        extra = [
+            html.escape(format_value(column, row.get(column, "")))
+            for column in query["columns"]
+            if column != "title" and row.get(column)
+        ]
+        details = f""" <span class="query-details">{" · ".join(extra)}</span>""" if extra else ""
+        out.append(f"<li>{page_link(base_url, row)}{details}</li>")
+    out.append("</ul>")
+    return "".join(out)
+
+
+class QueryBlockPreprocessor(Preprocessor):
+    """
+    ```query
+    TABLE title, date
+    FROM "projects"
+    SORT date DESC
+    ```
+    becomes the matching pages.  The results (and their generation, for
+    the render cache to check) come from query_callback, which caches them.
+    """
+
+    def __init__(self, md, config):
+        super().__init__(md)
+        self.query_callback = config["query_callback"]
+        self.base_url = config["base_url"].rstrip("/")
+
+    def render(self, source):
+        try:
+            query = parse_query(source)
+            key, generation, rows = self.query_callback(source)
+        except QueryError as e:
+            return self.md.htmlStash.store(
+                f"""<div class="query-results query-error">Query: {html.escape(str(e))}</div>"""
+            )
+        self.md.pymdwiki_queries[key] = generation
+        return self.md.htmlStash.store(render_results(query, rows, self.base_url))
+
+    def run(self, lines):
+        """
+        Fences are followed line by line, like page_index.iter_headings,
+        so a ```query inside another code block (say a ~~~~markdown
+        example of how to write one) stays text.
+        """
+        out = []
+        fence = None  # the open fence's ``` or ~~~
+        query = None  # the lines of the query block being read
+        for line in lines:
+            match = RE_FENCE.match(line)
+            closes = (
+                fence is not None
+                and match is not None
+                and match.group(1)[0] == fence[0]
+                and len(match.group(1)) >= len(fence)
+                and not match.group(2).strip()
+            )
+            if query is not None:
+                if closes:
+                    out.extend(["", self.render("\n".join(query[1:])), ""])
+                    fence = query = None
+                else:
+                    query.append(line)
+            elif fence is not None:
+                if closes:
+                    fence = None
+                out.append(line)
+            elif match:
+                fence = match.group(1)
+                if fence[0] == "`" and match.group(2).strip() == "query":
+                    query = [line]
+                else:
+                    out.append(line)
+            else:
+                out.append(line)
+        if query is not None:
+            # never closed, not a query
+            out.extend(query)
+        return out
+
+
+class QueryBlockExtension(Extension):
+    def __init__(self, **kwargs):
+        self.config = {
+            "query_callback": [
+                no_page_index,
+                "Function giving (key, generation, rows) for a query's text",
+            ],
+            "base_url": ["/wiki", "Base URL for page links"],
+        }
+        super().__init__(**kwargs)
+
+    def extendMarkdown(self, md):
+        # { query key: generation } of the results on this page
+        md.pymdwiki_queries = {}
+        self.md = md
+        md.registerExtension(self)
+        md.preprocessors.register(
+            QueryBlockPreprocessor(md, config=self.getConfigs()), "query_block", 27
+        )
+
+    def reset(self):
+        self.md.pymdwiki_queries = {}
@@ -0,0 +1,315 @@
+# related.py
+# "Related pages" for the panel under each page: the pages most like it by
+# TF-IDF cosine similarity of their words, blended with how much their
+# links overlap (two pages linking to the same pages, or to each other).
+#
+# Vectors are sparse, { feature: weight }, and kept in the page index's
+# SQLite file with each page's top neighbours, so viewing a page is one
+# indexed select.  Similarities are computed as a sparse matrix product
+# would, through postings (feature -> pages having it), never page pair
+# by page pair.  A save recomputes that page's vector and neighbours, and
+# puts it in the lists of pages it is now close to; the whole thing is
+# rebuilt at startup when the index changed, which also catches up the
+# idf weights.
+
+import heapq
+import math
+import re
+from collections import defaultdict
+
+WORD = re.compile(r"[^\W\d_]{3,}")
+FENCE = re.compile(r"^[ ]{0,3}(```|~~~)")
+WIKILINK = re.compile(r"!?\[\[[^\]]*\]\]|https?://\S+")
+
+# words too common to say anything about a page
+STOPWORDS = frozenset(
+    """
+    the and for are but not you all any can had her was one our out has him his
+    how its may new now old see two who did get let say she too use that with
+    have this will your from they know want been good much some time very when
+    come here just like long make many more only over such take than them then
+    well were what into also each other which their there would about could
+    these those where while should after first being under because between
+    """.split()
+)
+
+# words kept per page, the rest hardly move the similarity
+TERMS_PER_PAGE = 48
+
+# links are features too, marked so they can't clash with words
+LINK_FEATURE = "[["
+
+
+def page_terms(lines):
+    """[(word, count)] of a page's most frequent words, code and links left out"""
+    counts = defaultdict(int)
+    in_fence = False
+    for line in lines:
+        if FENCE.match(line):
+            in_fence = not in_fence
+            continue
+        if in_fence:
+            continue
+        for word in WORD.findall(WIKILINK.sub(" ", line).lower()):
+            if word not in STOPWORDS:
+                counts[word] += 1
+    top = heapq.nlargest(TERMS_PER_PAGE, counts.items(), key=lambda item: (item[1], item[0]))
+    return sorted(top)
+
+
+def _unit(weights, scale):
+    norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+    if not norm:
+        return {}
+    return {feature: weight * scale / norm for feature, weight in weights.items()}
+
+
+class RelatedPages(object):
+    """
+    Top count neighbours of every page in page_index.  link_weight is how
+    much of the similarity comes from links rather than words.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS vectors (
+            page TEXT NOT NULL,
+            feature TEXT NOT NULL,
+            weight REAL NOT NULL,
+            PRIMARY KEY (page, feature)
+        );
+        CREATE INDEX IF NOT EXISTS vectors_by_feature ON vectors (feature);
+        CREATE TABLE IF NOT EXISTS related (
+            page TEXT NOT NULL,
+            other TEXT NOT NULL,
+            score REAL NOT NULL,
+            PRIMARY KEY (page, other)
+        );
+        CREATE INDEX IF NOT EXISTS related_by_other ON related (other);
+    """
+
+    # features on more pages than this (and 2% of them) are skipped when
+    # scoring, they'd make every page a candidate and weigh next to nothing
+    COMMON_FEATURE = 200
+
+    def __init__(self, page_index, count=8, link_weight=0.3, features=24):
+        self.page_index = page_index
+        self.count = count
+        self.link_weight = link_weight
+        self.features = features
+        with page_index.connection() as db:
+            db.executescript(self.SCHEMA)
+
+    # vectors
+
+    def _frequencies(self, db, features=None):
+        """(pages, { feature: pages having it }), for features or all of them"""
+        total = db.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+        if features is None:
+            terms = db.execute("SELECT term, COUNT(*) FROM terms GROUP BY term")
+            # a page is in its own link set, links to it count it again
+            links = db.execute(
+                "SELECT target, COUNT(*) + 1 FROM links GROUP BY target"
+            )
+            frequencies = dict(terms.fetchall())
+            frequencies.update(
+                (LINK_FEATURE + target, count) for target, count in links.fetchall()
+            )
+            return total, frequencies
+
+        frequencies = {}
+        words = [feature for feature in features if not feature.startswith(LINK_FEATURE)]
+        targets = [
+            feature[len(LINK_FEATURE) :] for feature in features if feature.startswith(LINK_FEATURE)
+        ]
+        for start in range(0, len(words), 500):
+            chunk = words[start : start + 500]
+            marks = ", ".join("?" * len(chunk))
+            frequencies.update(
+                db.execute(
+                    f"SELECT term, COUNT(*) FROM terms WHERE term IN ({marks}) GROUP BY term",
+                    chunk,
+                ).fetchall()
+            )
+        for start in range(0, len(targets), 500):
+            chunk = targets[start : start + 500]
+            marks = ", ".join("?" * len(chunk))
+            frequencies.update(
+                (LINK_FEATURE + target, count)
+                for target, count in db.execute(
+                    f"SELECT target, COUNT(*) + 1 FROM links WHERE target IN ({marks}) GROUP BY target",
+                    chunk,
+                )
+            )
+        return total, frequencies
+
+    def _vector(self, page, terms, targets, total, frequencies):
+        """a page's unit vector, words and links each scaled to their share"""
+        words = {
+            word: (1 + math.log(count)) * math.log(1 + total / frequencies.get(word, 1))
+            for word, count in terms
+        }
+        words = dict(heapq.nlargest(self.features, words.items(), key=lambda item: item[1]))
+        links = {
+            LINK_FEATURE + target: math.log(1 + total / frequencies.get(LINK_FEATURE + target, 1))
+            for target in {*targets, page}
+        }
+        if not words:
+            return _unit(links, 1.0)
+        vector = _unit(words, math.sqrt(1 - self.link_weight))
+        vector.update(_unit(links, math.sqrt(self.link_weight)))
+        return vector
+
+    def _page_features(self, db, page):
+        terms = db.execute("SELECT term, count FROM terms WHERE page = ?", (page,)).fetchall()
+        targets = [
+            row[0]
+            for row in db.execute("SELECT DISTINCT target FROM links WHERE page = ?", (page,))
+        ]
+        return terms, targets
+
+    def _neighbours(self, page, vector, postings, common):
+        """{ other page: cosine similarity } through the postings of vector's features"""
+        scores = defaultdict(float)
+        for feature, weight in vector.items():
+            having = postings.get(feature, ())
+            if len(having) > common:
+                continue
+            for other, other_weight in having:
+                scores[other] += weight * other_weight
+        scores.pop(page, None)
+        return scores
+
+    def _common(self, total):
+        return max(self.COMMON_FEATURE, total // 50)
+
+    # keeping it up to date
+
+    def rebuild(self):
+        """every page's vector and neighbours from scratch. Returns the number of pages"""
+        with self.page_index.connection() as db:
+            total, frequencies = self._frequencies(db)
+            terms = defaultdict(list)
+            for page, term, count in db.execute("SELECT page, term, count FROM terms"):
+                terms[page].append((term, count))
+            targets = defaultdict(list)
+            for page, target in db.execute("SELECT DISTINCT page, target FROM links"):
+                targets[page].append(target)
+            pages = [row[0] for row in db.execute("SELECT page FROM pages")]
+
+        vectors = {
+            page: self._vector(page, terms[page], targets[page], total, frequencies)
+            for page in pages
+        }
+        postings = defaultdict(list)
+        for page, vector in vectors.items():
+            for feature, weight in vector.items():
+                postings[feature].append((page, weight))
+
+        common = self._common(total)
+        related = []
+        for page, vector in vectors.items():
+            scores = self._neighbours(page, vector, postings, common)
+            for other, score in heapq.nlargest(self.count, scores.items(), key=lambda item: item[1]):
+                related.append((page, other, score))
+
+        with self.page_index.connection() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("DELETE FROM vectors")
+            db.execute("DELETE FROM related")
+            db.executemany(
+                "INSERT INTO vectors VALUES (?, ?, ?)",
+                [
+                    (page, feature, weight)
+                    for page, vector in vectors.items()
+                    for feature, weight in vector.items()
+                ],
+            )
+            db.executemany("INSERT INTO related VALUES (?, ?, ?)", related)
+        return len(vectors)
+
+    def update(self, page):
+        """
+        After page was saved or deleted: its vector and neighbours again, and
+        its place in other pages' lists.  Other pages' vectors stay as they
+        were until the next rebuild.
+        """
+        with self.page_index.connection() as db:
+            exists = db.execute("SELECT 1 FROM pages WHERE page = ?", (page,)).fetchone()
+            if exists is None:
+                db.execute("BEGIN IMMEDIATE")
+                self._remove(db, page)
+                return
+
+            terms, targets = self._page_features(db, page)
+            features = [term for term, _ in terms] + [LINK_FEATURE + t for t in {*targets, page}]
+            total, frequencies = self._frequencies(db, features)
+            vector = self._vector(page, terms, targets, total, frequencies)
+
+            postings = defaultdict(list)
+            common = self._common(total)
+            keys = [
+                feature
+                for feature in vector
+                if frequencies.get(feature, 0) <= common
+            ]
+            for start in range(0, len(keys), 500):
+                chunk = keys[start : start + 500]
+                marks = ", ".join("?" * len(chunk))
+                for other, feature, weight in db.execute(
+                    f"SELECT page, feature, weight FROM vectors WHERE feature IN ({marks})",
+                    chunk,
+                ):
+                    postings[feature].append((other, weight))
+            scores = self._neighbours(page, vector, postings, common)
+
+            db.execute("BEGIN IMMEDIATE")
+            self._remove(db, page)
+            db.executemany(
+                "INSERT INTO vectors VALUES (?, ?, ?)",
+                [(page, feature, weight) for feature, weight in vector.items()],
+            )
+            db.executemany(
+                "INSERT INTO related VALUES (?, ?, ?)",
+                [
+                    (page, other, score)
+                    for other, score in heapq.nlargest(
+                        self.count, scores.items(), key=lambda item: item[1]
+                    )
+                ],
+            )
+            # and in the lists of the pages it's now closer to than their last
+            for other, score in scores.items():
+                row = db.execute(
+                    "SELECT COUNT(*), MIN(score) FROM related WHERE page = ?", (other,)
+                ).fetchone()
+                if row[0] < self.count:
+                    db.execute("INSERT INTO related VALUES (?, ?, ?)", (other, page, score))
+                elif score > row[1]:
+                    db.execute(
+                        "DELETE FROM related WHERE rowid = (SELECT rowid FROM related"
+                        " WHERE page = ? ORDER BY score LIMIT 1)",
+                        (other,),
+                    )
+                    db.execute("INSERT INTO related VALUES (?, ?, ?)", (other, page, score))
+
+    def _remove(self, db, page):
+        db.execute("DELETE FROM vectors WHERE page = ?", (page,))
+        db.execute("DELETE FROM related WHERE page = ? OR other = ?", (page, page))
+
+    # reading it
+
+    def related(self, page):
+        """[{ page, title }] of the pages most like page, closest first"""
+        with self.page_index.connection() as db:
+            return [
+                {"page": other, "title": title}
+                for other, title in db.execute(
+                    """SELECT r.other, p.title FROM related r JOIN pages p ON p.page = r.other
+                       WHERE r.page = ? ORDER BY r.score DESC""",
+                    (page,),
+                )
+            ]
+
+    def is_empty(self):
+        with self.page_index.connection() as db:
+            return db.execute("SELECT 1 FROM vectors LIMIT 1").fetchone() is None
@@ -0,0 +1,206 @@
+# rename.py
+# Moving a page, a file or a whole directory, and rewriting every [[link]]
+# and ![[embed]] to it across the vault.  The pages to rewrite come from
+# the page index's links table, so only those are read, not all 20k.
+#
+# All the writes go in as one batch: the rewritten pages are written to
+# temporary files and synced first, then a journal listing every step is
+# written, then the steps are applied (renames, which don't half happen).
+# A crash before the journal leaves the vault untouched, after it the
+# journal is finished at the next start by recover().
+
+import contextlib
+import json
+import os
+import uuid
+
+from src.markdown_extensions import normalize_page_name
+from src.saving import fsync_directory
+from src.wikilinks import rewrite_links
+
+TEMP_SUFFIX = ".rename-tmp"
+
+
+class RenameError(ValueError):
+    pass
+
+
+def _target(relative_path):
+    """link target of a file under the wiki, pages without .md"""
+    if relative_path.endswith(".md"):
+        return relative_path[: -len(".md")]
+    return relative_path
+
+
+def _directory(page):
+    return page.rpartition("/")[0]
+
+
+def plan_moves(root, old_name, new_name, include_hidden=False):
+    """
+    The files to move for renaming old_name to new_name, both paths under
+    root without .md for pages.  Returns ({ old target: new target },
+    [(old file, new file)]).  Directories move with everything in them.
+    """
+    # new names the way links spell them, so [[links]] to them still work
+    old_name = old_name.strip("/")
+    new_name = normalize_page_name(new_name.strip("/"))
+    if not old_name or not new_name:
+        raise RenameError("Give both the old and the new name.")
+    if old_name == new_name:
+        raise RenameError("The new name is the same as the old one.")
+    if ".." in new_name.split("/") or (
+        not include_hidden and any(part.startswith(".") for part in new_name.split("/"))
+    ):
+        raise RenameError(f"Can't rename to {new_name}.")
+
+    old_path = os.path.join(root, old_name)
+    new_path = os.path.join(root, new_name)
+    if os.path.isfile(old_path + ".md"):
+        old_path, new_path = old_path + ".md", new_path + ".md"
+    elif os.path.isdir(old_path):
+        if (new_name + "/").startswith(old_name + "/"):
+            raise RenameError(f"Can't move {old_name} into itself.")
+    elif not os.path.isfile(old_path):
+        raise RenameError(f"{old_name} doesn't exist.")
+    if os.path.exists(new_path):
+        raise RenameError(f"{new_name} already exists.")
+
+    moves = {}
+    if os.path.isdir(old_path):
+        for current, dirnames, filenames in os.walk(old_path):
+            for file_name in filenames:
+                old_file = os.path.relpath(os.path.join(current, file_name), root)
+                old_file = old_file.replace(os.sep, "/")
+                new_file = new_name + old_file[len(old_name) :]
+                moves[_target(old_file)] = _target(new_file)
+    else:
+        moves[_target(os.path.relpath(old_path, root).replace(os.sep, "/"))] = (
+            _target(os.path.relpath(new_path, root).replace(os.sep, "/"))
+        )
+    return moves, [(old_path, new_path)]
+
+
+def plan_rewrites(root, moves, linking_pages, encoding="utf-8"):
+    """
+    { file path: new text } of the pages whose links change, linking_pages
+    being the ones (from the index) that link to any of the moved targets.
+    The moved pages themselves are looked at too, their relative links
+    mean something else from the new place.
+    """
+    pages = set(linking_pages)
+    pages.update(old for old in moves if os.path.isfile(os.path.join(root, old + ".md")))
+
+    rewrites = {}
+    for page in sorted(pages):
+        file_path = os.path.join(root, page + ".md")
+        try:
+            with open(file_path, "r", encoding=encoding, newline="") as file:
+                text = file.read()
+        except (FileNotFoundError, UnicodeDecodeError):
+            # gone since it was indexed, or not something we should rewrite
+            continue
+        new_page = moves.get(page, page)
+        text, changed = rewrite_links(text, _directory(page), _directory(new_page), moves)
+        if changed:
+            rewrites[file_path] = text
+    return rewrites
+
+
+def _write_synced(path, data, encoding="utf-8"):
+    with open(path, "w", encoding=encoding, newline="") as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def _apply(steps):
+    """replace and move steps, each skipped if it's already been done"""
+    for kind, source, destination in steps:
+        if kind == "replace":
+            if os.path.exists(source):
+                os.replace(source, destination)
+        elif kind == "move":
+            if os.path.exists(source) and not os.path.exists(destination):
+                os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+                os.rename(source, destination)
+                fsync_directory(os.path.dirname(destination) or ".")
+        elif kind == "remove":
+            if os.path.exists(source):
+                os.remove(source)
+
+
+def apply_batch(journal_path, rewrites, file_moves, encoding="utf-8"):
+    """
+    Write rewrites ({ file path: text }, paths before the move) and make
+    file_moves [(old, new)], all of it or, if interrupted, none of it until
+    recover() finishes the job.
+    """
+    batch = uuid.uuid4().hex[:8]
+    temps = [(path, f"{path}.{batch}{TEMP_SUFFIX}") for path in rewrites]
+
+    # the journal first says which temporary files to clean up...
+    _write_synced(
+        journal_path,
+        json.dumps({"state": "prepare", "steps": [["remove", temp, ""] for _, temp in temps]}),
+    )
+    try:
+        for path, temp in temps:
+            _write_synced(temp, rewrites[path], encoding)
+    except BaseException:
+        _apply([("remove", temp, "") for _, temp in temps])
+        os.remove(journal_path)
+        raise
+
+    # ...then, once they're all on disk, what to do with them
+    steps = [("replace", temp, path) for path, temp in temps]
+    steps += [("move", old, new) for old, new in file_moves]
+    _write_synced(journal_path + ".new", json.dumps({"state": "commit", "steps": steps}))
+    os.replace(journal_path + ".new", journal_path)
+    fsync_directory(os.path.dirname(journal_path) or ".")
+
+    _apply(steps)
+    os.remove(journal_path)
+
+
+def recover(journal_path):
+    """finish, or undo, a batch a crash interrupted. True if there was one"""
+    if os.path.exists(journal_path + ".new"):
+        os.remove(journal_path + ".new")
+    try:
+        with open(journal_path, "r", encoding="utf-8") as file:
+            journal = json.load(file)
+    except FileNotFoundError:
+        return False
+    except ValueError:
+        # torn while being written, the temporary files weren't started
+        os.remove(journal_path)
+        return True
+    _apply(journal["steps"])
+    os.remove(journal_path)
+    return True
+
+
+def rename(page_index, root, old_name, new_name, journal_path, encoding="utf-8", locks=None):
+    """
+    Rename old_name to new_name (paths under root, pages without .md) and
+    fix the links to it everywhere.  Returns (moves, rewritten file paths
+    as they are after the move).  With locks (a saving.PageLocks) every
+    page read, rewritten or moved is locked against saves from the read
+    until it's replaced, so a save can't land in between and be lost.
+    """
+    moves, _ = plan_moves(root, old_name, new_name, page_index.include_hidden)
+    linking_pages = page_index.linking_pages(moves)
+    pages = {*linking_pages, *moves, *moves.values()}
+    paths = [os.path.join(root, page + ".md") for page in pages]
+    with locks.file_locks(paths) if locks is not None else contextlib.nullcontext():
+        # again, a save may have made the new name while we waited
+        moves, file_moves = plan_moves(root, old_name, new_name, page_index.include_hidden)
+        rewrites = plan_rewrites(root, moves, linking_pages, encoding)
+        apply_batch(journal_path, rewrites, file_moves, encoding)
+
+    rewritten = []
+    for path in rewrites:
+        page = _target(os.path.relpath(path, root).replace(os.sep, "/"))
+        rewritten.append(os.path.join(root, moves.get(page, page) + ".md"))
+    return moves, rewritten
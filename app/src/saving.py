@@ -0,0 +1,131 @@
+# saving.py
+# Writing pages so that a save is all or nothing, and two saves of one
+# page one after the other, never interleaved.
+#
+# A page is written to a temporary file next to it, synced, then renamed
+# over it: a reader (or Obsidian sync on the same directory) sees the old
+# page or the new one, and a crash leaves the old one.  Saves of a page
+# wait for each other on an asyncio lock within a worker, and on an flock
+# across workers, so the revision checked is still the one written over.
+
+import asyncio
+import contextlib
+import hashlib
+import os
+import time
+import uuid
+import weakref
+
+try:
+    import fcntl
+except ImportError:  # windows, saves are only kept apart within a worker
+    fcntl = None
+
+TEMP_SUFFIX = ".save-tmp"
+
+
+def fsync_directory(path):
+    """make a rename in path stick, where the platform allows"""
+    try:
+        descriptor = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(descriptor)
+    except OSError:
+        pass
+    finally:
+        os.close(descriptor)
+
+
+def write_atomic(path, data):
+    """replace path's contents with data (bytes), all at once"""
+    directory, name = os.path.split(path)
+    temp = os.path.join(directory, f".{name}.{uuid.uuid4().hex[:8]}{TEMP_SUFFIX}")
+    try:
+        with open(temp, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        try:
+            # keep the page's permissions, a new file gets the umask's
+            os.chmod(temp, os.stat(path).st_mode & 0o7777)
+        except FileNotFoundError:
+            pass
+        os.replace(temp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp)
+        raise
+    fsync_directory(directory or ".")
+
+
+def remove_temporary_files(root, older_than=3600):
+    """
+    temporary files a crash left behind, returns how many.  Only old ones,
+    a recent one may be another worker's save in progress.
+    """
+    removed = 0
+    cutoff = time.time() - older_than
+    for current, _, filenames in os.walk(root):
+        for file_name in filenames:
+            if not file_name.endswith(TEMP_SUFFIX):
+                continue
+            path = os.path.join(current, file_name)
+            with contextlib.suppress(OSError):
+                if os.stat(path).st_mtime < cutoff:
+                    os.remove(path)
+                    removed += 1
+    return removed
+
+
+class PageLocks(object):
+    """
+    async with locks.lock(path): one save of path at a time in this worker.
+    with locks.file_lock(path): and across workers, a blocking flock on
+    one of stripes lock files in directory (pages share them by hash).
+    with locks.file_locks(paths): the same for many pages at once.
+    """
+
+    def __init__(self, directory, stripes=64):
+        self.directory = directory
+        self.stripes = stripes
+        # a page's lock lives while someone holds or waits for it
+        self.locks = weakref.WeakValueDictionary()
+        os.makedirs(directory, exist_ok=True)
+
+    def lock(self, path):
+        lock = self.locks.get(path)
+        if lock is None:
+            lock = self.locks[path] = asyncio.Lock()
+        return lock
+
+    def _stripe(self, path):
+        return int(hashlib.sha1(os.path.normpath(path).encode()).hexdigest(), 16) % self.stripes
+
+    @contextlib.contextmanager
+    def _stripe_lock(self, stripe):
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, f"{stripe}.lock"), "a") as file:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+    def file_lock(self, path):
+        return self._stripe_lock(self._stripe(path))
+
+    @contextlib.contextmanager
+    def file_locks(self, paths):
+        """
+        file_lock for every one of paths.  Each stripe is taken once (a
+        second flock of it would wait on the first) and in order, so two
+        of these can't each hold what the other waits for.
+        """
+        with contextlib.ExitStack() as stack:
+            for stripe in sorted({self._stripe(path) for path in paths}):
+                stack.enter_context(self._stripe_lock(stripe))
+            yield
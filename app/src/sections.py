@@ -0,0 +1,93 @@
+# sections.py
+# Editing a page one section at a time, and saving edits as patches.
+#
+# The editor gets a page's revision (a hash of the file as it was read)
+# along with the text, and sends back that revision with only the lines it
+# changed.  A patch against any other revision is refused: the lines it
+# names may not be the lines the editor saw.
+#
+# Lines are the text split on "\n", as a browser's textarea has them, so
+# a page with \r\n endings is patched as if it had \n and written back
+# with \r\n again.
+
+import hashlib
+
+from src.page_index import iter_headings, split_meta
+
+
+class PatchError(ValueError):
+    pass
+
+
+class StaleRevision(PatchError):
+    """the page changed since the editor read it, revision is what it is now"""
+
+    def __init__(self, revision):
+        super().__init__("The page changed since it was opened for editing.")
+        self.revision = revision
+
+
+def revision(data):
+    """a page's revision, from its bytes as they are on disk"""
+    return hashlib.sha256(data).hexdigest()[:24]
+
+
+def split_lines(text):
+    """(lines, True if it had \\r\\n endings)"""
+    crlf = "\r\n" in text
+    if crlf:
+        text = text.replace("\r\n", "\n")
+    return text.split("\n"), crlf
+
+
+def join_lines(lines, crlf=False):
+    return ("\r\n" if crlf else "\n").join(lines)
+
+
+def section_lines(lines, anchor):
+    """
+    (start, end) of the section under the heading with id anchor, its
+    subsections included, end not.  None if there's no such heading.
+    """
+    _, body = split_meta(lines)
+    skip = len(lines) - len(body)
+    start = level = None
+    for number, heading_level, _, heading_id in iter_headings(body):
+        if start is None:
+            if heading_id == anchor:
+                start, level = number, heading_level
+        elif heading_level <= level:
+            return skip + start, skip + number
+    if start is None:
+        return None
+    return skip + start, len(lines)
+
+
+def apply_patch(lines, hunks):
+    """
+    lines with hunks applied, each { start, end, lines } replacing lines
+    start to end (end not included) of the original with its lines.
+    Hunks mustn't overlap, they're applied bottom up so the line numbers
+    all refer to the original.
+    """
+    checked = []
+    for hunk in hunks:
+        try:
+            start, end, new_lines = int(hunk["start"]), int(hunk["end"]), hunk["lines"]
+        except (KeyError, TypeError, ValueError):
+            raise PatchError("A hunk needs start, end and lines.")
+        if not isinstance(new_lines, list) or not all(isinstance(line, str) for line in new_lines):
+            raise PatchError("A hunk's lines should be a list of strings.")
+        if not 0 <= start <= end <= len(lines):
+            raise PatchError(f"Lines {start} to {end} aren't in the page.")
+        checked.append((start, end, [line.replace("\r", "") for line in new_lines]))
+
+    checked.sort(key=lambda hunk: hunk[:2])
+    for previous, following in zip(checked, checked[1:]):
+        if following[0] < previous[1]:
+            raise PatchError("Hunks overlap.")
+
+    lines = list(lines)
+    for start, end, new_lines in reversed(checked):
+        lines[start:end] = new_lines
+    return lines
@@ -0,0 +1,320 @@
+# shared_cache.py
+# A render cache that every uvicorn worker shares through a SQLite file,
+# with a small in-process LRU in front of it.
+#
+# Entries carry a stamp (file mtime, size, generation counters, code
+# fingerprint), a lookup with a different stamp is a miss.  Generation
+# counters live in the same file, so bumping one in any worker
+# invalidates the matching entries in all of them.
+#
+# Entries can also name the files they depend on (the pages a rendered
+# page links to), and invalidate_dependents() drops exactly the entries
+# that depend on a file that was created or deleted.
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from src.metrics import record_cache
+from src.sqlite_store import SQLiteStore
+
+
+def code_fingerprint(paths, extra=()):
+    """
+    Short hash of some source files' mtimes and sizes, plus extra strings.
+    Goes into every stamp, so editing an extension or the config
+    (uvicorn --reload) doesn't serve html rendered by the old code.
+    """
+    digest = hashlib.sha1()
+    for path in sorted(paths):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        digest.update(f"{path}:{stat.st_mtime_ns}:{stat.st_size};".encode())
+    for item in extra:
+        digest.update(str(item).encode())
+    return digest.hexdigest()[:12]
+
+
+class SharedCache(SQLiteStore):
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS cache (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            stamp TEXT NOT NULL,
+            value TEXT NOT NULL,
+            created REAL NOT NULL,
+            PRIMARY KEY (namespace, key)
+        );
+        CREATE INDEX IF NOT EXISTS cache_by_age ON cache (created);
+        CREATE TABLE IF NOT EXISTS generations (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS dependencies (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            target TEXT NOT NULL,
+            PRIMARY KEY (namespace, key, target)
+        );
+        CREATE INDEX IF NOT EXISTS dependencies_by_target ON dependencies (target);
+    """
+
+    def __init__(self, path, max_entries=10000, memory_bytes=64 * 1024 * 1024):
+        super().__init__(path)
+        self.max_entries = max_entries
+        self.memory_bytes = memory_bytes
+        # { (namespace, key): (stamp, value, size) } least recently used first
+        self.memory = OrderedDict()
+        self.memory_used = 0
+        self.memory_lock = threading.Lock()
+        self.memory_generation = None
+        self.sets_since_prune = 0
+
+    # in-process front
+
+    def _remember(self, namespace, key, stamp, value, size):
+        if size > self.memory_bytes // 4:
+            # one huge page shouldn't flush everything else
+            return
+        with self.memory_lock:
+            old = self.memory.pop((namespace, key), None)
+            if old is not None:
+                self.memory_used -= old[2]
+            self.memory[(namespace, key)] = (stamp, value, size)
+            self.memory_used += size
+            while self.memory_used > self.memory_bytes and self.memory:
+                _, (_, _, old_size) = self.memory.popitem(last=False)
+                self.memory_used -= old_size
+
+    def refresh_memory(self):
+        """
+        Drop the in-process copies if any worker invalidated dependents
+        since, their stamps can't tell.  Once per request, like
+        ExistenceIndex.refresh().
+        """
+        generation = self.generation("dependents")
+        if generation != self.memory_generation:
+            with self.memory_lock:
+                self.memory.clear()
+                self.memory_used = 0
+            self.memory_generation = generation
+
+    def _forget(self, namespace, key):
+        with self.memory_lock:
+            old = self.memory.pop((namespace, key), None)
+            if old is not None:
+                self.memory_used -= old[2]
+
+    # entries
+
+    def get(self, namespace, key, stamp):
+        """the cached value, or None if missing or stamped differently"""
+        with self.memory_lock:
+            entry = self.memory.get((namespace, key))
+            if entry is not None and entry[0] == stamp:
+                self.memory.move_to_end((namespace, key))
+                record_cache(namespace, True)
+                return entry[1]
+
+        with self.connection() as db:
+            row = db.execute(
+                "SELECT stamp, value FROM cache WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+        if row is None or row[0] != stamp:
+            record_cache(namespace, False)
+            return None
+        value = json.loads(row[1])
+        self._remember(namespace, key, stamp, value, len(row[1]))
+        record_cache(namespace, True)
+        return value
+
+    def set(self, namespace, key, stamp, value):
+        encoded = json.dumps(value)
+        with self.connection() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)",
+                (namespace, key, stamp, encoded, time.time()),
+            )
+        self._remember(namespace, key, stamp, value, len(encoded))
+        self.sets_since_prune += 1
+        if self.sets_since_prune >= 100:
+            self.sets_since_prune = 0
+            self.prune()
+
+    def delete(self, namespace, key):
+        self._forget(namespace, key)
+        with self.connection() as db:
+            db.execute(
+                "DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key)
+            )
+            db.execute(
+                "DELETE FROM dependencies WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            )
+
+    def clear(self, namespace=None):
+        with self.memory_lock:
+            for memory_key in list(self.memory):
+                if namespace is None or memory_key[0] == namespace:
+                    self.memory_used -= self.memory.pop(memory_key)[2]
+        with self.connection() as db:
+            if namespace is None:
+                db.execute("DELETE FROM cache")
+                db.execute("DELETE FROM dependencies")
+            else:
+                db.execute("DELETE FROM cache WHERE namespace = ?", (namespace,))
+                db.execute("DELETE FROM dependencies WHERE namespace = ?", (namespace,))
+
+    def prune(self):
+        """drop the oldest entries beyond max_entries"""
+        with self.connection() as db:
+            db.execute(
+                """DELETE FROM cache WHERE rowid IN (
+                    SELECT rowid FROM cache ORDER BY created DESC LIMIT -1 OFFSET ?
+                )""",
+                (self.max_entries,),
+            )
+            db.execute(
+                """DELETE FROM dependencies WHERE NOT EXISTS (
+                    SELECT 1 FROM cache c
+                    WHERE c.namespace = dependencies.namespace AND c.key = dependencies.key
+                )"""
+            )
+
+    # dependencies
+
+    def set_dependencies(self, namespace, key, targets):
+        """the files an entry depends on, replacing what it had"""
+        with self.connection() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute(
+                "DELETE FROM dependencies WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            )
+            db.executemany(
+                "INSERT OR IGNORE INTO dependencies VALUES (?, ?, ?)",
+                [(namespace, key, target) for target in targets],
+            )
+
+    def invalidate_dependents(self, targets):
+        """drop every entry that depends on one of targets, returns how many"""
+        targets = list(targets)
+        entries = set()
+        with self.connection() as db:
+            db.execute("BEGIN IMMEDIATE")
+            for start in range(0, len(targets), 500):
+                chunk = targets[start : start + 500]
+                marks = ", ".join("?" * len(chunk))
+                entries.update(
+                    db.execute(
+                        f"SELECT namespace, key FROM dependencies WHERE target IN ({marks})",
+                        chunk,
+                    ).fetchall()
+                )
+            for namespace, key in entries:
+                db.execute(
+                    "DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key)
+                )
+                db.execute(
+                    "DELETE FROM dependencies WHERE namespace = ? AND key = ?",
+                    (namespace, key),
+                )
+        for namespace, key in entries:
+            self._forget(namespace, key)
+        if entries:
+            # other workers may have them in memory
+            generation = self.bump("dependents")
+            if self.memory_generation == generation - 1:
+                # nothing from anyone else in between, ours is current
+                self.memory_generation = generation
+        return len(entries)
+
+    # generation counters
+
+    def generation(self, name):
+        with self.connection() as db:
+            row = db.execute(
+                "SELECT value FROM generations WHERE name = ?", (name,)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, name):
+        """increment a generation counter, visible to every worker"""
+        with self.connection() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute(
+                """INSERT INTO generations VALUES (?, 1)
+                ON CONFLICT(name) DO UPDATE SET value = value + 1""",
+                (name,),
+            )
+            row = db.execute(
+                "SELECT value FROM generations WHERE name = ?", (name,)
+            ).fetchone()
+        return row[0]
+
+
+class ExistenceIndex(object):
+    """
+    Memo of "does this wikilink target exist", dropped whenever the
+    shared "existence" generation changes, i.e. a page was created or
+    deleted by any worker.  refresh() once per request, then lookups
+    are dict hits instead of stat calls.  Cached renders don't go by the
+    generation, they're dropped through their dependencies.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.generation = None
+        self.known = {}
+
+    def refresh(self):
+        generation = self.cache.generation("existence")
+        if generation != self.generation:
+            self.known = {}
+            self.generation = generation
+        return generation
+
+    def lookup(self, key, check):
+        known = self.known
+        if key in known:
+            record_cache("existence", True)
+            return known[key]
+        record_cache("existence", False)
+        result = known[key] = check(key)
+        return result
+
+    def invalidate(self):
+        self.known = {}
+        self.generation = self.cache.bump("existence")
+
+
+def install_highlight_cache(cache, stamp):
+    """
+    Memoize codehilite's pygments output in the shared cache, so the same
+    code block (or jupyter cell) is only highlighted once across workers.
+    Used by page renders that miss the page cache, previews and
+    /api/markdown/code/.
+    """
+    from markdown.extensions.codehilite import CodeHilite
+
+    if getattr(CodeHilite.hilite, "pymdwiki_cached", False):
+        return
+    original = CodeHilite.hilite
+
+    def hilite(self, shebang=True):
+        state = repr(sorted((k, repr(v)) for k, v in vars(self).items()))
+        key = hashlib.sha1(f"{shebang}:{state}".encode()).hexdigest()
+        html = cache.get("highlight", key, stamp)
+        if html is None:
+            html = original(self, shebang)
+            cache.set("highlight", key, stamp, html)
+        return html
+
+    hilite.pymdwiki_cached = True
+    CodeHilite.hilite = hilite
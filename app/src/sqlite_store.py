@@ -0,0 +1,58 @@
+# sqlite_store.py
+# Base for the small SQLite files in STATE_DIRECTORY that uvicorn
+# workers share (kernel registry, render cache).
+
+import os
+import sqlite3
+import threading
+
+
+class SQLiteStore(object):
+    """
+    One connection per thread, WAL mode, and a schema made on first use.
+    Subclasses set SCHEMA.
+    """
+
+    SCHEMA = ""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # sqlite connections can't be shared between threads,
+        # and starlette runs sync code in a thread pool.
+        self.local = threading.local()
+        with self.connection() as db:
+            db.executescript(self.SCHEMA)
+
+    def connection(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            # WAL lets readers carry on while another worker writes
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+        return _Transaction(db)
+
+
+class _Transaction(object):
+    """
+    with store.connection() as db: ...
+    commits on success, rolls back on error, when a transaction was begun.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.db.in_transaction:
+            if exc_type is None:
+                self.db.execute("COMMIT")
+            else:
+                self.db.execute("ROLLBACK")
+        return False
@@ -0,0 +1,142 @@
+# startup.py
+# Where startup time goes.  main.py and lifespan mark their phases on
+# `startup`, and import_time_report() runs `python -X importtime` on a
+# fresh interpreter to break the imports down by package.
+#
+#   cd app && python -m src.startup            # import report
+#   cd app && python -m src.startup --top 40
+
+import os
+import re
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+
+def process_age():
+    """seconds since this process started, None where /proc isn't available"""
+    try:
+        with open("/proc/self/stat") as file:
+            # the command name can have spaces, fields count from after it
+            fields = file.read().rsplit(")", 1)[1].split()
+        with open("/proc/stat") as file:
+            boot_time = next(
+                int(line.split()[1]) for line in file if line.startswith("btime")
+            )
+    except (OSError, IndexError, StopIteration, ValueError):
+        return None
+    started = boot_time + int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    return max(0.0, time.time() - started)
+
+
+class StartupTimer(object):
+    """named phases from the first import of this module until ready()"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.last = self.started
+        # interpreter startup and anything imported before us
+        self.before = process_age()
+        self.phases = []
+        self.total = None
+
+    def mark(self, name):
+        """the time since the previous mark goes to name"""
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self.phases.append((name, now - start))
+            self.last = now
+
+    def ready(self):
+        self.total = time.perf_counter() - self.started
+        summary = ", ".join(f"{name} {seconds * 1000:.0f}" for name, seconds in self.phases)
+        print(f"Started in {self.total * 1000:.0f} ms ({summary})")
+
+    def markdown_table(self):
+        rows = ["Phase | ms", "----- | -----:"]
+        if self.before is not None:
+            rows.append(f"interpreter and earlier imports (~10 ms resolution) | {self.before * 1000:.0f}")
+        for name, seconds in self.phases:
+            rows.append(f"{name} | {seconds * 1000:.1f}")
+        if self.total is not None:
+            rows.append(f"**total** | **{self.total * 1000:.1f}**")
+        return "\n".join(rows) + "\n"
+
+
+startup = StartupTimer()
+
+
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_times(module="main", cwd=None):
+    """
+    [(name, self_us, cumulative_us, depth)] for importing module in a
+    new interpreter, in import order.
+    """
+    env = dict(os.environ)
+    cwd = cwd or os.getcwd()
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [cwd, env.get("PYTHONPATH")]))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd,
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((name, int(self_us), int(cumulative_us), len(indent) // 2))
+    if not rows:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    return rows
+
+
+def import_time_report(module="main", top=25, cwd=None):
+    """markdown: the slowest imports, and self time summed per top level package"""
+    rows = import_times(module, cwd)
+    total = next((row[2] for row in rows if row[0] == module), None)
+
+    packages = {}
+    for name, self_us, cumulative_us, depth in rows:
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + self_us
+
+    lines = []
+    if total is not None:
+        lines.append(f"`import {module}` took {total / 1000:.1f} ms\n")
+    lines.append("Package | self ms, all its modules")
+    lines.append("----- | -----:")
+    for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+        lines.append(f"{package} | {self_us / 1000:.1f}")
+    lines.append("")
+    lines.append("Module | cumulative ms | self ms")
+    lines.append("----- | -----: | -----:")
+    slowest = sorted(rows, key=lambda row: -row[2])
+    for name, self_us, cumulative_us, depth in slowest[:top]:
+        lines.append(f"{name} | {cumulative_us / 1000:.1f} | {self_us / 1000:.1f}")
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="python -X importtime, summarized")
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--top", type=int, default=25)
+    args = parser.parse_args()
+    print(import_time_report(args.module, args.top))
@@ -0,0 +1,75 @@
+# streaming.py
+# Helpers for sending rendered pages as a StreamingResponse instead of
+# building the whole html string (and its encoded copy) in memory first.
+
+import uuid
+
+
+# a placeholder put where the body goes, so everything before it
+# can be sent while the body is still being produced.
+BODY_MARKER = f"<!--pymdwiki-body-{uuid.uuid4().hex}-->"
+
+
+def _sliced(piece, chunk_size):
+    for start in range(0, len(piece), chunk_size):
+        yield piece[start : start + chunk_size]
+
+
+def stream_template(
+    template,
+    doc_data,
+    body_key="document",
+    body_chunks=None,
+    chunk_size=65536,
+    encoding="utf-8",
+):
+    """
+    Render a jinja template with generate() and yield encoded chunks.
+
+    Small pieces from jinja are coalesced up to chunk_size, big ones
+    (the document body) are sliced, so there is never a second full
+    copy of the page in memory.
+
+    If body_chunks is an iterable of strings, doc_data[body_key] is
+    replaced with a placeholder.  Everything before the placeholder is
+    flushed first, then body_chunks is consumed lazily.
+    """
+    if body_chunks is not None:
+        doc_data = dict(doc_data)
+        doc_data[body_key] = BODY_MARKER
+
+    buffer = []
+    buffered = 0
+
+    def flush():
+        nonlocal buffer, buffered
+        data = "".join(buffer).encode(encoding)
+        buffer = []
+        buffered = 0
+        return data
+
+    for piece in template.generate(doc_data):
+        if body_chunks is not None and BODY_MARKER in piece:
+            before, after = piece.split(BODY_MARKER, 1)
+            buffer.append(before)
+            # send the header right away, before the body work starts
+            yield flush()
+            for body_piece in body_chunks:
+                for part in _sliced(body_piece, chunk_size):
+                    yield part.encode(encoding)
+            piece = after
+
+        if len(piece) >= chunk_size:
+            if buffer:
+                yield flush()
+            for part in _sliced(piece, chunk_size):
+                yield part.encode(encoding)
+            continue
+
+        buffer.append(piece)
+        buffered += len(piece)
+        if buffered >= chunk_size:
+            yield flush()
+
+    if buffer:
+        yield flush()
@@ -1,19 +1,38 @@
 import asyncio
 from src.jupyter_client import jupyter_manager
+from src.metrics import registry
 
 
 async def kernel_reaper_loop():
     """
     Runs forever. Checks for stale kernels every 5 minutes.
+    With several workers, only the one holding the reaper lease prunes,
+    the lease outlives a couple of missed checks before another takes over.
     """
     try:
         while True:
-            # Run the prune logic
-            # Set max_age_seconds to 3600 (1 hour)
-            await jupyter_manager.prune_stale_kernels(max_age_seconds=3600)
+            if jupyter_manager.is_reaper(ttl=2 * 300 + 60):
+                # Run the prune logic
+                # Set max_age_seconds to 3600 (1 hour)
+                await jupyter_manager.prune_stale_kernels(max_age_seconds=3600)
 
             # Sleep for 5 minutes before checking again
             await asyncio.sleep(300)
     except asyncio.CancelledError:
         # Handle clean shutdown if needed
+        jupyter_manager.release_reaper()
         print("Reaper task cancelled.")
+
+
+async def metrics_flush_loop():
+    """
+    Runs forever. Writes this worker's metrics to the shared file every
+    flush_interval seconds, so the worker answering /metrics counts them.
+    """
+    try:
+        while True:
+            await asyncio.sleep(registry.flush_interval)
+            await asyncio.to_thread(registry.flush)
+    except asyncio.CancelledError:
+        # what was counted since the last write
+        await asyncio.to_thread(registry.flush)
@@ -0,0 +1,125 @@
+# wikilinks.py
+# [[links]] read straight from the markdown, for the link index and for
+# rewriting them when pages move.  Resolution goes through the same
+# resolve_page_name and normalize_page_name the renderer uses, so a link
+# means the same page here as it does on the rendered page.
+
+import posixpath
+import re
+
+from src.markdown_extensions import (
+    normalize_anchor,
+    normalize_page_name,
+    resolve_page_name,
+)
+
+# [[target]], [[target|text]], [[target#anchor]] and ![[embeds]]
+WIKILINK_RE = re.compile(r"(!?)\[\[([^\]]+)\]\]")
+FENCE_RE = re.compile(r"^[ ]{0,3}(```|~~~)", re.MULTILINE)
+
+
+def _outside_fences(text):
+    """(start, end) of the parts of text that aren't fenced code"""
+    position = 0
+    inside = False
+    for match in FENCE_RE.finditer(text):
+        if not inside:
+            yield position, match.start()
+        else:
+            # the fence line itself belongs to the code
+            position = text.find("\n", match.end())
+            position = len(text) if position < 0 else position
+        inside = not inside
+    if not inside:
+        yield position, len(text)
+
+
+def iter_wikilinks(text):
+    """the [[...]] matches in text, not counting those in fenced code"""
+    for start, end in _outside_fences(text):
+        yield from WIKILINK_RE.finditer(text, start, end)
+
+
+def split_link(inner):
+    """'Page#anchor|text' -> ('Page', '#anchor', '|text')"""
+    target, bar, text = inner.partition("|")
+    target, hash_mark, anchor = target.partition("#")
+    return target, hash_mark + anchor, bar + text
+
+
+def link_target(target, current_path):
+    """
+    The page a link's target means on a page in current_path, as a path
+    under the wiki without .md: "dir/Other_Page".  Files other than pages
+    keep their extension.  "" for links to the page itself, [[#anchor]].
+    """
+    if not target.strip():
+        return ""
+    resolved = normalize_page_name(resolve_page_name(target, current_path))
+    resolved = posixpath.normpath("/" + resolved).lstrip("/")
+    if resolved.endswith(".md"):
+        resolved = resolved[: -len(".md")]
+    return resolved
+
+
+def link_anchors(text, current_path):
+    """
+    (target, anchor) of every page or file linked or embedded from text,
+    anchor the heading id the link goes to, "" for none
+    """
+    links = set()
+    for match in iter_wikilinks(text):
+        target, anchor, _ = split_link(match.group(2))
+        target = link_target(target, current_path)
+        if target:
+            links.add((target, normalize_anchor(anchor[1:]) if anchor else ""))
+    return links
+
+
+def link_targets(text, current_path):
+    """every page or file linked or embedded from text"""
+    return {target for target, _ in link_anchors(text, current_path)}
+
+
+def _relative_link(target, current_path):
+    """how to write a link to target from a page in current_path"""
+    if current_path and target.startswith(current_path + "/"):
+        return target[len(current_path) + 1 :]
+    if not current_path:
+        return target
+    return "/" + target
+
+
+def rewrite_links(text, old_path, new_path, moves):
+    """
+    text of a page that was in directory old_path and is now in new_path
+    (the same unless it moved too), with every link to a page in
+    { old target: new target } moves pointing at the new one.  Links that
+    still mean the same page are left exactly as they were.
+    Returns (text, number of links changed).
+    """
+    pieces = []
+    position = 0
+    changed = 0
+    for match in iter_wikilinks(text):
+        bang, inner = match.group(1), match.group(2)
+        target, anchor, label = split_link(inner)
+        old_target = link_target(target, old_path)
+        if not old_target:
+            continue
+        new_target = moves.get(old_target, old_target)
+        if link_target(target, new_path) == new_target:
+            continue
+
+        if target.strip().endswith(".md") and not new_target.endswith(".md"):
+            new_target += ".md"
+        if target.strip().startswith("/"):
+            written = "/" + new_target
+        else:
+            written = _relative_link(new_target, new_path)
+        pieces.append(text[position : match.start()])
+        pieces.append(f"{bang}[[{written}{anchor}{label}]]")
+        position = match.end()
+        changed += 1
+    pieces.append(text[position:])
+    return "".join(pieces), changed
@@ -0,0 +1,203 @@
+// Quick switcher (Ctrl+K, or / outside a text field) and [[ completion in
+// the editor, both asking /api/complete for the best matching pages.
+(function () {
+    const LIMIT = 10;
+    let controller = null;
+
+    async function fetchPages(query) {
+        // only the latest query's answer matters
+        if (controller) controller.abort();
+        controller = new AbortController();
+        try {
+            const response = await fetch(
+                `/api/complete?q=${encodeURIComponent(query)}&limit=${LIMIT}`,
+                { signal: controller.signal }
+            );
+            return response.ok ? await response.json() : [];
+        } catch (error) {
+            return null;
+        }
+    }
+
+    // a list of pages, one selected, for the arrow keys to move through
+    function makeList() {
+        const list = document.createElement("ul");
+        list.className = "complete-list";
+        list.hidden = true;
+        let pages = [];
+        let selected = 0;
+
+        function draw() {
+            list.replaceChildren(
+                ...pages.map((page, index) => {
+                    const item = document.createElement("li");
+                    item.className = index === selected ? "selected" : "";
+                    const title = document.createElement("span");
+                    title.textContent = page.title;
+                    const path = document.createElement("span");
+                    path.className = "complete-path";
+                    path.textContent = page.page;
+                    item.append(title, path);
+                    item.onmousedown = (event) => {
+                        event.preventDefault();
+                        selected = index;
+                        list.onchoose(page);
+                    };
+                    return item;
+                })
+            );
+            list.hidden = pages.length === 0;
+        }
+
+        list.show = (newPages) => {
+            pages = newPages;
+            selected = 0;
+            draw();
+        };
+        list.close = () => list.show([]);
+        list.isOpen = () => !list.hidden;
+        list.move = (step) => {
+            selected = (selected + step + pages.length) % pages.length;
+            draw();
+        };
+        list.current = () => pages[selected];
+        list.onchoose = () => {};
+        return list;
+    }
+
+    // Ctrl+K: type part of a page's name or title, Enter to go there
+    function makeSwitcher() {
+        const box = document.createElement("div");
+        box.id = "switcher";
+        box.hidden = true;
+        const input = document.createElement("input");
+        input.type = "text";
+        input.placeholder = "Go to page…";
+        input.autocomplete = "off";
+        const list = makeList();
+        box.append(input, list);
+        document.body.append(box);
+
+        const go = (page) => { window.location.href = page.url; };
+        list.onchoose = go;
+
+        let timer = null;
+        input.addEventListener("input", () => {
+            clearTimeout(timer);
+            timer = setTimeout(async () => {
+                const pages = await fetchPages(input.value);
+                if (pages !== null) list.show(pages);
+            }, 50);
+        });
+        input.addEventListener("keydown", (event) => {
+            if (event.key === "ArrowDown" || event.key === "ArrowUp") {
+                event.preventDefault();
+                if (list.isOpen()) list.move(event.key === "ArrowDown" ? 1 : -1);
+            } else if (event.key === "Enter") {
+                event.preventDefault();
+                if (list.isOpen()) go(list.current());
+            } else if (event.key === "Escape") {
+                close();
+            }
+        });
+        input.addEventListener("blur", () => setTimeout(close, 150));
+
+        function open() {
+            box.hidden = false;
+            input.value = "";
+            list.close();
+            input.focus();
+        }
+        function close() {
+            box.hidden = true;
+            list.close();
+        }
+        return { open, isOpen: () => !box.hidden };
+    }
+
+    // [[ in the editor: the pages matching what's typed after it
+    function attachLinkCompletion(textarea, documentName) {
+        const list = makeList();
+        list.classList.add("complete-links");
+        textarea.insertAdjacentElement("afterend", list);
+
+        // links from the page's own directory can leave it out
+        const directory = documentName.replace(/^\/?wiki\//, "").split("/").slice(0, -1).join("/");
+
+        function partial() {
+            const before = textarea.value.slice(0, textarea.selectionStart);
+            const match = before.match(/\[\[([^\[\]\n|#]*)$/);
+            return match ? match[1] : null;
+        }
+
+        list.onchoose = (page) => {
+            const typed = partial();
+            if (typed === null) return list.close();
+            let target = "/" + page.page;
+            if (directory && page.page.startsWith(directory + "/")) {
+                target = page.page.slice(directory.length + 1);
+            } else if (!directory) {
+                target = page.page;
+            }
+            const start = textarea.selectionStart - typed.length;
+            const after = textarea.value.slice(textarea.selectionStart);
+            const close = after.startsWith("]]") ? "" : "]]";
+            textarea.setRangeText(target + close, start, textarea.selectionStart, "end");
+            if (!close) textarea.selectionStart = textarea.selectionEnd = start + target.length + 2;
+            list.close();
+            textarea.focus();
+        };
+
+        let timer = null;
+        textarea.addEventListener("input", () => {
+            clearTimeout(timer);
+            const typed = partial();
+            if (typed === null || typed.trim() === "") return list.close();
+            timer = setTimeout(async () => {
+                const pages = await fetchPages(typed);
+                if (pages !== null && partial() === typed) list.show(pages);
+            }, 50);
+        });
+        textarea.addEventListener("keydown", (event) => {
+            if (!list.isOpen()) return;
+            if (event.key === "ArrowDown" || event.key === "ArrowUp") {
+                event.preventDefault();
+                list.move(event.key === "ArrowDown" ? 1 : -1);
+            } else if (event.key === "Enter" || event.key === "Tab") {
+                event.preventDefault();
+                list.onchoose(list.current());
+            } else if (event.key === "Escape") {
+                event.preventDefault();
+                list.close();
+            }
+        });
+        textarea.addEventListener("blur", () => setTimeout(list.close, 150));
+    }
+
+    document.addEventListener("DOMContentLoaded", () => {
+        const switcher = makeSwitcher();
+        document.addEventListener("keydown", (event) => {
+            const typing = ["INPUT", "TEXTAREA", "SELECT"].includes(document.activeElement.tagName)
+                || document.activeElement.isContentEditable;
+            if ((event.key === "k" && (event.ctrlKey || event.metaKey)) || (event.key === "/" && !typing)) {
+                event.preventDefault();
+                switcher.open();
+            }
+        });
+        // on the document, the header may be swapped for another page's
+        document.addEventListener("click", (event) => {
+            if (event.target.closest("#switcher-open")) {
+                event.preventDefault();
+                switcher.open();
+            }
+        });
+
+        const form = document.querySelector("form[name='edit_document_form']");
+        if (form) {
+            attachLinkCompletion(
+                form.querySelector("textarea[name='markdown']"),
+                form.querySelector("input[name='document_name']").value
+            );
+        }
+    });
+})();
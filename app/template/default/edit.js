@@ -0,0 +1,80 @@
+// Saves from the editor as a patch: only the lines that changed go to
+// /api/save/, with the revision the page was at when it was opened.  If
+// the page changed since, the server says so (409) and nothing is lost,
+// the text stays in the editor.  Without this script the form still
+// posts the whole text to /save/.
+
+// /edit/page#section opens just that section
+if (window.location.hash && !new URLSearchParams(window.location.search).has("section")) {
+    window.location.replace(
+        window.location.pathname + "?section=" + encodeURIComponent(decodeURIComponent(window.location.hash.slice(1)))
+    );
+}
+
+(function () {
+    // one hunk, the lines between what's the same at the start and the end
+    function diffLines(before, after) {
+        const a = before.split("\n");
+        const b = after.split("\n");
+        let start = 0;
+        while (start < a.length && start < b.length && a[start] === b[start]) start++;
+        let same = 0;
+        while (
+            same < a.length - start && same < b.length - start &&
+            a[a.length - 1 - same] === b[b.length - 1 - same]
+        ) same++;
+        if (start === a.length && start === b.length) return [];
+        return [{ start: start, end: a.length - same, lines: b.slice(start, b.length - same) }];
+    }
+
+    function showNotice(form, text) {
+        let notice = document.getElementById("save-notice");
+        if (!notice) {
+            notice = document.createElement("p");
+            notice.id = "save-notice";
+            notice.className = "admonition warning";
+            form.prepend(notice);
+        }
+        notice.textContent = text;
+    }
+
+    document.addEventListener("DOMContentLoaded", () => {
+        const form = document.querySelector("form[name='edit_document_form']");
+        const base = form.querySelector("input[name='base_revision']");
+        if (!base || !base.value) return;  // a new page, saved whole
+        const textarea = form.querySelector("textarea[name='markdown']");
+        const original = textarea.value;
+        const field = (name) => form.querySelector(`input[name='${name}']`);
+        const offset = field("section_start") ? parseInt(field("section_start").value, 10) : 0;
+
+        form.addEventListener("submit", async (event) => {
+            // delete and rename go through the form as before
+            if (event.submitter && event.submitter.name) return;
+            event.preventDefault();
+            const hunks = diffLines(original, textarea.value).map((hunk) => ({
+                start: hunk.start + offset,
+                end: hunk.end + offset,
+                lines: hunk.lines,
+            }));
+            const response = await fetch("/api/save/", {
+                method: "POST",
+                headers: { "Content-Type": "application/json" },
+                body: JSON.stringify({
+                    document_name: field("document_name").value,
+                    base: base.value,
+                    hunks: hunks,
+                }),
+            });
+            const answer = await response.json();
+            if (response.ok) {
+                const section = field("section");
+                window.location.href = answer.url + (section ? "#" + encodeURIComponent(section.value) : "");
+            } else if (response.status === 409) {
+                showNotice(form, "This page was changed by someone else since you opened it, so it wasn't saved. " +
+                    "Copy your changes, then reload the editor to see the new version.");
+            } else {
+                showNotice(form, `Not saved: ${answer.error}`);
+            }
+        });
+    });
+})();
@@ -0,0 +1,59 @@
+// Reloads the page when its markdown file changes on disk,
+// pushed from /ws/live instead of polling.
+(function () {
+    const protocol = window.location.protocol === "https:" ? "wss:" : "ws:";
+    let retryDelay = 1000;
+    let socket = null;
+
+    function keepsState() {
+        // don't throw away jupyter output the user is looking at
+        return Array.from(document.querySelectorAll(".jupyter-output")).some(
+            (output) => output.style.display === "block"
+        );
+    }
+
+    function showNotice(text) {
+        let notice = document.getElementById("live-reload-notice");
+        if (!notice) {
+            notice = document.createElement("p");
+            notice.id = "live-reload-notice";
+            notice.className = "admonition note";
+            document.getElementById("document").prepend(notice);
+        }
+        notice.innerHTML = text;
+    }
+
+    function connect() {
+        const page = encodeURIComponent(window.location.pathname);
+        socket = new WebSocket(`${protocol}//${window.location.host}/ws/live?page=${page}`);
+
+        socket.onopen = () => { retryDelay = 1000; };
+
+        socket.onmessage = (event) => {
+            const message = JSON.parse(event.data);
+            if (message.kind === "deleted") {
+                showNotice('This page was deleted. <a href="/index/">Index</a>');
+            } else if (keepsState()) {
+                showNotice('This page changed. <a href="">Reload</a>');
+            } else {
+                window.location.reload();
+            }
+        };
+
+        socket.onclose = () => {
+            // server restarted or the page went away, try again later
+            setTimeout(connect, retryDelay);
+            retryDelay = Math.min(retryDelay * 2, 30000);
+        };
+    }
+
+    // the router showed another page, watch that one instead
+    document.addEventListener("pymdwiki:navigated", () => {
+        socket.onclose = null;
+        socket.close();
+        retryDelay = 1000;
+        connect();
+    });
+
+    connect();
+})();
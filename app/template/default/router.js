@@ -0,0 +1,117 @@
+// Follows links to wiki pages without reloading the whole page: the new
+// page's header, table of contents and content come from /api/page/ and
+// are swapped in, everything else (css, scripts) stays.  A link is
+// fetched as soon as it's hovered, so by the click it's usually there.
+// Anything the router can't show (attachments, missing pages, pages
+// needing jupyter, or KaTeX when this page didn't load it) is a normal
+// page load.
+(function () {
+    const KEEP_PREFETCHED = 30000;
+    const HOVER_DELAY = 65;
+    const fetched = new Map();
+    let shown = window.location.pathname;
+
+    // /wiki/ links on this site, the page they're for, else null
+    function pageOf(link) {
+        if (!link || link.target || link.hasAttribute("download")) return null;
+        const url = new URL(link.href, window.location.href);
+        if (url.origin !== window.location.origin || !url.pathname.startsWith("/wiki/")) return null;
+        return url;
+    }
+
+    function fetchPage(url) {
+        const key = url.pathname;
+        const known = fetched.get(key);
+        if (known && Date.now() - known.time < KEEP_PREFETCHED) return known.promise;
+        const promise = fetch("/api/page/" + key.slice("/wiki/".length))
+            .then((response) => (response.ok ? response.json() : null))
+            .catch(() => null);
+        fetched.set(key, { promise: promise, time: Date.now() });
+        return promise;
+    }
+
+    function canShow(page) {
+        if (!page || page.has_jupyter) return false;
+        return !page.has_latex || typeof window.renderMathInElement === "function";
+    }
+
+    // scripts set with innerHTML don't run, these are put back so they do
+    function runScripts(element) {
+        for (const old of element.querySelectorAll("script")) {
+            const script = document.createElement("script");
+            script.textContent = old.textContent;
+            old.replaceWith(script);
+        }
+    }
+
+    function show(url, page) {
+        document.title = page.title;
+        const header = document.getElementById("document_header");
+        if (header) header.outerHTML = page.header;
+        const toc = document.getElementById("toc");
+        if (toc) toc.innerHTML = page.toc;
+        const content = document.getElementById("document");
+        content.innerHTML = page.document;
+        runScripts(content);
+        if (page.has_latex) {
+            window.renderMathInElement(content, {
+                delimiters: [
+                    { left: "\\(", right: "\\)", display: false },
+                    { left: "\\[", right: "\\]", display: true },
+                ],
+                throwOnError: false,
+            });
+        }
+        const target = url.hash && document.getElementById(decodeURIComponent(url.hash.slice(1)));
+        if (target) target.scrollIntoView();
+        else window.scrollTo(0, 0);
+        document.dispatchEvent(new CustomEvent("pymdwiki:navigated", { detail: { url: url.href } }));
+    }
+
+    let latest = 0;
+
+    async function go(url, push) {
+        const ticket = ++latest;
+        const page = await fetchPage(url);
+        if (ticket !== latest) return;  // another link was clicked meanwhile
+        if (!canShow(page)) {
+            window.location.href = url.href;
+            return;
+        }
+        if (push) history.pushState({ router: true }, "", url.href);
+        shown = url.pathname;
+        show(url, page);
+    }
+
+    document.addEventListener("click", (event) => {
+        if (event.defaultPrevented || event.button !== 0) return;
+        if (event.ctrlKey || event.metaKey || event.shiftKey || event.altKey) return;
+        const link = event.target.closest("a[href]");
+        const url = pageOf(link);
+        if (!url) return;
+        if (url.pathname === window.location.pathname && url.hash) return;  // same page, let it scroll
+        event.preventDefault();
+        go(url, true);
+    });
+
+    // hovering a link a moment fetches it
+    let hoverTimer = null;
+    document.addEventListener("mouseover", (event) => {
+        const url = pageOf(event.target.closest && event.target.closest("a[href]"));
+        if (!url || url.pathname === window.location.pathname) return;
+        clearTimeout(hoverTimer);
+        hoverTimer = setTimeout(() => fetchPage(url), HOVER_DELAY);
+    });
+    document.addEventListener("mouseout", () => clearTimeout(hoverTimer));
+    document.addEventListener("touchstart", (event) => {
+        const url = pageOf(event.target.closest && event.target.closest("a[href]"));
+        if (url) fetchPage(url);
+    }, { passive: true });
+
+    // back and forward between pages the router showed
+    history.replaceState({ router: true }, "", window.location.href);
+    window.addEventListener("popstate", (event) => {
+        if (!event.state || !event.state.router || window.location.pathname === shown) return;
+        go(new URL(window.location.href), false);
+    });
+})();
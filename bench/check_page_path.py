@@ -0,0 +1,191 @@
+# check_page_path.py
+# Differential check of src/page_path.py against the dict-returning
+# parse_url_path and parse_file_path it replaced, copied here verbatim.
+# Random and vault-like paths are fed to both, any difference is printed.
+#
+#   python bench/check_page_path.py --count 200000
+
+import argparse
+import os
+import random
+import sys
+from urllib.parse import unquote
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from harness import APP_DIR
+
+sys.path.insert(0, APP_DIR)
+
+from config import DEFAULT_WIKI_PAGE
+from src.page_path import parse_file_path, parse_url_path
+
+# as copied, plus "rename": /rename/ came after the rewrite and is meant
+# to be reserved in both, the parsers must still agree on it
+RESERVED_PATHS = ["wiki", "edit", "save", "delete", "rename", "index"]
+
+
+def old_parse_url_path(path):
+    """helper to break url into some commonly used components"""
+    path = unquote(path)
+    while ".." in path:
+        path = path.replace("..", "")
+    while "\\" in path:
+        path = path.replace("\\", "/")
+    while "//" in path:
+        path = path.replace("//", "/")
+    path_split = path.split("/")
+    path_split = [each for each in path_split if each]
+
+    if path_split and path_split[0] in RESERVED_PATHS:
+        path_split.pop(0)
+
+    if path_split:
+        file_name = path_split.pop()
+        if len(path_split) == 0:
+            path_split = [""]
+        file_name_parts = file_name.split(".")
+        if len(file_name_parts) > 1:
+            if file_name_parts[0]:
+                file_ext = file_name_parts.pop()
+                file_name_no_ext = file_name[: -1 - len(file_ext)]
+            else:
+                # could be .hidden.md  ['', 'hidden', 'md']
+                # or .hidden  ['', 'hidden']
+                if len(file_name_parts) == 2:
+                    file_ext = ""
+                    file_name_no_ext = file_name
+                else:
+                    file_ext = file_name_parts.pop()
+                    file_name_no_ext = ".".join(file_name_parts)
+        else:
+            file_ext = ""
+            file_name_no_ext = file_name
+    else:
+        path_split = [""]
+        file_name = DEFAULT_WIKI_PAGE
+        file_ext = ""
+        file_name_no_ext = DEFAULT_WIKI_PAGE
+
+    response = {
+        "path": "/".join(path_split),
+        "path_list": path_split,
+        "file_name": file_name,
+        "file_ext": file_ext,
+        "file_name_no_ext": file_name_no_ext,
+    }
+    return response
+
+
+def old_parse_file_path(path, remove_reserved=True):
+    """helper to break path into some commonly used components"""
+    path = unquote(path)
+    while ".." in path:
+        path = path.replace("..", "")
+    while "\\" in path:
+        path = path.replace("\\", "/")
+    while "//" in path:
+        path = path.replace("//", "/")
+    path_split = path.split("/")
+    path_split = [each for each in path_split if each]
+    is_md = False
+
+    if remove_reserved and path_split and path_split[0] in RESERVED_PATHS:
+        path_split.pop(0)
+
+    if path_split:
+        file_name = path_split.pop()
+        if len(path_split) == 0:
+            path_split = [""]
+        file_name_parts = file_name.split(".")
+        if len(file_name_parts) > 1:
+            file_ext = file_name_parts.pop()
+            file_name_no_ext = file_name[: -1 - len(file_ext)]
+        else:
+            file_ext = ""
+            file_name_no_ext = file_name
+
+        if file_ext == "md":
+            is_md = True
+            path_split.append(file_name_no_ext)
+
+        if not path_split[0]:
+            path_split.pop(0)
+    else:
+        path_split = [""]
+        file_name = DEFAULT_WIKI_PAGE
+        file_ext = ""
+        file_name_no_ext = DEFAULT_WIKI_PAGE
+
+    response = {
+        "path": "/".join(path_split),
+        "path_list": path_split,
+        "file_name": file_name,
+        "file_ext": file_ext,
+        "file_name_no_ext": file_name_no_ext,
+        "is_md": is_md,
+    }
+    return response
+
+
+PIECES = [
+    "a", "Page", "page name", "dir", "wiki", "edit", "index", "save", "delete",
+    "rename", "template", "md", "png", "x.y", "é", "日本", "%20", "%2F", "%2e", "%2E%2E",
+    "%5C", ".", "..", "...", "/", "//", "\\", ".hidden", "a.b.c", "", " ",
+]
+EXTENSIONS = ["", ".md", ".png", ".jpg", ".canvas", ".tar.gz", ".", ".md.md"]
+
+
+def random_path(rng):
+    pieces = [rng.choice(PIECES) for _ in range(rng.randint(0, 7))]
+    separators = [rng.choice(["/", "/", "/", "\\", "//", "", "%2F"]) for _ in pieces]
+    path = "".join(piece + separator for piece, separator in zip(pieces, separators))
+    if rng.random() < 0.5:
+        path = "/" + path
+    return path + rng.choice(EXTENSIONS)
+
+
+def vault_path(rng):
+    depth = rng.randint(0, 4)
+    directories = [rng.choice(["notes", "Projects", "2024", ".obsidian", "a b"]) for _ in range(depth)]
+    name = rng.choice(["Home", "Some Page", "README", ".hidden", "img_1"])
+    return "/".join(["wiki", *directories, name + rng.choice(EXTENSIONS)])
+
+
+def differences(path):
+    found = []
+    old = old_parse_url_path(path)
+    new = parse_url_path(path).as_dict()
+    del new["is_md"]
+    if old != new:
+        found.append(("parse_url_path", path, old, new))
+    for remove_reserved in (True, False):
+        old = old_parse_file_path(path, remove_reserved)
+        new = parse_file_path(path, remove_reserved).as_dict()
+        if old != new:
+            found.append((f"parse_file_path({remove_reserved})", path, old, new))
+    return found
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="PagePath against the old parsers")
+    parser.add_argument("--count", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    failures = []
+    for n in range(args.count):
+        path = random_path(rng) if n % 2 else vault_path(rng)
+        failures.extend(differences(path))
+        # again, from the cache this time
+        failures.extend(differences(path))
+
+    for name, path, old, new in failures[:20]:
+        print(f"{name} {path!r}\n  old {old}\n  new {new}")
+    print(f"{args.count} paths, {len(failures)} differences")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main_cli()
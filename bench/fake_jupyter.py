@@ -0,0 +1,228 @@
+# fake_jupyter.py
+# A stand-in for jupyter-server, just enough of the REST api and the
+# kernel channels websocket for AsyncJupyterManager to talk to.
+# Replies are scripted, nothing is executed.
+#
+#   python bench/fake_jupyter.py --port 8888 --latency 0.05
+#   JUPYTER_HOST=http://127.0.0.1:8888 uvicorn main:app
+
+import argparse
+import asyncio
+import json
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route, WebSocketRoute
+from starlette.websockets import WebSocketDisconnect
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+class FakeJupyter(object):
+    """
+    latency       seconds to wait before the first reply to an execute_request
+    spawn_latency seconds to wait before answering POST /api/kernels
+    stream_messages  number of "stream" messages per execution
+    message_delay    seconds between those messages
+    payload_bytes    size of the text in each stream message
+    display_data     also send a display_data message with a small png
+    """
+
+    def __init__(
+        self,
+        latency=0.0,
+        spawn_latency=0.0,
+        stream_messages=3,
+        message_delay=0.0,
+        payload_bytes=64,
+        display_data=True,
+    ):
+        self.latency = latency
+        self.spawn_latency = spawn_latency
+        self.stream_messages = stream_messages
+        self.message_delay = message_delay
+        self.payload_bytes = payload_bytes
+        self.display_data = display_data
+        self.kernels = {}
+        self.executions = 0
+
+        self.app = Starlette(
+            routes=[
+                Route("/api/kernels", self.list_kernels, methods=["GET"]),
+                Route("/api/kernels", self.start_kernel, methods=["POST"]),
+                Route("/api/kernels/{kernel_id}", self.get_kernel, methods=["GET"]),
+                Route(
+                    "/api/kernels/{kernel_id}", self.delete_kernel, methods=["DELETE"]
+                ),
+                WebSocketRoute("/api/kernels/{kernel_id}/channels", self.channels),
+            ]
+        )
+
+    def _kernel_model(self, kernel_id):
+        return self.kernels[kernel_id]
+
+    async def list_kernels(self, request):
+        return JSONResponse(list(self.kernels.values()))
+
+    async def start_kernel(self, request):
+        if self.spawn_latency:
+            await asyncio.sleep(self.spawn_latency)
+        kernel_id = str(uuid.uuid4())
+        self.kernels[kernel_id] = {
+            "id": kernel_id,
+            "name": "python3",
+            "last_activity": _now(),
+            "execution_state": "idle",
+            "connections": 0,
+        }
+        return JSONResponse(self.kernels[kernel_id], status_code=201)
+
+    async def get_kernel(self, request):
+        kernel_id = request.path_params["kernel_id"]
+        if kernel_id not in self.kernels:
+            return JSONResponse({"message": "not found"}, status_code=404)
+        return JSONResponse(self.kernels[kernel_id])
+
+    async def delete_kernel(self, request):
+        self.kernels.pop(request.path_params["kernel_id"], None)
+        return Response(status_code=204)
+
+    def _message(self, parent, msg_type, content):
+        return {
+            "header": {
+                "msg_id": uuid.uuid4().hex,
+                "msg_type": msg_type,
+                "session": parent["header"].get("session", ""),
+                "date": _now(),
+            },
+            "parent_header": parent["header"],
+            "msg_type": msg_type,
+            "metadata": {},
+            "content": content,
+            "channel": "iopub",
+        }
+
+    async def channels(self, websocket):
+        kernel_id = websocket.path_params["kernel_id"]
+        if kernel_id not in self.kernels:
+            await websocket.close(code=1008)
+            return
+        await websocket.accept()
+        kernel = self.kernels[kernel_id]
+        kernel["connections"] += 1
+        try:
+            while True:
+                request = json.loads(await websocket.receive_text())
+                if request["header"].get("msg_type") != "execute_request":
+                    continue
+                self.executions += 1
+                kernel["execution_state"] = "busy"
+                kernel["last_activity"] = _now()
+
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+
+                async def send(msg_type, content):
+                    await websocket.send_text(
+                        json.dumps(self._message(request, msg_type, content))
+                    )
+                    if self.message_delay:
+                        await asyncio.sleep(self.message_delay)
+
+                await send("status", {"execution_state": "busy"})
+                # some noise from another request, the client should ignore it
+                await websocket.send_text(
+                    json.dumps(
+                        self._message(
+                            {"header": {"msg_id": "someone-else"}},
+                            "stream",
+                            {"name": "stdout", "text": "not yours\n"},
+                        )
+                    )
+                )
+                for n in range(self.stream_messages):
+                    text = f"line {n} " + "x" * max(0, self.payload_bytes - 8) + "\n"
+                    await send("stream", {"name": "stdout", "text": text})
+                if self.display_data:
+                    await send(
+                        "display_data",
+                        {
+                            "data": {
+                                "image/png": "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg=="
+                            },
+                            "metadata": {},
+                        },
+                    )
+                await send(
+                    "execute_result",
+                    {"data": {"text/plain": "42"}, "execution_count": self.executions},
+                )
+                await send("status", {"execution_state": "idle"})
+                kernel["execution_state"] = "idle"
+                kernel["last_activity"] = _now()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            kernel["connections"] -= 1
+
+
+class BackgroundServer(object):
+    """Runs an ASGI app with uvicorn in a thread, for in-process tests."""
+
+    def __init__(self, app, host="127.0.0.1", port=0, **uvicorn_options):
+        config = uvicorn.Config(
+            app, host=host, port=port, log_level="warning", **uvicorn_options
+        )
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def port(self):
+        return self.server.servers[0].sockets[0].getsockname()[1]
+
+    def start(self, timeout=10):
+        self.thread.start()
+        deadline = time.monotonic() + timeout
+        while not self.server.started:
+            if time.monotonic() > deadline or not self.thread.is_alive():
+                raise RuntimeError("server did not start")
+            time.sleep(0.01)
+        return self
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake jupyter-server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--spawn-latency", type=float, default=0.0)
+    parser.add_argument("--stream-messages", type=int, default=3)
+    parser.add_argument("--message-delay", type=float, default=0.0)
+    parser.add_argument("--payload-bytes", type=int, default=64)
+    args = parser.parse_args()
+
+    fake = FakeJupyter(
+        latency=args.latency,
+        spawn_latency=args.spawn_latency,
+        stream_messages=args.stream_messages,
+        message_delay=args.message_delay,
+        payload_bytes=args.payload_bytes,
+    )
+    uvicorn.run(fake.app, host=args.host, port=args.port)
@@ -0,0 +1,151 @@
+# harness.py
+# Runs the wiki app in-process against a generated vault.
+
+import contextlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(REPO_ROOT, "app")
+
+
+@contextlib.contextmanager
+def app_workdir(keep=None):
+    """
+    A working directory laid out the way main.py expects it,
+    template/ and favicon.ico copied from app/, and an empty wiki/.
+    main.py uses paths relative to the current directory, so we chdir into it.
+    """
+    workdir = keep or tempfile.mkdtemp(prefix="pymdwiki_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    template = os.path.join(workdir, "template")
+    if not os.path.exists(template):
+        shutil.copytree(
+            os.path.join(APP_DIR, "template"),
+            template,
+            ignore=shutil.ignore_patterns("*.gz", "*.br"),
+        )
+    shutil.copy(os.path.join(APP_DIR, "favicon.ico"), workdir)
+    os.makedirs(os.path.join(workdir, "wiki"), exist_ok=True)
+
+    old_cwd = os.getcwd()
+    os.chdir(workdir)
+    if APP_DIR not in sys.path:
+        sys.path.insert(0, APP_DIR)
+    try:
+        yield workdir
+    finally:
+        os.chdir(old_cwd)
+        if keep is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    """the app prints a lot while rendering, keep it out of the results"""
+    if not enabled:
+        yield
+        return
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def summarize(samples):
+    """timing statistics in seconds for a list of samples"""
+    ordered = sorted(samples)
+    p95_index = min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))
+    mean = statistics.fmean(ordered)
+    return {
+        "n": len(ordered),
+        "min": ordered[0],
+        "median": statistics.median(ordered),
+        "mean": mean,
+        "p95": ordered[p95_index],
+        "max": ordered[-1],
+        "stdev": statistics.stdev(ordered) if len(ordered) > 1 else 0.0,
+        "ops_per_second": 1.0 / mean if mean else 0.0,
+    }
+
+
+def measure(function, repeat=20, warmup=2, inner=1):
+    """
+    Time function() repeat times after warmup calls.  With inner > 1,
+    each sample is the mean of inner calls, for very fast functions.
+    """
+    for _ in range(warmup):
+        function()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(inner):
+            function()
+        samples.append((time.perf_counter() - start) / inner)
+    return summarize(samples)
+
+
+def environment_info():
+    commit = ""
+    dirty = False
+    with contextlib.suppress(Exception):
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        dirty = bool(
+            subprocess.run(
+                ["git", "status", "--porcelain", "--untracked-files=no"],
+                cwd=REPO_ROOT,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.strip()
+        )
+    return {
+        "commit": commit,
+        "dirty": dirty,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def write_results(results, output):
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2, sort_keys=True)
+
+
+def compare_results(old, new, threshold=0.10, key="median"):
+    """
+    Compare two result files benchmark by benchmark.
+    Returns (lines, regressions), a regression is anything slower than
+    old by more than threshold (0.10 is 10%).
+    """
+    lines = [f"{'benchmark':40} {'old':>12} {'new':>12} {'change':>8}"]
+    regressions = []
+    for name, new_stats in sorted(new["benchmarks"].items()):
+        old_stats = old["benchmarks"].get(name)
+        if old_stats is None:
+            lines.append(f"{name:40} {'-':>12} {new_stats[key]:>12.6f} {'new':>8}")
+            continue
+        change = (new_stats[key] - old_stats[key]) / old_stats[key] if old_stats[key] else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  SLOWER"
+            regressions.append(name)
+        elif change < -threshold:
+            flag = "  faster"
+        lines.append(
+            f"{name:40} {old_stats[key]:>12.6f} {new_stats[key]:>12.6f} {change:>+8.1%}{flag}"
+        )
+    return lines, regressions
@@ -0,0 +1,148 @@
+# load_test.py
+# Drives concurrent /ws/run_jupyter clients against the wiki app, with the
+# fake jupyter server standing in for the real one.  Both run in this process.
+#
+#   python bench/load_test.py --clients 50 --runs 10 --pages 10 --latency 0.02
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import websockets
+
+from fake_jupyter import BackgroundServer, FakeJupyter
+from harness import app_workdir, environment_info, quiet, write_results
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_client(url, client_number, runs, pages, results):
+    for run_number in range(runs):
+        page_id = f"/wiki/load/page_{(client_number + run_number) % pages}"
+        start = time.perf_counter()
+        first_message = None
+        received = 0
+        try:
+            async with websockets.connect(url) as ws:
+                await ws.send(
+                    json.dumps({"page_id": page_id, "code": f"print({run_number})"})
+                )
+                async for message in ws:
+                    if first_message is None:
+                        first_message = time.perf_counter() - start
+                    received += len(message)
+                    if "System Error" in message:
+                        raise RuntimeError(message)
+        except Exception as e:
+            results["errors"].append(str(e))
+            continue
+        results["latencies"].append(time.perf_counter() - start)
+        results["first_message"].append(first_message or 0.0)
+        results["bytes"] += received
+
+
+async def drive(url, clients, runs, pages):
+    results = {"latencies": [], "first_message": [], "errors": [], "bytes": 0}
+    start = time.perf_counter()
+    await asyncio.gather(
+        *[run_client(url, n, runs, pages, results) for n in range(clients)]
+    )
+    results["elapsed"] = time.perf_counter() - start
+    return results
+
+
+def summarize(results):
+    latencies = sorted(results["latencies"])
+    first = sorted(results["first_message"])
+    completed = len(latencies)
+    return {
+        "completed": completed,
+        "errors": len(results["errors"]),
+        "elapsed": results["elapsed"],
+        "throughput_per_second": completed / results["elapsed"] if results["elapsed"] else 0,
+        "latency_p50": percentile(latencies, 0.50),
+        "latency_p90": percentile(latencies, 0.90),
+        "latency_p99": percentile(latencies, 0.99),
+        "latency_max": latencies[-1] if latencies else 0.0,
+        "first_message_p50": percentile(first, 0.50),
+        "first_message_p99": percentile(first, 0.99),
+        "bytes_received": results["bytes"],
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Load test /ws/run_jupyter")
+    parser.add_argument("--clients", type=int, default=20, help="concurrent clients")
+    parser.add_argument("--runs", type=int, default=10, help="executions per client")
+    parser.add_argument("--pages", type=int, default=5, help="distinct pages (kernels)")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--spawn-latency", type=float, default=0.0)
+    parser.add_argument("--stream-messages", type=int, default=3)
+    parser.add_argument("--message-delay", type=float, default=0.0)
+    parser.add_argument("--payload-bytes", type=int, default=64)
+    parser.add_argument(
+        "--target",
+        help="ws url of an already running wiki, skips starting one here",
+    )
+    parser.add_argument("--output", help="write results to this json file")
+    parser.add_argument("--verbose", action="store_true", help="show app output")
+    args = parser.parse_args()
+
+    fake = FakeJupyter(
+        latency=args.latency,
+        spawn_latency=args.spawn_latency,
+        stream_messages=args.stream_messages,
+        message_delay=args.message_delay,
+        payload_bytes=args.payload_bytes,
+    )
+
+    if args.target:
+        raw = asyncio.run(drive(args.target, args.clients, args.runs, args.pages))
+    else:
+        with BackgroundServer(fake.app) as jupyter_server, app_workdir():
+            # config.py reads this when main is imported
+            os.environ["JUPYTER_HOST"] = f"http://127.0.0.1:{jupyter_server.port}"
+            with quiet(not args.verbose):
+                import main
+
+                with BackgroundServer(main.app) as wiki_server:
+                    url = f"ws://127.0.0.1:{wiki_server.port}/ws/run_jupyter"
+                    raw = asyncio.run(drive(url, args.clients, args.runs, args.pages))
+
+    summary = summarize(raw)
+    if not args.target:
+        # a --target wiki talks to its own jupyter, the fake saw nothing
+        summary["executions_seen_by_fake"] = fake.executions
+        summary["kernels_started"] = len(fake.kernels)
+
+    for key, value in summary.items():
+        if isinstance(value, float):
+            print(f"{key:28} {value:12.4f}")
+        else:
+            print(f"{key:28} {value:12}")
+    if raw["errors"]:
+        print("First error:", raw["errors"][0])
+
+    if args.output:
+        write_results(
+            {
+                "environment": environment_info(),
+                "settings": vars(args),
+                "results": summary,
+            },
+            args.output,
+        )
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,217 @@
+# run_benchmarks.py
+# Benchmarks the wiki against a synthetic vault, in-process.
+#
+#   python bench/run_benchmarks.py --pages 500 --output bench/results/new.json
+#   python bench/run_benchmarks.py --compare bench/results/old.json
+#
+# Results are JSON, --compare prints the change per benchmark and exits
+# with status 1 if anything got slower than --threshold.
+
+import argparse
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from harness import (
+    app_workdir,
+    compare_results,
+    environment_info,
+    measure,
+    quiet,
+    write_results,
+)
+from vault_generator import add_vault_arguments, generate_vault, vault_settings
+
+
+def run(args):
+    results = {
+        "environment": environment_info(),
+        "vault": vault_settings(args),
+        "benchmarks": {},
+    }
+    benchmarks = results["benchmarks"]
+    rng = random.Random(args.seed)
+
+    with app_workdir(keep=args.workdir) as workdir:
+        vault = generate_vault(os.path.join(workdir, "wiki"), **vault_settings(args))
+        sample_pages = rng.sample(vault["pages"], min(args.sample, len(vault["pages"])))
+
+        with quiet(not args.verbose):
+            import main
+            from starlette.testclient import TestClient
+
+            urls = [f"/wiki/{page}" for page in vault["pages"]]
+            links = [
+                f"/{page}" for page in vault["pages"]
+            ] + [f"/missing_{n}" for n in range(len(vault["pages"]) // 10)]
+
+            def parse_all():
+                for url in urls:
+                    main.parse_url_path(url)
+
+            def check_all():
+                for link in links:
+                    main.wikilink_page_check(link)
+
+            page_files = [
+                os.path.join(workdir, "wiki", *page.split("/")) + ".md"
+                for page in vault["pages"]
+            ]
+
+            def headers_all():
+                # cold, read from the files every time
+                main.page_header.__globals__["_page_header"].cache_clear()
+                for file_path in page_files:
+                    main.page_header(file_path)
+
+            with TestClient(main.app) as client:
+                # the index is built in the background, finish it first
+                main.page_index.sync()
+                page_cycle = iter(())
+
+                def view_one():
+                    nonlocal page_cycle
+                    page = next(page_cycle, None)
+                    if page is None:
+                        page_cycle = iter(sample_pages)
+                        page = next(page_cycle)
+                    response = client.get(f"/wiki/{page}")
+                    assert response.status_code == 200, (page, response.status_code)
+
+                fragment_cycle = iter(())
+
+                def view_fragment():
+                    # what the template's router fetches instead
+                    nonlocal fragment_cycle
+                    page = next(fragment_cycle, None)
+                    if page is None:
+                        fragment_cycle = iter(sample_pages)
+                        page = next(fragment_cycle)
+                    response = client.get(f"/api/page/{page}")
+                    assert response.status_code == 200, (page, response.status_code)
+
+                def index():
+                    response = client.get("/index/")
+                    assert response.status_code == 200
+
+                preview_source = open(
+                    os.path.join(workdir, "wiki", sample_pages[0] + ".md"),
+                    encoding="utf-8",
+                ).read()
+
+                def preview():
+                    response = client.post(
+                        "/api/markdown/",
+                        data={"markdown": preview_source, "document_name": sample_pages[0]},
+                    )
+                    assert response.status_code == 200
+
+                save_counter = [0]
+
+                def save():
+                    save_counter[0] += 1
+                    response = client.post(
+                        "/save/",
+                        data={
+                            "markdown": preview_source + f"\n\nsave {save_counter[0]}\n",
+                            "document_name": f"bench_saves/page_{save_counter[0] % 50}",
+                        },
+                        follow_redirects=False,
+                    )
+                    assert response.status_code in (200, 303, 307), response.status_code
+
+                # back and forth, rewriting every page that links to it
+                renamed_page = sample_pages[-1]
+                rename_names = [renamed_page, renamed_page + "_renamed"]
+
+                def rename_page():
+                    old_name, new_name = rename_names
+                    response = client.post(
+                        "/rename/",
+                        data={"document_name": old_name, "new_name": new_name},
+                        follow_redirects=False,
+                    )
+                    assert response.status_code == 303, response.status_code
+                    rename_names.reverse()
+
+                # pieces of page names as typed, a misspelt one among them
+                queries = [page.rpartition("/")[2][:n] for page in sample_pages for n in (2, 4, 7)]
+                queries += [query[:-2] + query[-1] + query[-2] for query in queries if len(query) > 5]
+
+                def complete_pages():
+                    for query in queries:
+                        main.page_completer.complete(query)
+
+                plan = [
+                    ("parse_url_path", parse_all, len(urls)),
+                    ("wikilink_page_check", check_all, len(links)),
+                    ("page_header", headers_all, len(page_files)),
+                    ("page_index_summaries", main.page_index.summaries, 1),
+                    ("view_document", view_one, 1),
+                    ("view_fragment", view_fragment, 1),
+                    ("index_document", index, 1),
+                    ("markdown_convert_preview", preview, 1),
+                    ("save_document", save, 1),
+                    ("rename_page", rename_page, 1),
+                    ("complete_pages", complete_pages, len(queries)),
+                ]
+                for name, function, per_call in plan:
+                    if args.only and name not in args.only:
+                        continue
+                    repeat = args.index_repeat if name == "index_document" else args.repeat
+                    stats = measure(function, repeat=repeat, warmup=args.warmup)
+                    if per_call > 1:
+                        # report per item, not per batch
+                        for field in ["min", "median", "mean", "p95", "max", "stdev"]:
+                            stats[field] /= per_call
+                        stats["ops_per_second"] *= per_call
+                        stats["items_per_sample"] = per_call
+                    benchmarks[name] = stats
+
+    return results
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="pymdwiki benchmarks")
+    add_vault_arguments(parser)
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--index-repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--sample", type=int, default=30, help="pages to render")
+    parser.add_argument("--only", nargs="*", help="run only these benchmarks")
+    parser.add_argument("--output", help="write results to this json file")
+    parser.add_argument("--compare", help="json results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10)
+    parser.add_argument("--workdir", help="keep the generated vault here")
+    parser.add_argument("--verbose", action="store_true", help="show app output")
+    args = parser.parse_args()
+
+    results = run(args)
+
+    if args.output:
+        write_results(results, args.output)
+        print(f"Results written to {args.output}")
+
+    for name, stats in results["benchmarks"].items():
+        print(
+            f"{name:28} median {stats['median'] * 1000:10.3f} ms"
+            f"   p95 {stats['p95'] * 1000:10.3f} ms   {stats['ops_per_second']:10.1f}/s"
+        )
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            old = json.load(file)
+        if old.get("vault") != results["vault"]:
+            print("Warning: the vault settings differ from the compared run.")
+        lines, regressions = compare_results(old, results, threshold=args.threshold)
+        print("\n".join(lines))
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
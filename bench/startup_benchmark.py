@@ -0,0 +1,158 @@
+# startup_benchmark.py
+# How long the wiki takes to start: a bare interpreter, `import main`,
+# and uvicorn from launch to the first page served.  Every sample is a
+# new process, nothing is shared between them.
+#
+#   python bench/startup_benchmark.py --repeat 10 --output bench/results/startup.json
+#   python bench/startup_benchmark.py --compare bench/results/startup.json
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from harness import (
+    APP_DIR,
+    app_workdir,
+    compare_results,
+    environment_info,
+    summarize,
+    write_results,
+)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def app_env():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [APP_DIR, env.get("PYTHONPATH")]))
+    return env
+
+
+def time_command(command, workdir):
+    start = time.perf_counter()
+    subprocess.run(
+        command,
+        cwd=workdir,
+        env=app_env(),
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - start
+
+
+def time_first_response(workdir, page, timeout=60):
+    """launch uvicorn, poll until page is served, then stop it"""
+    port = free_port()
+    url = f"http://127.0.0.1:{port}/wiki/{page}"
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port)],
+        cwd=workdir,
+        env=app_env(),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(url, timeout=5) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                pass
+            if server.poll() is not None:
+                raise RuntimeError("uvicorn exited during startup")
+            time.sleep(0.005)
+        raise RuntimeError(f"no response from {url} after {timeout}s")
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def run(args):
+    results = {
+        "environment": environment_info(),
+        "settings": {"cold": not args.warm_cache},
+        "benchmarks": {},
+    }
+    plan = {
+        "python_baseline": lambda workdir: time_command(
+            [sys.executable, "-c", "pass"], workdir
+        ),
+        "import_main": lambda workdir: time_command(
+            [sys.executable, "-c", "import main"], workdir
+        ),
+        "first_response": lambda workdir: time_first_response(workdir, "Home"),
+    }
+
+    with app_workdir(keep=args.workdir) as workdir:
+        with open(os.path.join(workdir, "wiki", "Home.md"), "w", encoding="utf-8") as file:
+            file.write("# Home\n\nSome *text*, a [[Link]] and code\n\n```python\nprint(1)\n```\n")
+
+        for name, function in plan.items():
+            if args.only and name not in args.only:
+                continue
+            samples = []
+            for _ in range(args.warmup + args.repeat):
+                if not args.warm_cache:
+                    # no render cache or kernel registry left by the last run
+                    shutil.rmtree(os.path.join(workdir, ".state"), ignore_errors=True)
+                samples.append(function(workdir))
+            results["benchmarks"][name] = summarize(samples[args.warmup :])
+
+    return results
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="pymdwiki startup time")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--only", nargs="*", help="run only these benchmarks")
+    parser.add_argument(
+        "--warm-cache",
+        action="store_true",
+        help="keep app/.state between runs, so the first page is a cache hit",
+    )
+    parser.add_argument("--output", help="write results to this json file")
+    parser.add_argument("--compare", help="json results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10)
+    parser.add_argument("--workdir", help="run in this directory and keep it")
+    args = parser.parse_args()
+
+    results = run(args)
+
+    if args.output:
+        write_results(results, args.output)
+        print(f"Results written to {args.output}")
+
+    for name, stats in results["benchmarks"].items():
+        print(
+            f"{name:20} median {stats['median'] * 1000:8.1f} ms"
+            f"   min {stats['min'] * 1000:8.1f} ms   max {stats['max'] * 1000:8.1f} ms"
+        )
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            old = json.load(file)
+        lines, regressions = compare_results(old, results, threshold=args.threshold)
+        print("\n".join(lines))
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,171 @@
+# stress_saves.py
+# Concurrency stress test for saving pages.  Several worker processes,
+# each with a few threads, keep adding a line of their own to the same
+# page, the way an editor does: open it, change it, save it with the
+# revision it opened, and on a 409 open it again and retry.  Half the
+# saves are patches to /api/save/, half whole pages posted to /save/.
+# Meanwhile the page is read over and over to catch it half written.
+#
+# At the end every line added must be in the page exactly once, or an
+# update was lost.  --no-precondition saves whole pages without their
+# revision, to show the test does catch lost updates.
+#
+#   python bench/stress_saves.py --processes 4 --threads 4 --saves 25
+
+import argparse
+import html
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from harness import app_workdir, quiet
+
+PAGE = "stress/page"
+FIRST_LINE = "# Stress"
+
+TEXTAREA = re.compile(r"<textarea[^>]*>\n(.*?)</textarea>", re.S)
+REVISION = re.compile(r'name="base_revision" value="(\w*)"')
+
+
+def open_editor(client):
+    response = client.get(f"/edit/{PAGE}")
+    assert response.status_code == 200, response.status_code
+    text = html.unescape(TEXTAREA.search(response.text).group(1))
+    return text, REVISION.search(response.text).group(1)
+
+
+def add_line(client, line, patch, precondition):
+    """add line to the page, retrying on conflicts. Returns the number of 409s"""
+    conflicts = 0
+    while True:
+        text, revision = open_editor(client)
+        lines = text.split("\n")
+        if patch:
+            # before the empty string after the last \n
+            response = client.post(
+                "/api/save/",
+                json={
+                    "document_name": PAGE,
+                    "base": revision,
+                    "hunks": [{"start": len(lines) - 1, "end": len(lines) - 1, "lines": [line]}],
+                },
+            )
+        else:
+            data = {"markdown": "\n".join(lines[:-1] + [line, ""]), "document_name": PAGE}
+            if precondition:
+                data["base_revision"] = revision
+            response = client.post("/save/", data=data, follow_redirects=False)
+        if response.status_code == 409:
+            conflicts += 1
+            continue
+        assert response.status_code in (200, 303, 307), response.status_code
+        return conflicts
+
+
+def worker(workdir, number, threads, saves, precondition, results):
+    os.chdir(workdir)
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+    conflicts = []
+    try:
+        with quiet():
+            import main
+            from starlette.testclient import TestClient
+
+            # one event loop for all the threads, like a uvicorn worker
+            with TestClient(main.app) as client:
+
+                def run(thread):
+                    count = 0
+                    for save in range(saves):
+                        patch = precondition and (save + thread) % 2 == 0
+                        line = f"line {number}-{thread}-{save}"
+                        count += add_line(client, line, patch, precondition)
+                    conflicts.append(count)
+
+                pool = [threading.Thread(target=run, args=(thread,)) for thread in range(threads)]
+                for each in pool:
+                    each.start()
+                for each in pool:
+                    each.join()
+    finally:
+        # a worker that died still answers, its lines will be missing
+        results.put(sum(conflicts))
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="concurrent saves of one page")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--saves", type=int, default=25, help="lines added per thread")
+    parser.add_argument("--no-precondition", action="store_true", help="save without the revision")
+    parser.add_argument("--workdir", help="keep the vault here")
+    args = parser.parse_args()
+    precondition = not args.no_precondition
+
+    with app_workdir(keep=args.workdir) as workdir:
+        page_file = os.path.join(workdir, "wiki", *PAGE.split("/")) + ".md"
+        os.makedirs(os.path.dirname(page_file), exist_ok=True)
+        with open(page_file, "w", encoding="utf-8") as file:
+            file.write(FIRST_LINE + "\n")
+
+        # read it all along, it must never be seen half written
+        torn = []
+        stop = threading.Event()
+
+        def read_page():
+            while not stop.is_set():
+                with open(page_file, "r", encoding="utf-8") as file:
+                    text = file.read()
+                if not text.startswith(FIRST_LINE) or not text.endswith("\n"):
+                    torn.append(text)
+
+        reader = threading.Thread(target=read_page)
+        reader.start()
+
+        context = multiprocessing.get_context("spawn")
+        results = context.Queue()
+        start = time.perf_counter()
+        processes = [
+            context.Process(
+                target=worker,
+                args=(workdir, number, args.threads, args.saves, precondition, results),
+            )
+            for number in range(args.processes)
+        ]
+        for process in processes:
+            process.start()
+        conflicts = sum(results.get() for _ in processes)
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+        stop.set()
+        reader.join()
+
+        with open(page_file, "r", encoding="utf-8") as file:
+            lines = file.read().split("\n")
+
+    expected = {
+        f"line {number}-{thread}-{save}"
+        for number in range(args.processes)
+        for thread in range(args.threads)
+        for save in range(args.saves)
+    }
+    found = [line for line in lines if line.startswith("line ")]
+    lost = expected - set(found)
+    doubled = len(found) - len(set(found))
+    print(
+        f"{len(expected)} saves by {args.processes} processes x {args.threads} threads"
+        f" in {elapsed:.1f}s, {conflicts} conflicts retried"
+    )
+    print(f"lost updates: {len(lost)}, duplicated: {doubled}, torn reads: {len(torn)}")
+    if lost or doubled or torn:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,234 @@
+# vault_generator.py
+# Builds a synthetic wiki vault for benchmarks and load tests.
+# The same seed and settings always give the same vault.
+
+import argparse
+import os
+import random
+import struct
+import zlib
+
+
+WORDS = (
+    "alpha beta gamma delta kernel notebook vault page link index render "
+    "markdown python matrix vector signal noise sample result method theory "
+    "experiment data table figure summary note draft review idea project"
+).split()
+
+PYTHON_SNIPPETS = [
+    "import math\nprint(math.sqrt(2))",
+    "values = [x * x for x in range(10)]\nprint(sum(values))",
+    "def f(n):\n    return n if n < 2 else f(n - 1) + f(n - 2)\n\nprint(f(15))",
+]
+
+MATH_SNIPPETS = [
+    "$E = mc^2$",
+    "$\\alpha + \\beta = \\gamma$",
+    "\\(\\sum_{i=0}^{n} i = \\frac{n(n+1)}{2}\\)",
+]
+
+MATH_BLOCKS = [
+    "$$\n\\int_0^\\infty e^{-x^2} dx = \\frac{\\sqrt{\\pi}}{2}\n$$",
+    "\\[\n\\nabla \\cdot \\mathbf{E} = \\frac{\\rho}{\\varepsilon_0}\n\\]",
+]
+
+
+def png_bytes(width, height, rgb=(200, 120, 40)):
+    """a small valid png of a single colour"""
+    row = b"\x00" + bytes(rgb) * width
+    raw = row * height
+
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(raw))
+        + chunk(b"IEND", b"")
+    )
+
+
+def _sentence(rng, length=12):
+    words = [rng.choice(WORDS) for _ in range(length)]
+    words[0] = words[0].capitalize()
+    return " ".join(words) + "."
+
+
+def _directories(rng, depth, count):
+    """a list of relative directories, '' is the vault root"""
+    directories = [""]
+    for n in range(count):
+        levels = rng.randint(1, max(1, depth))
+        parts = [f"{rng.choice(WORDS)}_{n % 7}_{level}" for level in range(levels)]
+        directories.append("/".join(parts))
+    return directories
+
+
+def generate_vault(
+    root,
+    pages=200,
+    depth=3,
+    directories=20,
+    links_per_page=8,
+    missing_link_ratio=0.1,
+    sections_per_page=6,
+    math_ratio=0.3,
+    code_ratio=0.3,
+    jupyter_ratio=0.1,
+    images=20,
+    image_ratio=0.2,
+    seed=0,
+):
+    """
+    Write a vault of markdown pages under root.
+    Returns a dict describing what was written, page names are
+    the url paths used by /wiki/ (no .md).
+    """
+    rng = random.Random(seed)
+    os.makedirs(root, exist_ok=True)
+
+    dirs = _directories(rng, depth, directories)
+    page_names = []
+    for n in range(pages):
+        directory = rng.choice(dirs)
+        name = f"{rng.choice(WORDS)}_page_{n}"
+        page_names.append(f"{directory}/{name}" if directory else name)
+
+    image_names = []
+    for n in range(images):
+        directory = rng.choice(dirs)
+        name = f"image_{n}.png"
+        image_names.append(f"{directory}/{name}" if directory else name)
+        os.makedirs(os.path.join(root, directory), exist_ok=True)
+        width, height = rng.choice([(64, 48), (320, 240), (800, 600)])
+        with open(os.path.join(root, directory, name), "wb") as file:
+            file.write(png_bytes(width, height))
+
+    for page_name in page_names:
+        lines = [
+            f"Title: {page_name.split('/')[-1]}",
+            f"Summary: {_sentence(rng, 8)}",
+            "Authors: bench",
+            "Date: 2024-01-01 00:00:00+00:00",
+            f"Keywords: {rng.choice(WORDS)}, {rng.choice(WORDS)}",
+            "",
+            f"# {page_name.split('/')[-1].replace('_', ' ')}",
+            "",
+        ]
+
+        for section in range(sections_per_page):
+            lines.append(f"## Section {section} {rng.choice(WORDS)}")
+            lines.append("")
+            paragraph = [_sentence(rng) for _ in range(3)]
+
+            for _ in range(max(0, links_per_page // sections_per_page) + 1):
+                if rng.random() < missing_link_ratio:
+                    target = f"missing_{rng.randint(0, 10**6)}"
+                else:
+                    target = rng.choice(page_names)
+                style = rng.random()
+                if style < 0.5:
+                    link = f"[[/{target}]]"
+                elif style < 0.7:
+                    link = f"[[/{target}|{rng.choice(WORDS)}]]"
+                elif style < 0.9:
+                    link = f"[[/{target}#Section {rng.randint(0, sections_per_page)}]]"
+                else:
+                    # relative, resolved against the current directory
+                    link = f"[[{target.split('/')[-1]}]]"
+                paragraph.insert(rng.randint(0, len(paragraph)), link)
+
+            if rng.random() < math_ratio:
+                paragraph.append(rng.choice(MATH_SNIPPETS))
+            lines.append(" ".join(paragraph))
+            lines.append("")
+
+            if rng.random() < math_ratio:
+                lines.append(rng.choice(MATH_BLOCKS))
+                lines.append("")
+            if rng.random() < code_ratio:
+                lines.append("```python")
+                lines.append(rng.choice(PYTHON_SNIPPETS))
+                lines.append("```")
+                lines.append("")
+            if rng.random() < jupyter_ratio:
+                lines.append("```jupyter")
+                lines.append(rng.choice(PYTHON_SNIPPETS))
+                lines.append("```")
+                lines.append("")
+            if image_names and rng.random() < image_ratio:
+                lines.append(f"![[/wiki/{rng.choice(image_names)}]]")
+                lines.append("")
+
+        directory, _, name = page_name.rpartition("/")
+        os.makedirs(os.path.join(root, directory), exist_ok=True)
+        with open(
+            os.path.join(root, directory, name + ".md"), "w", encoding="utf-8"
+        ) as file:
+            file.write("\n".join(lines))
+
+    return {
+        "root": root,
+        "pages": page_names,
+        "images": image_names,
+        "directories": dirs,
+        "settings": {
+            "pages": pages,
+            "depth": depth,
+            "directories": directories,
+            "links_per_page": links_per_page,
+            "missing_link_ratio": missing_link_ratio,
+            "sections_per_page": sections_per_page,
+            "math_ratio": math_ratio,
+            "code_ratio": code_ratio,
+            "jupyter_ratio": jupyter_ratio,
+            "images": images,
+            "image_ratio": image_ratio,
+            "seed": seed,
+        },
+    }
+
+
+def add_vault_arguments(parser):
+    """the generate_vault settings as command line options"""
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--directories", type=int, default=20)
+    parser.add_argument("--links-per-page", type=int, default=8)
+    parser.add_argument("--missing-link-ratio", type=float, default=0.1)
+    parser.add_argument("--sections-per-page", type=int, default=6)
+    parser.add_argument("--math-ratio", type=float, default=0.3)
+    parser.add_argument("--code-ratio", type=float, default=0.3)
+    parser.add_argument("--jupyter-ratio", type=float, default=0.1)
+    parser.add_argument("--images", type=int, default=20)
+    parser.add_argument("--image-ratio", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def vault_settings(args):
+    return {
+        "pages": args.pages,
+        "depth": args.depth,
+        "directories": args.directories,
+        "links_per_page": args.links_per_page,
+        "missing_link_ratio": args.missing_link_ratio,
+        "sections_per_page": args.sections_per_page,
+        "math_ratio": args.math_ratio,
+        "code_ratio": args.code_ratio,
+        "jupyter_ratio": args.jupyter_ratio,
+        "images": args.images,
+        "image_ratio": args.image_ratio,
+        "seed": args.seed,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic wiki vault.")
+    parser.add_argument("root", help="directory to write the vault into")
+    add_vault_arguments(parser)
+    args = parser.parse_args()
+    vault = generate_vault(args.root, **vault_settings(args))
+    print(f"Wrote {len(vault['pages'])} pages and {len(vault['images'])} images to {args.root}")
@@ -0,0 +1,9 @@
+set -a 
+source .env 2>/dev/null || echo ".env file not found, using defaults"
+set +a
+
+PORT="${PORT:-8000}"
+WORKERS="${WORKERS:-4}"
+
+cd app
+PYMDWIKI_DEBUG=0 uv run uvicorn main:app --host 0.0.0.0 --port "$PORT" --workers "$WORKERS"